@@ -0,0 +1,193 @@
+import math
+import time
+import heapq
+import asyncio
+import itertools
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+
+# Priority lanes, most urgent first. Within a bulkhead a freed slot always
+# goes to the waiter in the most urgent lane (FIFO within a lane), and a
+# full queue makes room for an urgent request by shedding the least urgent
+# waiter.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_BACKGROUND = 2
+LANE_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BATCH: "batch", PRIORITY_BACKGROUND: "background"}
+
+
+class Overloaded(RuntimeError):
+    """A bulkhead shed the request; retry_after is a suggested wait in seconds."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Slot:
+    """One admitted unit of work; released when the `async with` block exits.
+
+    hold() hands the release over to a coroutine that may outlive the block
+    (a generation that keeps running after its request was answered stale).
+    """
+
+    def __init__(self, bulkhead: "Bulkhead"):
+        self.bulkhead = bulkhead
+        self.held = False
+        self._start = time.perf_counter()
+
+    def hold(self, awaitable: Awaitable[Any]) -> Awaitable[Any]:
+        self.held = True
+        return self._hold(awaitable)
+
+    async def _hold(self, awaitable: Awaitable[Any]) -> Any:
+        try:
+            return await awaitable
+        finally:
+            self.release()
+
+    def release(self):
+        self.bulkhead.release(time.perf_counter() - self._start)
+
+
+class _SlotContext:
+    def __init__(self, bulkhead: "Bulkhead", priority: int):
+        self.bulkhead = bulkhead
+        self.priority = priority
+        self.slot: Optional[Slot] = None
+
+    async def __aenter__(self) -> Slot:
+        await self.bulkhead.acquire(self.priority)
+        self.slot = Slot(self.bulkhead)
+        return self.slot
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if not self.slot.held:
+            self.slot.release()
+
+
+class Bulkhead:
+    """Concurrency limit with a bounded, prioritised wait queue for one endpoint.
+
+    At most max_concurrent requests run at once and at most max_queue wait.
+    A request that finds the queue full, waits longer than queue_timeout or
+    is pushed out by a more urgent one gets Overloaded, whose retry_after
+    is estimated from the queue depth and the recent time a slot is held.
+    Runs on the event loop; not thread-safe.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        # Exponentially weighted averages, seconds
+        self.avg_hold_time: Optional[float] = None
+        self.avg_queue_wait = 0.0
+        self.stats = {
+            "admitted": 0,
+            "queued": 0,
+            "shed_queue_full": 0,
+            "shed_timeout": 0,
+            "shed_preempted": 0,
+            "max_queue_depth": 0,
+        }
+        self.lane_stats = {lane: {"admitted": 0, "shed": 0} for lane in LANE_NAMES}
+
+    def slot(self, priority: int = PRIORITY_INTERACTIVE) -> _SlotContext:
+        """`async with bulkhead.slot(priority) as slot:` waits for a slot or raises Overloaded."""
+        return _SlotContext(self, priority)
+
+    def retry_after(self) -> int:
+        """Seconds until a new request would likely be admitted."""
+        hold = self.avg_hold_time if self.avg_hold_time is not None else 5.0
+        return max(1, min(60, math.ceil((len(self._waiters) + 1) * hold / self.max_concurrent)))
+
+    def _shed(self, reason: str, priority: int) -> Overloaded:
+        self.stats[reason] += 1
+        self.lane_stats.setdefault(priority, {"admitted": 0, "shed": 0})["shed"] += 1
+        return Overloaded(f"{self.name} is overloaded", self.retry_after())
+
+    def _admitted(self, priority: int, waited: float):
+        self.stats["admitted"] += 1
+        self.lane_stats.setdefault(priority, {"admitted": 0, "shed": 0})["admitted"] += 1
+        self.avg_queue_wait = 0.9 * self.avg_queue_wait + 0.1 * waited
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE):
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self._admitted(priority, 0.0)
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            # Push out the least urgent, most recent waiter if this request outranks it
+            victim = max(self._waiters) if self._waiters else None
+            if victim is None or victim[0] <= priority:
+                raise self._shed("shed_queue_full", priority)
+            self._waiters.remove(victim)
+            heapq.heapify(self._waiters)
+            victim[2].set_exception(self._shed("shed_preempted", victim[0]))
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), future)
+        heapq.heappush(self._waiters, entry)
+        self.stats["queued"] += 1
+        self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], len(self._waiters))
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not self._granted(future):
+                self._withdraw(entry)
+                raise self._shed("shed_timeout", priority)
+        except asyncio.CancelledError:
+            # Client went away while queued; hand on a slot it was just given
+            if self._granted(future):
+                self.release()
+            else:
+                self._withdraw(entry)
+            raise
+        self._admitted(priority, time.perf_counter() - start)
+
+    @staticmethod
+    def _granted(future: asyncio.Future) -> bool:
+        return future.done() and not future.cancelled() and future.exception() is None
+
+    def _withdraw(self, entry: Tuple[int, int, asyncio.Future]):
+        if entry in self._waiters:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+        if not entry[2].done():
+            entry[2].cancel()
+
+    def release(self, held_for: Optional[float] = None):
+        """Free a slot; it passes straight to the most urgent waiter, if any."""
+        if held_for is not None:
+            self.avg_hold_time = held_for if self.avg_hold_time is None else 0.9 * self.avg_hold_time + 0.1 * held_for
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def get_stats(self) -> Dict:
+        queued_by_lane = {name: 0 for name in LANE_NAMES.values()}
+        for priority, _, _ in self._waiters:
+            name = LANE_NAMES.get(priority, str(priority))
+            queued_by_lane[name] = queued_by_lane.get(name, 0) + 1
+        return {
+            **self.stats,
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "queue_depth": len(self._waiters),
+            "queue_depth_by_lane": queued_by_lane,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "avg_hold_time": self.avg_hold_time,
+            "avg_queue_wait": self.avg_queue_wait,
+            "retry_after": self.retry_after(),
+            "lanes": {LANE_NAMES.get(lane, str(lane)): counts for lane, counts in self.lane_stats.items()},
+        }
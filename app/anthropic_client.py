@@ -1,25 +1,86 @@
 import os
 import asyncio
 import time
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 import anthropic
 from anthropic import AsyncAnthropic
 from rag.smart_cache import SmartCache
+from rag.query_canonicalizer import EDUCATIONAL_PREFIX
+from app.pipeline_metrics import PipelineRecord
+from app.output_budget import OutputBudget, complete_with_continuation
+from app.model_router import RouteDecision
+from app.stand_in_llm import StandInAnthropic
+from app.code_edits import EditApplyError, apply_edit_blocks, parse_edit_blocks
+from app.js_gate import JavaScriptGate, JSGateResult
+
+# Used when the caller does not pass a routing decision
+DEFAULT_MODEL = "claude-sonnet-4-20250514"
+FALLBACK_MODEL = "claude-3-5-sonnet-20241022"
+
+# Ceiling for a single generation; adaptive budgets never exceed it
+MAX_OUTPUT_TOKENS = 4096
+
+# The response is prefilled up to the opening fence so that generation stops
+# at the closing fence instead of running on into explanation text.
+CODE_PREFILL = "CODE:\n```javascript"
+CODE_STOP_SEQUENCES = ["\n```"]
+
+# Short system prompt for follow-up edits. The code being edited already
+# follows the full generation rules, so only the environment constraints
+# are restated here.
+REFINE_SYSTEM_PROMPT = """You edit existing Three.js code for a pre-configured educational execution environment.
+
+ENVIRONMENT RULES (the existing code already follows them; keep it that way):
+- scene, camera, renderer, controls and THREE (with all addons) already exist. Never recreate them.
+- No DOM manipulation, no window access, no event listeners, no imports, no IIFE wrappers.
+- Never call requestAnimationFrame, renderer.render() or animate(). The code must end with `return animate;` if it animates.
+- UI controls: clearControls(), showControls(), addSlider(label, min, max, defaultValue, callback, step), addDropdown(label, optionsArray, callback).
+- Declare and initialise variables before use. Dispose geometries and materials of objects you remove.
+
+Make the smallest change that fulfils the request. Reply ONLY with one or more edit blocks in exactly this format:
+
+<<<<<<< SEARCH
+exact lines copied from the current code
+=======
+replacement lines
+>>>>>>> REPLACE
+
+The SEARCH text must match the current code exactly and be unique. Use an empty SEARCH section to add new code; it is inserted before the final `return animate;`. Do not include explanations."""
+
+REFINE_REWRITE_INSTRUCTION = (
+    "Your edit could not be applied ({error}). Instead, return the complete updated code "
+    "in a single ```javascript block."
+)
+
+SYNTAX_REPAIR_INSTRUCTION = (
+    "This code does not parse as JavaScript ({error}). Fix the syntax error without changing "
+    "what the code does and return the complete corrected code in a single ```javascript block."
+)
 
 class AnthropicClient:
-    def __init__(self):
-        api_key = os.getenv("ANTHROPIC_API_KEY")
-        if not api_key:
-            raise ValueError("ANTHROPIC_API_KEY environment variable not set")
+    def __init__(self, client=None):
+        # LLM_BACKEND=stand-in swaps in a local fake for offline runs
+        if client is None and os.getenv("LLM_BACKEND", "").lower() == "stand-in":
+            client = StandInAnthropic()
         
-        self.client = AsyncAnthropic(api_key=api_key)
+        if client is None:
+            api_key = os.getenv("ANTHROPIC_API_KEY")
+            if not api_key:
+                raise ValueError("ANTHROPIC_API_KEY environment variable not set")
+            client = AsyncAnthropic(api_key=api_key)
+        
+        self.client = client
+        self.output_budget = OutputBudget(default_tokens=MAX_OUTPUT_TOKENS, min_tokens=1024)
+        self.js_gate = JavaScriptGate()
         print("Using Claude Sonnet 5 model")
     
     async def generate_threejs_code(
         self, 
         prompt: str, 
         context: Optional[str] = None,
-        temperature: float = 0.4
+        temperature: float = 0.4,
+        record: Optional[PipelineRecord] = None,
+        route: Optional[RouteDecision] = None
     ) -> Dict[str, str]:
         system_prompt = """You are an expert educational Three.js developer creating STEM visualizations for a pre-configured execution environment.
 
@@ -329,8 +390,8 @@ FINAL CHECKLIST:
 ✅ Proper object cleanup in update functions
 ✅ Helper functions (createVector, createParticle, plotFunction) defined before use"""
         
-        # Add educational context to reduce safety filter triggers
-        educational_prefix = "Create an educational Three.js visualization for learning purposes. "
+        # Add educational context to reduce safety filter triggers (cache keys ignore it)
+        educational_prefix = EDUCATIONAL_PREFIX
         
         full_prompt = f"{system_prompt}\n\n"
         if context:
@@ -342,40 +403,232 @@ FINAL CHECKLIST:
         print(f"DEBUG: Prompt being sent to Claude: {prompt[:100]}...")
         print(f"DEBUG: Full prompt length: {len(full_prompt)} characters")
         
+        max_tokens = self.output_budget.suggest(prompt)
+        model = route.model if route else DEFAULT_MODEL
+        fallback_model = route.fallback_model if route else FALLBACK_MODEL
+        if route and route.max_tokens:
+            max_tokens = min(max_tokens, route.max_tokens)
+        print(f"DEBUG: Requesting max_tokens={max_tokens}")
+        
+        role = "primary"
         try:
-            response = await self.client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=4096,
+            text, stop_reason, output_tokens = await complete_with_continuation(
+                self.client,
+                [{"role": "user", "content": full_prompt}],
+                max_tokens,
+                record=record,
+                prefill=CODE_PREFILL,
+                continuation_tokens=MAX_OUTPUT_TOKENS,
+                model=model,
                 temperature=temperature,
-                messages=[
-                    {"role": "user", "content": full_prompt}
-                ]
+                stop_sequences=CODE_STOP_SEQUENCES
             )
         except Exception as e:
             # If blocked, try with more conservative temperature
             print(f"First attempt failed: {e}")
-            response = await self.client.messages.create(
-                model="claude-3-5-sonnet-20241022",
-                max_tokens=4096,
+            role, model = "fallback", fallback_model
+            text, stop_reason, output_tokens = await complete_with_continuation(
+                self.client,
+                [{"role": "user", "content": full_prompt}],
+                max_tokens,
+                record=record,
+                role="fallback",
+                prefill=CODE_PREFILL,
+                continuation_tokens=MAX_OUTPUT_TOKENS,
+                model=fallback_model,
                 temperature=0.3,
-                messages=[
-                    {"role": "user", "content": full_prompt}
-                ]
+                stop_sequences=CODE_STOP_SEQUENCES
             )
         
-        # Extract the response text
-        text = response.content[0].text
+        # Only complete answers tell us how long similar prompts need
+        if stop_reason != "max_tokens":
+            self.output_budget.observe(prompt, output_tokens)
+        
+        post_start = time.perf_counter()
         
         # Extract code more reliably
         code = self._extract_code(text)
         
-        # Validate and fix common issues
-        code = self._validate_and_fix_code(code)
+        if record is not None:
+            record.add_stage("post_processing", time.perf_counter() - post_start)
+        
+        # Parse-check and fix common issues
+        code = await self._gate_code(
+            code, [{"role": "user", "content": full_prompt}], model, role, record
+        )
         
         return {
             "code": code
         }
     
+    async def refine_threejs_code(
+        self,
+        previous_code: str,
+        instruction: str,
+        context: Optional[str] = None,
+        temperature: float = 0.3,
+        record: Optional[PipelineRecord] = None,
+        route: Optional[RouteDecision] = None
+    ) -> Dict[str, str]:
+        """Apply a change request to previously generated code as a targeted edit."""
+        user_prompt = f"CURRENT CODE:\n```javascript\n{previous_code}\n```\n\n"
+        if context:
+            user_prompt += f"REFERENCE EXAMPLE:\n{context}\n\n"
+        user_prompt += f"Change request: {instruction}"
+        
+        print(f"DEBUG: Refining code ({len(previous_code)} chars) with: {instruction[:100]}...")
+        
+        messages = [{"role": "user", "content": user_prompt}]
+        max_tokens = self.output_budget.suggest(instruction, namespace="refine")
+        model = route.model if route else DEFAULT_MODEL
+        fallback_model = route.fallback_model if route else FALLBACK_MODEL
+        
+        async def complete(call_messages, role, call_model, **kwargs):
+            return await complete_with_continuation(
+                self.client,
+                call_messages,
+                max_tokens,
+                record=record,
+                role=role,
+                continuation_tokens=MAX_OUTPUT_TOKENS,
+                model=call_model,
+                temperature=temperature,
+                system=REFINE_SYSTEM_PROMPT,
+                **kwargs
+            )
+        
+        role = "primary"
+        try:
+            text, stop_reason, output_tokens = await complete(messages, role, model)
+        except Exception as e:
+            print(f"First attempt failed: {e}")
+            role, model = "fallback", fallback_model
+            text, stop_reason, output_tokens = await complete(messages, role, model)
+        
+        if stop_reason != "max_tokens":
+            self.output_budget.observe(instruction, output_tokens, namespace="refine")
+        
+        post_start = time.perf_counter()
+        edits = parse_edit_blocks(text)
+        mode = "edit"
+        
+        try:
+            if not edits:
+                raise EditApplyError("no edit blocks in response")
+            code = apply_edit_blocks(previous_code, edits)
+        except EditApplyError as e:
+            # Fall back to a full rewrite in the same conversation; the model
+            # already has the code and the request, so this is still far
+            # cheaper than a fresh generation.
+            print(f"Warning: {e}; asking for the full updated code")
+            mode = "rewrite"
+            rewrite_messages = messages + [
+                {"role": "assistant", "content": text.rstrip() or "(no edits)"},
+                {"role": "user", "content": REFINE_REWRITE_INSTRUCTION.format(error=e)},
+            ]
+            if record is not None:
+                record.add_stage("post_processing", time.perf_counter() - post_start)
+            text, _, _ = await complete(
+                rewrite_messages,
+                role,
+                model,
+                prefill=CODE_PREFILL,
+                stop_sequences=CODE_STOP_SEQUENCES
+            )
+            post_start = time.perf_counter()
+            code = self._extract_code(text)
+            messages = rewrite_messages
+        
+        if record is not None:
+            record.add_stage("post_processing", time.perf_counter() - post_start)
+        
+        code = await self._gate_code(code, messages, model, role, record, system=REFINE_SYSTEM_PROMPT)
+        
+        return {
+            "code": code,
+            "mode": mode,
+            "edits_applied": len(edits) if mode == "edit" else 0
+        }
+    
+    async def _gate_code(
+        self,
+        code: str,
+        messages: list,
+        model: str,
+        role: str,
+        record: Optional[PipelineRecord],
+        system: Optional[str] = None
+    ) -> str:
+        """Parse-check the code and apply environment fixes on its AST.
+        
+        Code that does not parse gets one repair request in the same
+        conversation, quoting the code the parser error refers to. Without
+        a JavaScript parser installed, when the parser cannot judge the
+        code, or if it still does not parse, the regex fixes are used
+        instead. Parsing runs in a thread, off the event loop.
+        """
+        if not code or code.startswith("// Error"):
+            return code
+        
+        gate = await asyncio.to_thread(self.js_gate.check, code)
+        if record is not None:
+            record.add_stage("syntax_gate", gate.elapsed_ms / 1000)
+        
+        if gate.parsed is False:
+            print(f"Warning: generated code does not parse ({gate.error}); requesting a fix")
+            # gate.code, not code: the error's line numbers are for the
+            # code after IIFE unwrapping and environment fixes
+            repaired = await self._repair_syntax(gate.code, gate.error, messages, model, role, record, system)
+            self.js_gate.record_repair(repaired is not None and repaired[1].parsed is True)
+            if repaired is not None:
+                code, gate = repaired
+        
+        if gate.parsed:
+            return gate.code
+        return self._validate_and_fix_code(code)
+    
+    async def _repair_syntax(
+        self,
+        code: str,
+        error: str,
+        messages: list,
+        model: str,
+        role: str,
+        record: Optional[PipelineRecord],
+        system: Optional[str]
+    ) -> Optional[Tuple[str, JSGateResult]]:
+        """Ask once for a syntax fix; returns the new code and its gate result."""
+        repair_messages = messages + [
+            {"role": "assistant", "content": f"{CODE_PREFILL}\n{code}\n```"},
+            {"role": "user", "content": SYNTAX_REPAIR_INSTRUCTION.format(error=error)},
+        ]
+        kwargs = {"system": system} if system else {}
+        try:
+            text, _, _ = await complete_with_continuation(
+                self.client,
+                repair_messages,
+                MAX_OUTPUT_TOKENS,
+                record=record,
+                role=role,
+                prefill=CODE_PREFILL,
+                continuation_tokens=MAX_OUTPUT_TOKENS,
+                model=model,
+                temperature=0.0,
+                stop_sequences=CODE_STOP_SEQUENCES,
+                **kwargs
+            )
+        except Exception as e:
+            print(f"Syntax repair request failed: {e}")
+            return None
+        
+        repaired_code = self._extract_code(text)
+        if repaired_code.startswith("// Error"):
+            return None
+        gate = await asyncio.to_thread(self.js_gate.check, repaired_code)
+        if record is not None:
+            record.add_stage("syntax_gate", gate.elapsed_ms / 1000)
+        return repaired_code, gate
+    
     def _extract_code(self, text: str) -> str:
         """Extract JavaScript code from response."""
         # Debug logging
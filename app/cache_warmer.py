@@ -0,0 +1,86 @@
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Optional
+
+from app.pregenerate import load_prompts
+from app.request_log import rotated_path
+
+
+class CacheWarmer:
+    """Warm a fresh replica with the working set real traffic uses.
+
+    Two sources, hottest first:
+    - the most used entries in rag_cache, code_cache and diagram_cache
+      (their stored embeddings go straight into the embedding memo, so no
+      model time is spent on them)
+    - the most frequent prompts in a captured request log (text or JSONL,
+      same format as pregenerate.py; its rotated part is read too), which
+      are run through the RAG
+      engine in batches so misses are searched and cached
+    Log batches run on a small thread pool, so their single-query
+    embeddings coalesce in the embedding batcher. Nothing new is started
+    once the time budget is spent.
+    """
+
+    def __init__(self, rag_engine, top_n: Optional[int] = None, time_budget: Optional[float] = None,
+                 concurrency: Optional[int] = None, days: Optional[int] = None,
+                 request_log: Optional[str] = None, batch_size: int = 16, k: int = 5):
+        self.rag_engine = rag_engine
+        self.top_n = top_n or int(os.getenv("CACHE_WARMUP_TOP_N", "200"))
+        self.time_budget = time_budget if time_budget is not None else float(os.getenv("CACHE_WARMUP_BUDGET", "15"))
+        self.concurrency = concurrency or int(os.getenv("CACHE_WARMUP_CONCURRENCY", "4"))
+        self.days = days if days is not None else int(os.getenv("CACHE_WARMUP_DAYS", "7"))
+        self.request_log = request_log or os.getenv("CACHE_WARMUP_LOG") or os.getenv("REQUEST_LOG") or None
+        self.batch_size = batch_size
+        self.k = k
+
+    def log_queries(self) -> List[str]:
+        """Most frequent prompts in the request log (and its rotated part), most frequent first."""
+        if not self.request_log:
+            return []
+        counts = Counter()
+        for path in (rotated_path(self.request_log), self.request_log):
+            if os.path.exists(path):
+                counts.update(item["prompt"] for item in load_prompts(path))
+        return [prompt for prompt, _ in counts.most_common(self.top_n)]
+
+    def run(self) -> Dict:
+        start = time.perf_counter()
+        deadline = start + self.time_budget
+        cache = self.rag_engine.cache
+
+        resident = cache.warm_cache(limit=self.top_n, days=self.days)
+
+        queries = self.log_queries()
+        batches = [queries[i:i + self.batch_size] for i in range(0, len(queries), self.batch_size)]
+        warmed = 0
+        skipped = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="warmup") as pool:
+            pending = set()
+            for batch in batches:
+                if time.perf_counter() >= deadline:
+                    skipped += len(batch)
+                    continue
+                if len(pending) >= self.concurrency:
+                    done, pending = wait(pending, timeout=max(deadline - time.perf_counter(), 0),
+                                         return_when=FIRST_COMPLETED)
+                    warmed += sum(future.result() for future in done if not future.exception())
+                    if time.perf_counter() >= deadline:
+                        skipped += len(batch)
+                        continue
+                pending.add(pool.submit(self.rag_engine.warm_cache, batch, self.k, self.batch_size))
+            done, _ = wait(pending)
+            warmed += sum(future.result() for future in done if not future.exception())
+
+        summary = {
+            "resident_from_cache": resident,
+            "log_queries": len(queries),
+            "log_queries_warmed": warmed,
+            "log_queries_skipped": skipped,
+            "elapsed": round(time.perf_counter() - start, 3),
+        }
+        print(f"🔥 Cache warm-up: {resident} hot entries resident, {warmed}/{len(queries)} logged "
+              f"queries warmed in {summary['elapsed']:.2f}s")
+        return summary
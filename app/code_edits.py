@@ -0,0 +1,90 @@
+import re
+from typing import List, Tuple
+
+# Edit format the refinement prompt asks the model to use
+EDIT_BLOCK_PATTERN = re.compile(
+    r"<<<<<<< SEARCH\n(.*?)\n?=======\n(.*?)\n?>>>>>>> REPLACE",
+    re.DOTALL
+)
+
+
+class EditApplyError(ValueError):
+    """Raised when a SEARCH block cannot be located in the code being edited."""
+
+
+def parse_edit_blocks(text: str) -> List[Tuple[str, str]]:
+    """Extract (search, replace) pairs from a model response."""
+    return [(m.group(1), m.group(2)) for m in EDIT_BLOCK_PATTERN.finditer(text)]
+
+
+def _find_by_lines(code: str, search: str) -> Tuple[int, int]:
+    """Locate search in code ignoring indentation and trailing whitespace.
+
+    Returns the (start, end) character offsets of the matching lines, or
+    (-1, -1) when there is no unique match.
+    """
+    code_lines = code.split("\n")
+    search_lines = [line.strip() for line in search.strip("\n").split("\n")]
+    if not search_lines:
+        return -1, -1
+
+    matches = []
+    for i in range(len(code_lines) - len(search_lines) + 1):
+        if all(code_lines[i + j].strip() == search_lines[j] for j in range(len(search_lines))):
+            matches.append(i)
+            if len(matches) > 1:
+                return -1, -1
+    if not matches:
+        return -1, -1
+
+    first = matches[0]
+    start = sum(len(line) + 1 for line in code_lines[:first])
+    end = start + sum(len(line) + 1 for line in code_lines[first:first + len(search_lines)]) - 1
+    return start, end
+
+
+def _final_return_offset(code: str) -> int:
+    """Offset of the line holding the last top-level return statement, or -1.
+
+    Top level means the least indented code in the body, so a return inside
+    animate() or another nested block does not count.
+    """
+    lines = code.split("\n")
+    indents = [len(line) - len(line.lstrip()) for line in lines if line.strip()]
+    if not indents:
+        return -1
+    top = min(indents)
+    offset, found = 0, -1
+    for line in lines:
+        if len(line) - len(line.lstrip()) == top and re.match(r"return\b", line.strip()):
+            found = offset
+        offset += len(line) + 1
+    return found
+
+
+def apply_edit_blocks(code: str, edits: List[Tuple[str, str]]) -> str:
+    """Apply SEARCH/REPLACE edits in order and return the new code."""
+    for search, replace in edits:
+        if not search.strip():
+            # An empty SEARCH block adds code; after the final top-level
+            # `return animate;` it would never run, so it goes before it
+            position = _final_return_offset(code)
+            if position == -1:
+                code = code.rstrip("\n") + "\n" + replace
+            else:
+                code = code[:position] + replace.strip("\n") + "\n\n" + code[position:]
+            continue
+
+        count = code.count(search)
+        if count == 1:
+            code = code.replace(search, replace, 1)
+            continue
+        if count > 1:
+            raise EditApplyError(f"SEARCH block matches {count} places: {search[:80]!r}")
+
+        start, end = _find_by_lines(code, search)
+        if start == -1:
+            raise EditApplyError(f"SEARCH block not found: {search[:80]!r}")
+        code = code[:start] + replace + code[end:]
+
+    return code
@@ -0,0 +1,210 @@
+import os
+import time
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class UpstreamUnavailable(RuntimeError):
+    """The upstream circuit is open and there is no cached answer to fall back to."""
+
+
+class CircuitBreaker:
+    """Stop calling an upstream that keeps failing, then probe it again.
+
+    closed: calls go through; failure_threshold consecutive failed calls
+    open the circuit. open: calls are refused for
+    reset_timeout seconds. half_open: one probe call is let through; its
+    success closes the circuit, its failure opens it again. A probe that
+    never reports back (its caller was cancelled) is replaced by a new one
+    after another reset_timeout.
+    """
+
+    def __init__(self, name: str, failure_threshold: Optional[int] = None,
+                 reset_timeout: Optional[float] = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or int(os.getenv("UPSTREAM_FAILURE_THRESHOLD", "5"))
+        self.reset_timeout = reset_timeout or float(os.getenv("UPSTREAM_RESET_TIMEOUT", "30"))
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_started: Optional[float] = None
+        self._lock = threading.Lock()
+        self.stats = {"opened": 0, "refused": 0, "failures": 0, "successes": 0}
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self._probe_started is not None or time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            probe_due = self._probe_started is None or now - self._probe_started >= self.reset_timeout
+            if probe_due and now - self.opened_at >= self.reset_timeout:
+                self._probe_started = now
+                return True
+            self.stats["refused"] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.stats["successes"] += 1
+            self.failures = 0
+            self.opened_at = None
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.stats["failures"] += 1
+            self.failures += 1
+            if self._probe_started is not None or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.stats["opened"] += 1
+                self.opened_at = time.monotonic()
+                self._probe_started = None
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout,
+            }
+
+
+class StaleWhileRevalidate:
+    """Bound the latency of an upstream call by falling back to a cached answer.
+
+    run() starts the fresh call and waits up to `deadline` seconds. If the
+    deadline passes, the call fails or the circuit is open, the stale()
+    lookup (a relaxed-threshold cache match) is served instead and the
+    reason returned alongside it. After a missed deadline the fresh call
+    keeps running and fills the cache when it lands; the breaker hears how
+    the call really ended, so a slow but healthy upstream never trips it.
+    After an error or
+    while the circuit is open, a background refresh is queued that runs
+    once the breaker lets calls through again. With nothing cached, a
+    slow call is waited for and a failure is raised as before.
+    """
+
+    def __init__(self, name: str, breaker: CircuitBreaker, deadline: float,
+                 refresh_max_wait: Optional[float] = None, refresh_concurrency: Optional[int] = None):
+        self.name = name
+        self.breaker = breaker
+        self.deadline = deadline
+        self.refresh_max_wait = refresh_max_wait or float(os.getenv("STALE_REFRESH_MAX_WAIT", "600"))
+        self.refresh_concurrency = refresh_concurrency or int(os.getenv("STALE_REFRESH_CONCURRENCY", "2"))
+        self._refresh_slots: Optional[asyncio.Semaphore] = None
+        self._refreshing: Dict[Hashable, asyncio.Task] = {}
+        self.stats = {
+            "fresh": 0,
+            "deadline_missed": 0,
+            "stale_deadline": 0,
+            "stale_circuit_open": 0,
+            "stale_upstream_error": 0,
+            "waited_past_deadline": 0,
+            "unavailable": 0,
+            "refreshes_scheduled": 0,
+            "refreshes_succeeded": 0,
+            "refreshes_failed": 0,
+            "refreshes_abandoned": 0,
+        }
+
+    async def run(self, key: Hashable, fresh: Callable[[], Awaitable[Any]],
+                  stale: Callable[[], Awaitable[Optional[Any]]],
+                  refresh: Optional[Callable[[], Awaitable[Any]]] = None) -> Tuple[Any, Optional[str]]:
+        """Return (result, stale_reason); stale_reason is None for a fresh result.
+        
+        refresh is what the background refresh calls (defaults to fresh);
+        it must put its result in the cache.
+        """
+        refresh = refresh or fresh
+        if not self.breaker.allow():
+            cached = await stale()
+            if cached is not None:
+                self.stats["stale_circuit_open"] += 1
+                self.schedule_refresh(key, refresh)
+                return cached, "circuit_open"
+            self.stats["unavailable"] += 1
+            raise UpstreamUnavailable(f"{self.name}: upstream circuit is open")
+
+        task = asyncio.ensure_future(fresh())
+        task.add_done_callback(self._record_outcome)
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), self.deadline)
+        except asyncio.TimeoutError:
+            # Only a trigger to serve stale; the call keeps going and the
+            # breaker hears its real outcome when it lands
+            self.stats["deadline_missed"] += 1
+            cached = await stale()
+            if cached is not None:
+                self.stats["stale_deadline"] += 1
+                return cached, "deadline"
+            self.stats["waited_past_deadline"] += 1
+            return await task, None
+        except Exception:
+            cached = await stale()
+            if cached is not None:
+                self.stats["stale_upstream_error"] += 1
+                self.schedule_refresh(key, refresh)
+                return cached, "upstream_error"
+            raise
+
+        self.stats["fresh"] += 1
+        return result, None
+
+    def _record_outcome(self, task: asyncio.Future):
+        # Also marks the exception of a call nobody awaits any more as retrieved
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def schedule_refresh(self, key: Hashable, fresh: Callable[[], Awaitable[Any]]):
+        """Regenerate key in the background once the upstream is reachable (one refresh per key)."""
+        if key in self._refreshing:
+            return
+        self.stats["refreshes_scheduled"] += 1
+        task = asyncio.ensure_future(self._refresh(key, fresh))
+        self._refreshing[key] = task
+
+    async def _refresh(self, key: Hashable, fresh: Callable[[], Awaitable[Any]]):
+        if self._refresh_slots is None:
+            self._refresh_slots = asyncio.Semaphore(self.refresh_concurrency)
+        give_up = time.monotonic() + self.refresh_max_wait
+        try:
+            async with self._refresh_slots:
+                # Back off before the first try too; the call just failed
+                while True:
+                    await asyncio.sleep(min(self.breaker.reset_timeout, 5.0))
+                    if self.breaker.allow():
+                        break
+                    if time.monotonic() >= give_up:
+                        self.stats["refreshes_abandoned"] += 1
+                        return
+                try:
+                    await fresh()
+                except Exception as e:
+                    self.breaker.record_failure()
+                    self.stats["refreshes_failed"] += 1
+                    print(f"⚠️ Background refresh failed ({self.name}): {e}")
+                else:
+                    self.breaker.record_success()
+                    self.stats["refreshes_succeeded"] += 1
+        finally:
+            self._refreshing.pop(key, None)
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            "deadline": self.deadline,
+            "refreshing": len(self._refreshing),
+        }
@@ -0,0 +1,264 @@
+import re
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_DIAGRAM_TYPE = "flowchart"
+
+# Cue phrases per diagram type with their weight. Naming the diagram type
+# outright outweighs topical hints, so "class schedule timeline" is a
+# timeline rather than a class diagram. Dict order is the tie-break
+# priority (the order the old if/elif chain checked types in).
+DIAGRAM_CUES: Dict[str, Dict[str, int]] = {
+    "sequenceDiagram": {
+        "sequence diagram": 5, "sequence": 3, "interaction": 1, "communication": 2,
+        "message flow": 2, "handshake": 2,
+    },
+    "classDiagram": {
+        "class diagram": 5, "uml class": 5, "uml": 3, "inheritance": 3, "class": 1,
+        "object oriented": 2,
+    },
+    "stateDiagram-v2": {
+        "state diagram": 5, "state machine": 5, "finite state": 4, "fsm": 4,
+        "state": 1, "transition": 1,
+    },
+    "erDiagram": {
+        "er diagram": 5, "erd": 5, "entity relationship": 5, "database schema": 4,
+        "entity": 3, "database": 1, "table": 1,
+    },
+    "journey": {
+        "user journey": 5, "customer journey": 5, "journey": 3,
+    },
+    "gantt": {
+        "gantt": 5, "project timeline": 4, "project plan": 3, "schedule": 2, "milestone": 2,
+    },
+    "pie": {
+        "pie chart": 5, "pie": 3, "percentage": 1, "distribution": 1, "proportion": 1, "share": 1,
+    },
+    "quadrantChart": {
+        "quadrant chart": 5, "four quadrants": 4, "2x2 matrix": 4, "quadrant": 3,
+    },
+    "requirementDiagram": {
+        "requirement diagram": 5, "requirement": 3,
+    },
+    "gitGraph": {
+        "gitgraph": 5, "git graph": 5, "git": 3, "commit": 3, "branching strategy": 3,
+        "branch": 1, "merge": 1,
+    },
+    "C4Context": {
+        "c4": 5, "system context": 4, "context diagram": 4,
+    },
+    "mindmap": {
+        "mindmap": 5, "mind map": 5, "brainstorm": 3, "concept map": 3,
+    },
+    "timeline": {
+        "timeline": 5, "chronology": 3, "chronological": 3, "history": 1, "historical": 1,
+    },
+    "zenuml": {
+        "zenuml": 5, "uml sequence": 4, "zen": 2,
+    },
+    "sankey-beta": {
+        "sankey": 5, "energy flow": 3, "flow diagram": 2,
+    },
+    "xychart-beta": {
+        "xy chart": 5, "xy graph": 5, "bar chart": 5, "line chart": 5, "bar graph": 5,
+        "line graph": 5, "plot": 1, "trend": 1,
+    },
+    "block-beta": {
+        "block diagram": 5, "block": 1, "grid": 1,
+    },
+    "packet-beta": {
+        "packet diagram": 5, "network packet": 4, "data packet": 4, "packet": 3, "header fields": 2,
+    },
+    "kanban": {
+        "kanban": 5, "task board": 4, "todo board": 4,
+    },
+    "architecture-beta": {
+        "architecture diagram": 5, "system architecture": 4, "architecture": 2, "microservice": 2,
+    },
+    "radar-beta": {
+        "radar chart": 5, "spider chart": 5, "radar": 3, "spider": 3, "skills": 1, "assessment": 1,
+    },
+    "treemap-beta": {
+        "treemap": 5, "tree map": 5, "hierarchical": 1,
+    },
+    "flowchart": {
+        "flowchart": 5, "flow chart": 5, "decision tree": 3, "workflow": 3, "process flow": 3,
+        "step by step": 2, "algorithm": 2, "process": 1, "steps": 1, "cycle": 1,
+    },
+}
+
+# Short descriptions used to build embedding centroids for the fallback path
+DIAGRAM_DESCRIPTIONS: Dict[str, List[str]] = {
+    "sequenceDiagram": ["messages exchanged between a client and a server over time",
+                        "how actors call each other step by step"],
+    "classDiagram": ["objects with attributes and methods and how they relate",
+                     "data model of classes for a software system"],
+    "stateDiagram-v2": ["the states something moves through and what triggers each change",
+                        "lifecycle of an order from placed to delivered"],
+    "erDiagram": ["tables in a relational schema with keys and relationships",
+                  "customers orders and products stored in a database"],
+    "journey": ["experience of a person completing a task and how they feel",
+                "steps a shopper takes when buying online"],
+    "gantt": ["tasks with start dates and durations for a project",
+              "plan of work over weeks"],
+    "pie": ["share of a whole split into parts",
+            "breakdown of a budget by category"],
+    "quadrantChart": ["items positioned by two criteria such as effort and impact",
+                      "priority matrix"],
+    "requirementDiagram": ["system requirements and the elements that satisfy them"],
+    "gitGraph": ["version control history with branches and merges"],
+    "C4Context": ["people and software systems and how they interact at a high level"],
+    "mindmap": ["central idea with branching subtopics",
+                "ideas related to a topic"],
+    "timeline": ["events in the order they happened over the years",
+                 "key dates in the history of a subject"],
+    "zenuml": ["method calls between services written as code"],
+    "sankey-beta": ["quantities flowing from sources to destinations",
+                    "where energy or money goes"],
+    "xychart-beta": ["values plotted against time or categories",
+                     "monthly sales figures"],
+    "block-beta": ["components arranged in blocks and columns"],
+    "packet-beta": ["bit layout of a protocol header"],
+    "kanban": ["tasks grouped into to do in progress and done"],
+    "architecture-beta": ["servers databases and services grouped in the cloud"],
+    "radar-beta": ["scores on several axes compared across people or products"],
+    "treemap-beta": ["nested categories sized by value"],
+    "flowchart": ["steps and decisions in a process",
+                  "how something works from start to end",
+                  "the stages of a natural cycle"],
+}
+
+_TYPE_PRIORITY = {diagram_type: i for i, diagram_type in enumerate(DIAGRAM_CUES)}
+
+
+def _trie_pattern(phrases: List[str]) -> str:
+    """Build a regex alternation factored into a prefix trie.
+
+    A flat "a|b|c|..." makes the regex engine try every phrase at every
+    position; the trie form checks each character once, so matching all
+    cues costs about as much as a single scan of the prompt.
+    """
+    trie: Dict[str, Dict] = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict[str, Dict]) -> str:
+        if list(node) == [""]:
+            return ""
+        optional = "" in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # Greedy optional group, so the longest phrase wins ("uml sequence" over "uml")
+        return f"(?:{body})?" if optional else body
+
+    return build(trie)
+
+
+class DiagramTypeClassifier:
+    """Pick a Mermaid diagram type for a prompt.
+
+    All cue phrases are compiled into one trie-shaped regex, so a single
+    pass over the prompt finds every cue and scores all types at once. The
+    highest score wins. When nothing matches and an embedding function is
+    available, the prompt goes to the type with the nearest description
+    centroid.
+    """
+
+    def __init__(self, embed_fn: Optional[Callable[[List[str]], Sequence]] = None,
+                 min_similarity: float = 0.45):
+        self._phrases: Dict[str, List[Tuple[str, int]]] = {}
+        for diagram_type, cues in DIAGRAM_CUES.items():
+            for phrase, weight in cues.items():
+                self._phrases.setdefault(phrase, []).append((diagram_type, weight))
+        self.pattern = re.compile(rf"\b(?:{_trie_pattern(list(self._phrases))})(?:e?s)?\b")
+
+        self.embed_fn = embed_fn
+        self.min_similarity = min_similarity
+        self._centroid_types: List[str] = []
+        self._centroids: Optional[np.ndarray] = None
+
+    def _lookup(self, phrase: str) -> List[Tuple[str, int]]:
+        hits = self._phrases.get(phrase)
+        if hits is None and phrase.endswith("s"):
+            hits = self._phrases.get(phrase[:-1]) or self._phrases.get(phrase[:-2])
+        return hits or []
+
+    def score(self, prompt: str) -> Dict[str, int]:
+        """Score every diagram type against the prompt in one regex pass."""
+        scores: Dict[str, int] = {}
+        for phrase in self.pattern.findall(" ".join(prompt.lower().split())):
+            for diagram_type, weight in self._lookup(phrase):
+                scores[diagram_type] = scores.get(diagram_type, 0) + weight
+        return scores
+
+    def _best(self, scores: Dict[str, int]) -> Optional[str]:
+        if not scores:
+            return None
+        return max(scores, key=lambda t: (scores[t], -_TYPE_PRIORITY[t]))
+
+    def _ensure_centroids(self):
+        if self._centroids is not None or self.embed_fn is None:
+            return
+        texts, owners = [], []
+        for diagram_type, descriptions in DIAGRAM_DESCRIPTIONS.items():
+            texts.extend(descriptions)
+            owners.extend([diagram_type] * len(descriptions))
+
+        vectors = np.asarray(self.embed_fn(texts), dtype=np.float32)
+        centroids = []
+        self._centroid_types = list(DIAGRAM_DESCRIPTIONS)
+        for diagram_type in self._centroid_types:
+            rows = [i for i, owner in enumerate(owners) if owner == diagram_type]
+            centroid = vectors[rows].mean(axis=0)
+            centroids.append(centroid / (np.linalg.norm(centroid) or 1.0))
+        self._centroids = np.stack(centroids)
+
+    def _nearest(self, prompts: List[str]) -> List[Optional[str]]:
+        self._ensure_centroids()
+        vectors = np.asarray(self.embed_fn(prompts), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+        similarities = vectors @ self._centroids.T
+        best = similarities.argmax(axis=1)
+        return [
+            self._centroid_types[j] if similarities[i, j] >= self.min_similarity else None
+            for i, j in enumerate(best)
+        ]
+
+    def classify_with_details(self, prompt: str) -> Tuple[str, str, Dict[str, int]]:
+        """Return (diagram_type, method, scores); method is "keywords", "embedding" or "default"."""
+        return self.classify_many_with_details([prompt])[0]
+
+    def classify_many_with_details(self, prompts: List[str]) -> List[Tuple[str, str, Dict[str, int]]]:
+        results: List[Tuple[str, str, Dict[str, int]]] = []
+        unmatched = []
+        for i, prompt in enumerate(prompts):
+            scores = self.score(prompt)
+            best = self._best(scores)
+            if best:
+                results.append((best, "keywords", scores))
+            else:
+                results.append((DEFAULT_DIAGRAM_TYPE, "default", scores))
+                unmatched.append(i)
+
+        if unmatched and self.embed_fn is not None:
+            try:
+                nearest = self._nearest([prompts[i] for i in unmatched])
+            except Exception as e:
+                print(f"Diagram type embedding fallback failed: {e}")
+                nearest = [None] * len(unmatched)
+            for i, diagram_type in zip(unmatched, nearest):
+                if diagram_type:
+                    results[i] = (diagram_type, "embedding", results[i][2])
+
+        return results
+
+    def classify(self, prompt: str) -> str:
+        return self.classify_with_details(prompt)[0]
+
+    def classify_many(self, prompts: List[str]) -> List[str]:
+        """Classify several prompts, batching any embedding fallbacks into one call."""
+        return [result[0] for result in self.classify_many_with_details(prompts)]
@@ -0,0 +1,385 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+TERMINAL_STATUSES = (SUCCEEDED, FAILED)
+
+
+class RetryLater(Exception):
+    """Raised by a job handler to put the job back in the queue for `delay` seconds."""
+
+    def __init__(self, message: str, delay: float):
+        super().__init__(message)
+        self.delay = delay
+
+
+class JobStore:
+    """Persistent job queue in a local SQLite file.
+
+    Several processes can share one file. A claimed job is leased to the
+    claiming process (owner), which renews heartbeat_at while it runs;
+    recover() only puts back jobs whose lease lapsed, so a job survives
+    its process dying without being taken from a live sibling. Finished
+    jobs keep their
+    result until result_ttl seconds after they finished. A job submitted
+    with the dedup_key of a queued, running or unexpired successful job
+    returns that job instead of adding a new one.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, result_ttl: Optional[float] = None):
+        self.db_path = db_path or os.getenv("JOB_DB", os.path.join("cache", "jobs.db"))
+        self.result_ttl = result_ttl if result_ttl is not None else float(os.getenv("JOB_RESULT_TTL", "3600"))
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self.init_database()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_database(self):
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                dedup_key TEXT,
+                priority INTEGER DEFAULT 0,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER DEFAULT 0,
+                created_at REAL NOT NULL,
+                run_after REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                expires_at REAL,
+                owner TEXT,
+                heartbeat_at REAL
+            )
+        ''')
+        # Files created before leases existed
+        columns = {row["name"] for row in conn.execute('PRAGMA table_info(jobs)')}
+        for column, column_type in (("owner", "TEXT"), ("heartbeat_at", "REAL")):
+            if column not in columns:
+                conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, priority, run_after)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_dedup ON jobs (dedup_key, status)')
+        conn.commit()
+        conn.close()
+
+    @property
+    def owner(self) -> str:
+        """Lease holder name of the current process."""
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def submit(self, kind: str, payload: Dict, dedup_key: Optional[str] = None,
+               priority: int = 0) -> Dict:
+        """Queue a job, or return the live job with the same dedup_key (marked "deduplicated")."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            # IMMEDIATE: two submits of the same request must not both miss the dedup check
+            conn.execute("BEGIN IMMEDIATE")
+            if dedup_key:
+                row = conn.execute('''
+                    SELECT * FROM jobs
+                    WHERE dedup_key = ? AND kind = ?
+                      AND (status IN (?, ?) OR (status = ? AND expires_at > ?))
+                    ORDER BY created_at DESC LIMIT 1
+                ''', (dedup_key, kind, QUEUED, RUNNING, SUCCEEDED, now)).fetchone()
+                if row:
+                    conn.commit()
+                    return {**self._to_dict(row), "deduplicated": True}
+
+            job_id = uuid.uuid4().hex
+            conn.execute('''
+                INSERT INTO jobs (id, kind, payload, dedup_key, priority, status, created_at, run_after)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (job_id, kind, json.dumps(payload), dedup_key, priority, QUEUED, now, now))
+            conn.commit()
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            return {**self._to_dict(row), "deduplicated": False}
+        finally:
+            conn.close()
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """The job, or None if it does not exist or its result has expired."""
+        conn = self._connect()
+        row = conn.execute('''
+            SELECT * FROM jobs WHERE id = ? AND (expires_at IS NULL OR expires_at > ?)
+        ''', (job_id, time.time())).fetchone()
+        conn.close()
+        return self._to_dict(row) if row else None
+
+    def claim_next(self) -> Optional[Dict]:
+        """Lease the most urgent due job to this process and return it (None if the queue is empty)."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            # IMMEDIATE takes the write lock first, so two workers (or
+            # processes) cannot claim the same job
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute('''
+                SELECT id FROM jobs WHERE status = ? AND run_after <= ?
+                ORDER BY priority, run_after LIMIT 1
+            ''', (QUEUED, now)).fetchone()
+            if row is None:
+                conn.commit()
+                return None
+            conn.execute('''
+                UPDATE jobs SET status = ?, started_at = ?, attempts = attempts + 1, owner = ?, heartbeat_at = ?
+                WHERE id = ?
+            ''', (RUNNING, now, self.owner, now, row["id"]))
+            conn.commit()
+            return self._to_dict(conn.execute('SELECT * FROM jobs WHERE id = ?', (row["id"],)).fetchone())
+        finally:
+            conn.close()
+
+    # complete, fail and requeue only touch a job this process still
+    # holds; they return False if its lease lapsed and it was recovered
+
+    def complete(self, job_id: str, result: Dict) -> bool:
+        return self._finish(job_id, SUCCEEDED, result=json.dumps(result))
+
+    def fail(self, job_id: str, error: str) -> bool:
+        return self._finish(job_id, FAILED, error=error)
+
+    def _finish(self, job_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None) -> bool:
+        now = time.time()
+        conn = self._connect()
+        cursor = conn.execute('''
+            UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, expires_at = ?, owner = NULL
+            WHERE id = ? AND status = ? AND owner = ?
+        ''', (status, result, error, now, now + self.result_ttl, job_id, RUNNING, self.owner))
+        conn.commit()
+        conn.close()
+        return cursor.rowcount > 0
+
+    def requeue(self, job_id: str, delay: float, error: Optional[str] = None, count_attempt: bool = True) -> bool:
+        """Put a claimed job back in the queue; count_attempt=False does not charge it an attempt."""
+        conn = self._connect()
+        cursor = conn.execute('''
+            UPDATE jobs SET status = ?, run_after = ?, error = ?, started_at = NULL, attempts = attempts - ?,
+                            owner = NULL, heartbeat_at = NULL
+            WHERE id = ? AND status = ? AND owner = ?
+        ''', (QUEUED, time.time() + delay, error, 0 if count_attempt else 1, job_id, RUNNING, self.owner))
+        conn.commit()
+        conn.close()
+        return cursor.rowcount > 0
+
+    def heartbeat(self, job_ids: List[str]):
+        """Renew this process's lease on the given running jobs."""
+        if not job_ids:
+            return
+        conn = self._connect()
+        conn.execute(f'''
+            UPDATE jobs SET heartbeat_at = ?
+            WHERE id IN ({", ".join("?" * len(job_ids))}) AND status = ? AND owner = ?
+        ''', (time.time(), *job_ids, RUNNING, self.owner))
+        conn.commit()
+        conn.close()
+
+    def recover(self, lease_timeout: float) -> int:
+        """Put running jobs whose lease was not renewed for lease_timeout seconds back in the queue."""
+        conn = self._connect()
+        cursor = conn.execute('''
+            UPDATE jobs SET status = ?, started_at = NULL, owner = NULL, heartbeat_at = NULL
+            WHERE status = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)
+        ''', (QUEUED, RUNNING, time.time() - lease_timeout))
+        conn.commit()
+        conn.close()
+        return cursor.rowcount
+
+    def purge_expired(self) -> int:
+        conn = self._connect()
+        cursor = conn.execute('DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?', (time.time(),))
+        conn.commit()
+        conn.close()
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        conn = self._connect()
+        rows = conn.execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status').fetchall()
+        conn.close()
+        counts = {status: 0 for status in (QUEUED, RUNNING, SUCCEEDED, FAILED)}
+        counts.update({row["status"]: row["n"] for row in rows})
+        return counts
+
+
+class JobWorkerPool:
+    """Asyncio workers that drain a JobStore.
+
+    handlers maps a job kind to a coroutine function that takes the job
+    payload and returns its result dict. A handler raising RetryLater puts
+    the job back with that delay; any other error is retried with
+    exponential backoff until max_attempts, then the job fails. While a
+    job runs its lease is renewed every lease_timeout / 4 seconds, and
+    jobs whose lease lapsed (their process died) are queued again. wait()
+    lets request handlers block until a job changes state in this process.
+    """
+
+    def __init__(self, store: JobStore, handlers: Dict[str, Callable[[Dict], Awaitable[Dict]]],
+                 workers: Optional[int] = None, max_attempts: Optional[int] = None,
+                 lease_timeout: Optional[float] = None, poll_interval: float = 1.0,
+                 purge_interval: float = 60.0):
+        self.store = store
+        self.handlers = handlers
+        self.workers = workers if workers is not None else int(os.getenv("JOB_WORKERS", "4"))
+        self.max_attempts = max_attempts or int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+        self.lease_timeout = lease_timeout or float(os.getenv("JOB_LEASE_TIMEOUT", "60"))
+        self.poll_interval = poll_interval
+        self.purge_interval = purge_interval
+        self._tasks: List[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+        # job id -> [event, number of waiters]
+        self._watchers: Dict[str, list] = {}
+        self._running: Set[str] = set()
+        self.stats = {"completed": 0, "failed": 0, "retried": 0, "recovered": 0, "lease_lost": 0,
+                      "store_errors": 0, "purged": 0}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        if self._tasks or self.workers <= 0:
+            return
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+        self._tasks.append(asyncio.create_task(self._purge()))
+        print(f"🧵 Job workers started ({self.workers})")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify_submitted(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def wait(self, job_id: str, timeout: float):
+        """Return when job_id changes state here, or after timeout seconds."""
+        watcher = self._watchers.get(job_id)
+        if watcher is None:
+            watcher = self._watchers[job_id] = [asyncio.Event(), 0]
+        watcher[1] += 1
+        try:
+            await asyncio.wait_for(watcher[0].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # The last waiter to give up drops the event, so timed-out
+            # waits on jobs that never change here do not pile up
+            watcher[1] -= 1
+            if watcher[1] == 0 and self._watchers.get(job_id) is watcher:
+                del self._watchers[job_id]
+
+    def _changed(self, job_id: str):
+        watcher = self._watchers.pop(job_id, None)
+        if watcher is not None:
+            watcher[0].set()
+
+    async def _work(self):
+        errors = 0
+        while True:
+            try:
+                job = await asyncio.to_thread(self.store.claim_next)
+                if job is None:
+                    self._wake.clear()
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    errors = 0
+                    continue
+                self._changed(job["id"])
+                self._running.add(job["id"])
+                try:
+                    await self._run(job)
+                finally:
+                    self._running.discard(job["id"])
+                self._changed(job["id"])
+                errors = 0
+            except Exception as e:
+                # e.g. the job file is locked; a job left running is
+                # recovered once its lease lapses
+                errors += 1
+                self.stats["store_errors"] += 1
+                delay = min(self.poll_interval * 2 ** errors, 30.0)
+                print(f"⚠️ Job worker error, retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+
+    async def _run(self, job: Dict):
+        handler = self.handlers.get(job["kind"])
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {job['kind']}")
+            result = await handler(job["payload"])
+        except RetryLater as e:
+            self.stats["retried"] += 1
+            # Shed or circuit open: not the job's fault, so no attempt is used up
+            held = await asyncio.to_thread(self.store.requeue, job["id"], e.delay, str(e), False)
+        except Exception as e:
+            if handler is not None and job["attempts"] < self.max_attempts:
+                self.stats["retried"] += 1
+                held = await asyncio.to_thread(self.store.requeue, job["id"], 2.0 ** job["attempts"], str(e))
+            else:
+                self.stats["failed"] += 1
+                held = await asyncio.to_thread(self.store.fail, job["id"], str(e))
+                print(f"❌ Job {job['id']} ({job['kind']}) failed: {e}")
+        else:
+            self.stats["completed"] += 1
+            held = await asyncio.to_thread(self.store.complete, job["id"], result)
+        if not held:
+            self.stats["lease_lost"] += 1
+            print(f"⚠️ Job {job['id']} ({job['kind']}) lost its lease; its outcome was dropped")
+
+    async def _heartbeat(self):
+        # Renew our leases, then take back jobs whose process stopped renewing
+        while True:
+            try:
+                await asyncio.to_thread(self.store.heartbeat, list(self._running))
+                self.stats["recovered"] += await asyncio.to_thread(self.store.recover, self.lease_timeout)
+            except Exception as e:
+                print(f"Job heartbeat failed: {e}")
+            await asyncio.sleep(self.lease_timeout / 4)
+
+    async def _purge(self):
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                self.stats["purged"] += await asyncio.to_thread(self.store.purge_expired)
+            except Exception as e:
+                print(f"Job purge failed: {e}")
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            "workers": self.workers if self._tasks else 0,
+            "watchers": len(self._watchers),
+            "jobs": self.store.counts(),
+            "running_here": len(self._running),
+            "lease_timeout": self.lease_timeout,
+            "result_ttl": self.store.result_ttl,
+        }
@@ -0,0 +1,359 @@
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import esprima
+except ImportError:  # Optional: without it AnthropicClient falls back to the regex fixes
+    esprima = None
+
+# The generated code is a function body (it ends with "return animate;"),
+# so it is parsed inside a wrapper function for top-level return to be legal.
+WRAPPER_PREFIX = "function __generated__() {\n"
+WRAPPER_SUFFIX = "\n}"
+
+# Objects the execution environment already provides
+PROVIDED_OBJECTS = {
+    "scene": ("Creates new scene", {"Scene"}),
+    "camera": ("Creates new camera", {"PerspectiveCamera", "OrthographicCamera"}),
+    "renderer": ("Creates new renderer", {"WebGLRenderer"}),
+}
+
+WINDOW_SIZE_REPLACEMENTS = {
+    "innerWidth": "800 /* canvas width */",
+    "innerHeight": "600 /* canvas height */",
+}
+
+# esprima stops at ES2017. A parse error in code using any of these is not
+# proof the code is broken, so it is reported as unverified, not failed.
+# A match inside a string or comment only costs a repair request.
+NEWER_SYNTAX = [
+    ("optional chaining", re.compile(r"\?\.(?!\d)")),
+    ("nullish coalescing", re.compile(r"\?\?")),
+    ("logical assignment", re.compile(r"(\|\||&&)=")),
+    ("numeric separators", re.compile(r"\b\d+(_\d+)+")),
+    ("BigInt literals", re.compile(r"\b\d+n\b")),
+    ("class fields", re.compile(r"\bclass\b")),
+    ("for await", re.compile(r"\bfor\s+await\b")),
+    ("async generators", re.compile(r"\basync\b[^\n(]*\*")),
+    ("optional catch binding", re.compile(r"\bcatch\s*\{")),
+    ("regex lookbehind or named groups", re.compile(r"\(\?<")),
+]
+
+
+def _newer_syntax(code: str) -> Optional[str]:
+    """Name of the first post-ES2017 feature the code seems to use, if any."""
+    for name, pattern in NEWER_SYNTAX:
+        if pattern.search(code):
+            return name
+    return None
+
+
+class JSGateResult:
+    """Outcome of gating one piece of generated code."""
+
+    def __init__(self, code: str, parsed: Optional[bool], error: Optional[str] = None,
+                 violations: Optional[List[str]] = None, rules: Optional[List[str]] = None,
+                 elapsed_ms: float = 0.0, cached: bool = False):
+        self.code = code
+        # None when no parser is installed
+        self.parsed = parsed
+        self.error = error
+        self.violations = violations or []
+        self.rules = rules or []
+        self.elapsed_ms = elapsed_ms
+        self.cached = cached
+
+
+def _root_name(node) -> Optional[str]:
+    """Identifier at the root of a member chain such as label.style.color."""
+    while node is not None and node.type in ("MemberExpression", "CallExpression"):
+        node = node.object if node.type == "MemberExpression" else node.callee
+    return node.name if node is not None and node.type == "Identifier" else None
+
+
+def _is_member(node, obj: str, prop: str) -> bool:
+    return (
+        node is not None
+        and node.type == "MemberExpression"
+        and not node.computed
+        and node.object.type == "Identifier"
+        and node.object.name == obj
+        and node.property.name == prop
+    )
+
+
+def _top_level(nodes: List) -> List:
+    """Statements directly inside the wrapper function (the Program is visited last)."""
+    return nodes[-1].body[0].body.body if nodes else []
+
+
+def _called(statement) -> Optional[object]:
+    """Callee of an expression statement that is a plain call, else None."""
+    expression = statement.expression
+    return expression.callee if expression.type == "CallExpression" else None
+
+
+class JavaScriptGate:
+    """Parse-check generated Three.js code and apply environment fixes on the AST.
+
+    The code is parsed once with esprima. The same rewrites the regex pass
+    made (no new scene/camera/renderer, no render loop, no DOM access) are
+    applied to exact statement ranges, so only the statements that violate
+    a rule are touched. For example, only `.style` lines of elements the code
+    created itself are dropped. The fixed code is parsed again to confirm it
+    is still valid JavaScript. A parse error in code that uses syntax newer
+    than esprima knows (NEWER_SYNTAX) leaves the code unverified
+    (parsed=None) rather than failed. Results are cached by code hash;
+    cold parses cost tens of milliseconds, so callers on an event loop
+    should run check() in a thread.
+    """
+
+    def __init__(self, cache_size: int = 512, window: int = 1000):
+        self.available = esprima is not None
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, JSGateResult]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._timings_ms = deque(maxlen=window)
+        self.rule_hits: Dict[str, int] = {}
+        self.stats = {"checks": 0, "cache_hits": 0, "parse_failures": 0, "unverified": 0,
+                      "repairs": 0, "repaired": 0}
+
+    def _parse(self, code: str) -> Tuple[Optional[List], Optional[str]]:
+        """Return (nodes in source order, None) or (None, error message)."""
+        nodes = []
+        try:
+            esprima.parseScript(
+                WRAPPER_PREFIX + code + WRAPPER_SUFFIX,
+                {"range": True},
+                lambda node, metadata: nodes.append(node)
+            )
+        except esprima.Error as e:
+            description = e.message.split(": ", 1)[-1]
+            return None, f"line {max((e.lineNumber or 1) - 1, 1)}: {description}"
+        except RecursionError:
+            return None, "code is nested too deeply to parse"
+        return nodes, None
+
+    @staticmethod
+    def _parse_failure(code: str, error: str, rules: Optional[List[str]] = None) -> JSGateResult:
+        feature = _newer_syntax(code)
+        if feature:
+            return JSGateResult(code, parsed=None, error=f"{error} (code uses {feature}, which the parser predates)",
+                                rules=rules)
+        return JSGateResult(code, parsed=False, error=error, rules=rules)
+
+    def _collect_edits(self, nodes: List, code: str) -> Tuple[List[Tuple[int, int, str, str, str]], bool]:
+        """Find (start, end, replacement, rule, violation) edits and whether animate is returned."""
+        offset = len(WRAPPER_PREFIX)
+        edits = []
+        created_elements = set()
+        animate_ranges = []
+        has_return = False
+        has_animate = False
+
+        def span(node) -> Tuple[int, int]:
+            return node.range[0] - offset, node.range[1] - offset
+
+        top_level_ids = {id(statement) for statement in _top_level(nodes)}
+
+        for node in nodes:
+            if node.type == "FunctionDeclaration" and node.id and node.id.name == "animate" \
+                    and id(node) in top_level_ids:
+                has_animate = True
+                animate_ranges.append(span(node))
+
+            elif node.type == "ReturnStatement" and id(node) in top_level_ids:
+                has_return = True
+
+            elif node.type == "VariableDeclaration" and len(node.declarations) == 1:
+                declarator = node.declarations[0]
+                name = declarator.id.name if declarator.id.type == "Identifier" else None
+                init = declarator.init
+                if name in PROVIDED_OBJECTS and init is not None and init.type == "NewExpression" \
+                        and init.callee.type == "MemberExpression" and _root_name(init.callee) == "THREE" \
+                        and init.callee.property.name in PROVIDED_OBJECTS[name][1]:
+                    edits.append((*span(node), f"// {name} already exists", name, PROVIDED_OBJECTS[name][0]))
+                elif init is not None and init.type == "CallExpression" \
+                        and _is_member(init.callee, "document", "createElement"):
+                    created_elements.add(name)
+                    edits.append((*span(node), "// DOM element creation removed",
+                                  "create_element", "Creates DOM elements"))
+
+            elif node.type == "ExpressionStatement":
+                callee = _called(node)
+                expression = node.expression
+                if callee is not None and callee.type == "Identifier" and callee.name == "requestAnimationFrame" \
+                        or _is_member(callee, "window", "requestAnimationFrame"):
+                    edits.append((*span(node), "// Animation handled by React",
+                                  "request_animation_frame", "Calls requestAnimationFrame"))
+                elif _is_member(callee, "renderer", "render"):
+                    edits.append((*span(node), "// Rendering handled by React",
+                                  "renderer_render", "Calls renderer.render"))
+                elif _is_member(callee, "window", "addEventListener"):
+                    edits.append((*span(node), "// Event handling by React",
+                                  "window_listener", "Adds event listeners"))
+                elif callee is not None and callee.type == "MemberExpression" \
+                        and _is_member(callee.object, "document", "body") and callee.property.name == "appendChild":
+                    edits.append((*span(node), "// DOM manipulation removed", "dom_append", "Manipulates DOM"))
+                elif callee is not None and callee.type == "Identifier" and callee.name == "animate" \
+                        and not expression.arguments:
+                    edits.append((*span(node), "// Return animate instead of calling it",
+                                  "animate_call", "Calls animate function"))
+                else:
+                    target = expression.left if expression.type == "AssignmentExpression" else expression
+                    if created_elements and _root_name(target) in created_elements:
+                        edits.append((*span(node), "", "create_element", "Creates DOM elements"))
+
+            elif node.type == "MemberExpression" and node.object.type == "Identifier" \
+                    and node.object.name == "window" and not node.computed \
+                    and node.property.name in WINDOW_SIZE_REPLACEMENTS:
+                edits.append((*span(node), WINDOW_SIZE_REPLACEMENTS[node.property.name],
+                              "window_size", "Uses window dimensions"))
+
+        # animate() inside animate itself is recursion, not a top-level call
+        edits = [
+            edit for edit in edits
+            if edit[3] != "animate_call" or not any(s <= edit[0] and edit[1] <= e for s, e in animate_ranges)
+        ]
+        return edits, has_animate and not has_return
+
+    def _drop_nested(self, edits: List[Tuple[int, int, str, str, str]]) -> List[Tuple[int, int, str, str, str]]:
+        """Keep edits in source order; an edit inside one already kept is redundant."""
+        kept = []
+        for edit in sorted(edits, key=lambda e: (e[0], -e[1])):
+            if kept and edit[0] < kept[-1][1]:
+                continue
+            kept.append(edit)
+        return kept
+
+    def _apply_edits(self, code: str, edits: List[Tuple[int, int, str, str, str]]) -> str:
+        for start, end, replacement, _, _ in reversed(edits):
+            if not replacement:
+                # Drop the whole line when the statement was the only thing on it
+                line_start = code.rfind("\n", 0, start) + 1
+                line_end = code.find("\n", end)
+                line_end = len(code) if line_end == -1 else line_end
+                if not code[line_start:start].strip() and not code[end:line_end].strip():
+                    start, end = line_start, min(line_end + 1, len(code))
+            code = code[:start] + replacement + code[end:]
+        return code
+
+    def _unwrap_iife(self, nodes: List, code: str) -> Optional[str]:
+        """Body of a code-wide (function () { ... })() wrapper, if that is all the code is."""
+        top_level = _top_level(nodes)
+        if len(top_level) != 1 or top_level[0].type != "ExpressionStatement":
+            return None
+        call = top_level[0].expression
+        if call.type != "CallExpression" or call.arguments \
+                or call.callee.type not in ("FunctionExpression", "ArrowFunctionExpression") \
+                or call.callee.body.type != "BlockStatement":
+            return None
+        offset = len(WRAPPER_PREFIX)
+        start, end = call.callee.body.range
+        return code[start - offset + 1:end - offset - 1].strip()
+
+    def _run(self, code: str) -> JSGateResult:
+        nodes, error = self._parse(code)
+        if nodes is None:
+            return self._parse_failure(code, error)
+
+        rules = []
+        inner = self._unwrap_iife(nodes, code)
+        if inner is not None:
+            print("Warning: Removed IIFE wrapper from generated code")
+            rules.append("iife")
+            code = inner
+            nodes, error = self._parse(code)
+            if nodes is None:
+                return self._parse_failure(code, error, rules)
+
+        edits, needs_return = self._collect_edits(nodes, code)
+        edits = self._drop_nested(edits)
+        violations = []
+        for _, _, _, rule, violation in edits:
+            rules.append(rule)
+            if violation not in violations:
+                violations.append(violation)
+
+        if edits:
+            code = self._apply_edits(code, edits)
+            if violations:
+                code = f"// WARNING: Fixed violations: {', '.join(violations)}\n\n" + code
+        if needs_return:
+            rules.append("return_animate")
+            code = code.rstrip() + "\n\nreturn animate;"
+
+        if edits or needs_return:
+            # Confirm the rewrites left valid code
+            _, error = self._parse(code)
+            if error:
+                return JSGateResult(code, parsed=False, error=f"after fixes, {error}", rules=rules)
+
+        return JSGateResult(code, parsed=True, violations=violations, rules=rules)
+
+    def check(self, code: str) -> JSGateResult:
+        """Parse-check and fix code; parsed is None when esprima is not installed or cannot judge the code."""
+        if not self.available:
+            return JSGateResult(code, parsed=None)
+
+        start = time.perf_counter()
+        key = hashlib.sha1(code.encode("utf-8")).hexdigest()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+
+        if cached is None:
+            result = self._run(code)
+            with self._lock:
+                self._cache[key] = result
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        else:
+            result = cached
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.stats["checks"] += 1
+            self.stats["cache_hits"] += 1 if cached is not None else 0
+            self.stats["parse_failures"] += 1 if result.parsed is False else 0
+            self.stats["unverified"] += 1 if result.parsed is None else 0
+            for rule in result.rules:
+                self.rule_hits[rule] = self.rule_hits.get(rule, 0) + 1
+            self._timings_ms.append(elapsed_ms)
+
+        return JSGateResult(result.code, result.parsed, result.error, result.violations,
+                            result.rules, elapsed_ms, cached=cached is not None)
+
+    def record_repair(self, success: bool):
+        """Count a repair request made for code that failed to parse."""
+        with self._lock:
+            self.stats["repairs"] += 1
+            self.stats["repaired"] += 1 if success else 0
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            timings = sorted(self._timings_ms)
+            stats = dict(self.stats)
+            rule_hits = dict(self.rule_hits)
+
+        def percentile(p: float) -> float:
+            if not timings:
+                return 0.0
+            return round(timings[min(len(timings) - 1, int(len(timings) * p / 100))], 3)
+
+        return {
+            "parser_available": self.available,
+            **stats,
+            "latency_ms": {
+                "p50": percentile(50),
+                "p90": percentile(90),
+                "p99": percentile(99),
+                "max": round(timings[-1], 3) if timings else 0.0,
+            },
+            "rule_hits": rule_hits,
+        }
@@ -0,0 +1,347 @@
+import os
+import re
+import json
+import math
+import time
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.khan_video import KHAN_CHANNEL_ID, parse_duration
+
+# Words that say nothing about which video fits
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it",
+    "of", "on", "or", "the", "to", "with", "what", "khan", "academy", "video", "videos",
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Titles count double in the lexical score
+TITLE_WEIGHT = 2.0
+
+
+def _stem(token: str) -> str:
+    # Plural folding is enough to match "configurations" with "configuration"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def _tokens(text: str) -> List[str]:
+    return [_stem(t) for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def _embedding_text(video: Dict) -> str:
+    return f"{video['title']}. {video['description'][:300]}"
+
+
+class KhanCatalog:
+    """Local index of the Khan Academy channel's videos.
+
+    Videos live in a SQLite file together with their embeddings (same
+    sentence model as the RAG cache). Searches run in memory. A video's
+    score mixes cosine similarity with the topic and the idf-weighted
+    share of topic words found in its title and description. A match
+    counts as confident when it clears min_score and leads the runner-up
+    by min_margin; anything less is left to the live API.
+    """
+
+    def __init__(self, db_path: Optional[str] = None,
+                 embed_fn: Optional[Callable[[List[str]], Sequence]] = None,
+                 vector_weight: float = 0.6, min_score: Optional[float] = None,
+                 min_margin: float = 0.02):
+        self.db_path = db_path or os.getenv("KHAN_CATALOG_DB", os.path.join("cache", "khan_catalog.db"))
+        self.embed_fn = embed_fn
+        self.vector_weight = vector_weight if embed_fn is not None else 0.0
+        self.min_score = min_score if min_score is not None else float(os.getenv("KHAN_CATALOG_MIN_SCORE", "0.55"))
+        self.min_margin = min_margin
+        self._lock = threading.Lock()
+
+        self.videos: List[Dict] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._postings: Dict[str, List[Tuple[int, float]]] = {}
+        self._idf: Dict[str, float] = {}
+
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._init_db()
+        self.load()
+
+    def _init_db(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS videos (
+                video_id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                description TEXT,
+                duration TEXT,
+                published_at TEXT,
+                embedding BLOB,
+                synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS sync_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def upsert(self, videos: List[Dict]):
+        """Store videos, embedding them in one batch when an embedder is set."""
+        if not videos:
+            return
+        embeddings = [None] * len(videos)
+        if self.embed_fn is not None:
+            vectors = np.asarray(self.embed_fn([_embedding_text(v) for v in videos]), dtype=np.float32)
+            embeddings = [vector.tobytes() for vector in vectors]
+
+        conn = sqlite3.connect(self.db_path)
+        conn.executemany('''
+            INSERT OR REPLACE INTO videos
+            (video_id, title, description, duration, published_at, embedding, synced_at)
+            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', [
+            (v["video_id"], v["title"], v["description"], v.get("duration"), v.get("published_at"), e)
+            for v, e in zip(videos, embeddings)
+        ])
+        conn.commit()
+        conn.close()
+
+    def set_state(self, key: str, value: str):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, value))
+        conn.commit()
+        conn.close()
+
+    def get_state(self, key: str) -> Optional[str]:
+        conn = sqlite3.connect(self.db_path)
+        row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    def load(self):
+        """(Re)build the in-memory vector matrix and inverted index from the database."""
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute('''
+            SELECT video_id, title, description, duration, published_at, embedding FROM videos
+        ''').fetchall()
+        conn.close()
+
+        videos = []
+        vectors = []
+        postings: Dict[str, List[Tuple[int, float]]] = {}
+        for i, (video_id, title, description, duration, published_at, embedding) in enumerate(rows):
+            videos.append({
+                "video_id": video_id,
+                "title": title,
+                "description": description or "",
+                "duration": duration,
+                "published_at": published_at,
+            })
+            if embedding is not None:
+                vectors.append(np.frombuffer(embedding, dtype=np.float32))
+
+            weights: Dict[str, float] = {}
+            for token in _tokens(title):
+                weights[token] = TITLE_WEIGHT
+            for token in _tokens(description or ""):
+                weights.setdefault(token, 1.0)
+            for token, weight in weights.items():
+                postings.setdefault(token, []).append((i, weight))
+
+        matrix = None
+        if vectors and len(vectors) == len(videos):
+            matrix = np.stack(vectors)
+            matrix /= np.linalg.norm(matrix, axis=1, keepdims=True).clip(min=1e-12)
+
+        total = max(len(videos), 1)
+        idf = {token: math.log(1 + total / len(docs)) for token, docs in postings.items()}
+
+        with self._lock:
+            self.videos = videos
+            self._matrix = matrix
+            self._postings = postings
+            self._idf = idf
+        print(f"📚 Khan catalog loaded: {len(videos)} videos"
+              f"{' with embeddings' if matrix is not None else ''}")
+
+    def __len__(self) -> int:
+        return len(self.videos)
+
+    def search(self, topic: str, k: int = 5) -> List[Dict]:
+        """Rank videos for a topic; each result carries score, vector and lexical parts."""
+        with self._lock:
+            videos, matrix, postings, idf = self.videos, self._matrix, self._postings, self._idf
+        if not videos:
+            return []
+
+        # Lexical: idf-weighted share of topic words found in the video, 1.0
+        # when all of them are in the title. Unknown words get the highest idf
+        # so gibberish does not look like a match.
+        query_tokens = set(_tokens(topic))
+        max_idf = math.log(1 + len(videos))
+        total_idf = sum(idf.get(t, max_idf) for t in query_tokens) or 1.0
+        lexical = np.zeros(len(videos), dtype=np.float32)
+        for token in query_tokens:
+            for row, weight in postings.get(token, []):
+                lexical[row] += idf[token] * weight
+        lexical /= total_idf * TITLE_WEIGHT
+
+        vector = np.zeros(len(videos), dtype=np.float32)
+        vector_weight = self.vector_weight if matrix is not None else 0.0
+        if vector_weight:
+            query = np.asarray(self.embed_fn([topic]), dtype=np.float32)[0]
+            query /= np.linalg.norm(query) or 1.0
+            vector = matrix @ query
+
+        scores = vector_weight * vector + (1 - vector_weight) * lexical
+        top = np.argsort(-scores)[:k]
+        return [
+            {
+                **videos[i],
+                "score": float(scores[i]),
+                "vector_score": float(vector[i]),
+                "lexical_score": float(lexical[i]),
+            }
+            for i in top
+        ]
+
+    def best_match(self, topic: str) -> Tuple[Optional[Dict], bool]:
+        """Return (best video or None, whether it is confident enough to skip the live API)."""
+        results = self.search(topic, k=2)
+        if not results:
+            return None, False
+        best = results[0]
+        margin = best["score"] - results[1]["score"] if len(results) > 1 else best["score"]
+        confident = best["score"] >= self.min_score and margin >= self.min_margin
+        return best, confident
+
+
+class CatalogSync:
+    """Page the channel's uploads playlist into a KhanCatalog.
+
+    Listing uploads costs one quota unit per 50 videos (playlistItems.list
+    and videos.list), against 100 units for every search.list call.
+    """
+
+    def __init__(self, youtube, catalog: KhanCatalog, channel_id: str = KHAN_CHANNEL_ID):
+        self.youtube = youtube
+        self.catalog = catalog
+        self.channel_id = channel_id
+
+    def _uploads_playlist(self) -> str:
+        response = self.youtube.channels().list(id=self.channel_id, part="contentDetails").execute()
+        return response["items"][0]["contentDetails"]["relatedPlaylists"]["uploads"]
+
+    def _durations(self, video_ids: List[str]) -> Dict[str, Optional[str]]:
+        response = self.youtube.videos().list(id=",".join(video_ids), part="contentDetails").execute()
+        return {
+            item["id"]: parse_duration(item["contentDetails"].get("duration", ""))
+            for item in response.get("items", [])
+        }
+
+    def run(self, max_pages: Optional[int] = None) -> Dict:
+        start = time.time()
+        playlist_id = self._uploads_playlist()
+        page_token = None
+        pages = 0
+        stored = 0
+        skipped = 0
+
+        while True:
+            response = self.youtube.playlistItems().list(
+                playlistId=playlist_id,
+                part="snippet",
+                maxResults=50,
+                pageToken=page_token
+            ).execute()
+            pages += 1
+
+            videos = []
+            for item in response.get("items", []):
+                snippet = item["snippet"]
+                if snippet["title"] in ("Private video", "Deleted video"):
+                    skipped += 1
+                    continue
+                videos.append({
+                    "video_id": snippet["resourceId"]["videoId"],
+                    "title": snippet["title"],
+                    "description": snippet.get("description", ""),
+                    "published_at": snippet.get("publishedAt"),
+                })
+
+            if videos:
+                durations = self._durations([v["video_id"] for v in videos])
+                for video in videos:
+                    video["duration"] = durations.get(video["video_id"])
+                self.catalog.upsert(videos)
+                stored += len(videos)
+            print(f"  page {pages}: {stored} videos stored")
+
+            page_token = response.get("nextPageToken")
+            if not page_token or (max_pages and pages >= max_pages):
+                break
+
+        self.catalog.set_state("last_sync", json.dumps({"at": time.time(), "videos": stored}))
+        self.catalog.load()
+        summary = {
+            "pages": pages,
+            "stored": stored,
+            "skipped": skipped,
+            "catalog_size": len(self.catalog),
+            "elapsed": time.time() - start,
+        }
+        print(f"✅ Catalog sync done: {stored} videos from {pages} pages in {summary['elapsed']:.1f}s")
+        return summary
+
+
+class _Recorded:
+    def __init__(self, response: Dict):
+        self._response = response
+
+    def execute(self) -> Dict:
+        return self._response
+
+
+class _RecordedCollection:
+    def __init__(self, handler: Callable[..., Dict]):
+        self._handler = handler
+
+    def list(self, **kwargs) -> _Recorded:
+        return _Recorded(self._handler(**kwargs))
+
+
+class RecordedYouTube:
+    """Replays a recorded catalog fixture through the client calls CatalogSync makes.
+
+    Fixture shape: {"channel": <channels.list response>, "playlist_pages":
+    [<playlistItems.list responses in order>], "videos": <videos.list
+    response covering every video>}.
+    """
+
+    def __init__(self, fixture_path: str):
+        with open(fixture_path, "r", encoding="utf-8") as f:
+            self.fixture = json.load(f)
+        self._pages = {None: 0}
+        for i, page in enumerate(self.fixture["playlist_pages"]):
+            if page.get("nextPageToken"):
+                self._pages[page["nextPageToken"]] = i + 1
+        self._videos = {item["id"]: item for item in self.fixture["videos"]["items"]}
+
+    def channels(self) -> _RecordedCollection:
+        return _RecordedCollection(lambda **kwargs: self.fixture["channel"])
+
+    def playlistItems(self) -> _RecordedCollection:
+        return _RecordedCollection(
+            lambda pageToken=None, **kwargs: self.fixture["playlist_pages"][self._pages[pageToken]]
+        )
+
+    def videos(self) -> _RecordedCollection:
+        return _RecordedCollection(lambda id, **kwargs: {
+            "items": [self._videos[v] for v in id.split(",") if v in self._videos]
+        })
@@ -0,0 +1,213 @@
+import os
+import re
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# Khan Academy's YouTube channel ID
+KHAN_CHANNEL_ID = "UC4a-Gbdw7vOaccHmFo40b9g"
+
+
+class KhanVideoNotFound(LookupError):
+    """No Khan Academy video matched the topic."""
+
+
+def parse_duration(iso_duration: str) -> Optional[str]:
+    """Convert ISO 8601 duration (PT4M13S) to readable format (4:13)."""
+    if not iso_duration:
+        return None
+
+    # Parse PT4M13S format
+    match = re.match(r'PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?', iso_duration)
+    if not match:
+        return None
+
+    hours, minutes, seconds = match.groups()
+
+    # Convert to readable format
+    if hours:
+        return f"{hours}:{minutes or '00'}:{seconds or '00'}"
+    elif minutes:
+        return f"{minutes}:{seconds.zfill(2) if seconds else '00'}"
+    else:
+        return f"0:{seconds or '00'}"
+
+
+def _normalize_topic(topic: str) -> str:
+    return " ".join(topic.lower().split())
+
+
+def _video_result(title: str, video_id: str, description: str, duration: Optional[str], source: str) -> Dict:
+    return {
+        "title": title,
+        "url": f"https://youtube.com/watch?v={video_id}",
+        "description": description[:200] + "..." if len(description) > 200 else description,
+        "duration": duration,
+        "source": source,
+    }
+
+
+class KhanVideoFinder:
+    """Find the best Khan Academy video for a topic via the YouTube Data API.
+
+    The API client is built from the discovery document bundled with
+    google-api-python-client, which is loaded once. Each worker thread
+    gets its own client because the underlying httplib2 connection is not
+    thread-safe. The blocking .execute() calls run in worker threads so
+    they never stall the event loop. Results, including "not found", are
+    cached per normalised topic for cache_ttl seconds. Concurrent requests
+    for the same topic share one API lookup. With a KhanCatalog attached,
+    confident local matches are answered without calling the API. With a
+    Bulkhead attached, only the API lookups are admission-controlled.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, cache_ttl: Optional[float] = None,
+                 cache_size: int = 1024, catalog=None, bulkhead=None):
+        self.api_key = api_key
+        # Optional app.admission.Bulkhead; raises Overloaded when it sheds
+        self.bulkhead = bulkhead
+        # Optional KhanCatalog; confident local matches skip the API entirely
+        self.catalog = catalog
+        self.cache_ttl = cache_ttl if cache_ttl is not None else float(
+            os.getenv("KHAN_VIDEO_CACHE_TTL", str(24 * 3600))
+        )
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._local = threading.local()
+        self._discovery_doc: Optional[str] = None
+        self._doc_lock = threading.Lock()
+        self.stats = {"requests": 0, "cache_hits": 0, "catalog_hits": 0, "api_lookups": 0, "api_calls": 0}
+
+    def get_api_key(self) -> Optional[str]:
+        key = self.api_key or os.getenv("YOUTUBE_API_KEY")
+        return key.strip() if key and key.strip() else None
+
+    def _youtube(self):
+        """YouTube client for the current thread, built from the cached discovery document."""
+        youtube = getattr(self._local, "youtube", None)
+        if youtube is None:
+            # googleapiclient is slow to import; only pay for it on first use
+            from googleapiclient.discovery import build_from_document
+            from googleapiclient.discovery_cache import get_static_doc
+            with self._doc_lock:
+                if self._discovery_doc is None:
+                    self._discovery_doc = get_static_doc("youtube", "v3")
+            youtube = build_from_document(self._discovery_doc, developerKey=self.get_api_key())
+            self._local.youtube = youtube
+        return youtube
+
+    def _lookup(self, topic: str) -> Optional[Dict]:
+        """Blocking search + details lookup; runs in a worker thread."""
+        youtube = self._youtube()
+
+        # Search for videos in Khan Academy channel
+        search_response = youtube.search().list(
+            q=f"Khan Academy {topic}",
+            channelId=KHAN_CHANNEL_ID,
+            part="snippet",
+            maxResults=5,
+            order="relevance",
+            type="video"
+        ).execute()
+        self.stats["api_calls"] += 1
+
+        if not search_response.get('items'):
+            return None
+
+        # Get the best match (first result is most relevant)
+        best_video = search_response['items'][0]
+        video_id = best_video['id']['videoId']
+
+        # Get additional video details (duration, etc.)
+        video_details = youtube.videos().list(
+            part="contentDetails",
+            id=video_id
+        ).execute()
+        self.stats["api_calls"] += 1
+
+        duration = None
+        if video_details.get('items'):
+            duration = parse_duration(video_details['items'][0]['contentDetails'].get('duration', ''))
+
+        return _video_result(best_video['snippet']['title'], video_id,
+                             best_video['snippet']['description'], duration, "api")
+    
+    def has_source(self) -> bool:
+        """Whether lookups can be answered at all (API key or a non-empty catalog)."""
+        return bool(self.get_api_key()) or (self.catalog is not None and len(self.catalog) > 0)
+
+    async def _resolve(self, topic: str) -> Optional[Dict]:
+        """Answer from the local catalog when confident, otherwise from the live API."""
+        if self.catalog is not None and len(self.catalog):
+            best, confident = await asyncio.to_thread(self.catalog.best_match, topic)
+            # Without an API key the best local match is all there is
+            if best is not None and (confident or not self.get_api_key()):
+                self.stats["catalog_hits"] += 1
+                return _video_result(best["title"], best["video_id"], best["description"],
+                                     best["duration"], "catalog")
+
+        self.stats["api_lookups"] += 1
+        if self.bulkhead is None:
+            return await asyncio.to_thread(self._lookup, topic)
+        async with self.bulkhead.slot():
+            return await asyncio.to_thread(self._lookup, topic)
+
+    def _cached(self, key: str) -> tuple:
+        """(hit, value) for a topic key, dropping expired entries."""
+        entry = self._cache.get(key)
+        if entry is None:
+            return False, None
+        stored_at, value = entry
+        if time.time() - stored_at > self.cache_ttl:
+            del self._cache[key]
+            return False, None
+        self._cache.move_to_end(key)
+        return True, value
+
+    def _store(self, key: str, value: Optional[Dict]):
+        self._cache[key] = (time.time(), value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def find(self, topic: str) -> Dict:
+        """Return the best video for topic or raise KhanVideoNotFound."""
+        self.stats["requests"] += 1
+        key = _normalize_topic(topic)
+
+        hit, video = self._cached(key)
+        if hit:
+            self.stats["cache_hits"] += 1
+        else:
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                video = await asyncio.shield(inflight)
+            else:
+                future = asyncio.get_running_loop().create_future()
+                self._inflight[key] = future
+                try:
+                    video = await self._resolve(topic)
+                    self._store(key, video)
+                    future.set_result(video)
+                except Exception as e:
+                    future.set_exception(e)
+                    # Mark the exception as retrieved when nobody else was waiting
+                    future.exception()
+                    raise
+                finally:
+                    del self._inflight[key]
+
+        if video is None:
+            raise KhanVideoNotFound(f"No Khan Academy videos found for topic: {topic}")
+        return dict(video)
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            "cache_size": len(self._cache),
+            "cache_ttl": self.cache_ttl,
+            "catalog_size": len(self.catalog) if self.catalog is not None else 0,
+        }
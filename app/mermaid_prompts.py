@@ -0,0 +1,459 @@
+from typing import Dict, List
+
+# Sent with every diagram request, ahead of the type-specific slice.
+MERMAID_CORE_PROMPT = """You are an expert at creating Mermaid diagrams. Your task is to generate valid Mermaid syntax based on user requests.
+
+CRITICAL RULES:
+1. ONLY return valid Mermaid diagram syntax
+2. DO NOT include markdown code blocks (```mermaid or ```)
+3. DO NOT include any explanations or additional text
+4. The output should be ready to render directly in a Mermaid renderer
+5. Start directly with the diagram type declaration
+
+FORMATTING RULES:
+- Use clear, descriptive node labels
+- Include proper connectors and relationships
+- Use appropriate styling when helpful
+- Keep diagrams readable and well-structured
+- Use standard Mermaid syntax only
+
+Return ONLY the Mermaid diagram code, nothing else."""
+
+MERMAID_TYPE_DESCRIPTIONS: Dict[str, str] = {
+    "flowchart": "For process flows, decision trees, workflows",
+    "sequenceDiagram": "For interaction sequences between entities",
+    "classDiagram": "For UML class relationships",
+    "stateDiagram-v2": "For state machines and transitions",
+    "erDiagram": "For entity-relationship diagrams",
+    "journey": "For user journey mapping",
+    "gantt": "For project timelines and schedules",
+    "pie": "For percentage/distribution visualization",
+    "quadrantChart": "For 2x2 matrix analysis",
+    "requirementDiagram": "For requirement specifications",
+    "gitGraph": "For Git workflow visualization",
+    "C4Context": "For C4 architecture context diagrams",
+    "mindmap": "For hierarchical mind maps",
+    "timeline": "For chronological events",
+    "zenuml": "For ZenUML sequence diagrams",
+    "sankey-beta": "For flow and energy diagrams",
+    "xychart-beta": "For bar and line charts",
+    "block-beta": "For block/grid layouts",
+    "packet-beta": "For network packet structures",
+    "kanban": "For task boards",
+    "architecture-beta": "For system architecture",
+    "radar-beta": "For spider/skills charts",
+    "treemap-beta": "For hierarchical data visualization",
+}
+
+MERMAID_EXAMPLES: Dict[str, str] = {
+    "flowchart": """Flowchart:
+flowchart TD
+    A[Start] --> B{Decision}
+    B -->|Yes| C[Action 1]
+    B -->|No| D[Action 2]
+    C --> E[End]
+    D --> E
+
+Flowchart with Subgraphs:
+flowchart TD
+    A[Start] --> B{Check User}
+    B -->|Valid| C[Process Request]
+    B -->|Invalid| D[Return Error]
+    
+    subgraph Authentication
+        C --> E[Validate Token]
+        E --> F[Check Permissions]
+    end
+    
+    subgraph Processing
+        F --> G[Execute Logic]
+        G --> H[Prepare Response]
+    end
+    
+    H --> I[End]
+    D --> I
+
+Flowchart with Color Styling:
+flowchart TD
+    A[Start]:::startStyle --> B{Check Input}
+    B -->|Valid| C[Process Data]:::processStyle
+    B -->|Invalid| D[Show Error]:::errorStyle
+    C --> E[Save Results]:::successStyle
+    D --> F[End]:::endStyle
+    E --> F
+    
+    classDef startStyle fill:#e1f5fe,stroke:#01579b,stroke-width:2px,color:#000
+    classDef processStyle fill:#f3e5f5,stroke:#4a148c,stroke-width:2px,color:#000
+    classDef errorStyle fill:#ffebee,stroke:#c62828,stroke-width:2px,color:#000
+    classDef successStyle fill:#e8f5e8,stroke:#2e7d32,stroke-width:2px,color:#000
+    classDef endStyle fill:#f5f5f5,stroke:#424242,stroke-width:2px,color:#000""",
+    "sequenceDiagram": """Sequence Diagram:
+sequenceDiagram
+    participant A as Alice
+    participant B as Bob
+    A->>B: Hello Bob
+    B-->>A: Hello Alice""",
+    "classDiagram": """Class Diagram:
+classDiagram
+    class Animal {
+        +String name
+        +int age
+        +makeSound()
+    }
+    class Dog {
+        +bark()
+    }
+    class Cat {
+        +meow()
+    }
+    Animal <|-- Dog : inherits
+    Animal <|-- Cat : inherits
+
+Class Diagram with Relationships:
+classDiagram
+    class User {
+        -String userId
+        -String name
+        +login()
+        +logout()
+    }
+    class Order {
+        -String orderId
+        -Date orderDate
+        +createOrder()
+        +cancelOrder()
+    }
+    class Product {
+        -String productId
+        -String name
+        -Double price
+    }
+    class ShoppingCart {
+        -List~Product~ items
+        +addItem()
+        +removeItem()
+    }
+    
+    %% Relationships in Class Diagrams:
+    %% Association: --> 
+    %% Inheritance: <|--
+    %% Composition: *--
+    %% Aggregation: o--
+    %% Implementation: <|..
+    %% Dependency: <..
+    %% With multiplicity: "1" --> "*"
+    
+    User "1" --> "*" Order : places
+    Order "*" --> "*" Product : contains
+    User "1" --> "1" ShoppingCart : has
+    ShoppingCart "1" o-- "*" Product : contains
+    
+    %% IMPORTANT: Do NOT use ER diagram syntax like ||--o{ in class diagrams!
+    %% That syntax is ONLY for erDiagram type""",
+    "stateDiagram-v2": """State Diagram:
+stateDiagram-v2
+    [*] --> Idle
+    Idle --> Processing : Start
+    Processing --> Error : Failed
+    Processing --> Success : Completed
+    Error --> Idle : Reset
+    Success --> [*]""",
+    "erDiagram": """Entity Relationship Diagram:
+erDiagram
+    CUSTOMER ||--o{ ORDER : places
+    ORDER ||--|{ LINE-ITEM : contains
+    CUSTOMER {
+        string name
+        string address
+        string phone
+    }
+    ORDER {
+        int orderNumber
+        date orderDate
+    }""",
+    "journey": """User Journey:
+journey
+    title My working day
+    section Go to work
+      Make tea: 5: Me
+      Go upstairs: 3: Me
+      Do work: 1: Me, Cat
+    section Go home
+      Go downstairs: 5: Me
+      Sit down: 5: Me""",
+    "gantt": """Gantt Chart:
+gantt
+    title Project Timeline
+    dateFormat YYYY-MM-DD
+    section Design
+    UI Design           :done,    des1, 2024-01-01, 2024-01-07
+    Database Design     :active,  des2, 2024-01-04, 7d
+    section Development
+    Backend API         :         dev1, after des2, 10d
+    Frontend            :         dev2, after dev1, 10d""",
+    "pie": """Pie Chart:
+pie title Sales Distribution
+    "Product A" : 35
+    "Product B" : 25
+    "Product C" : 20
+    "Product D" : 20""",
+    "quadrantChart": """Quadrant Chart:
+quadrantChart
+    title Reach and engagement of campaigns
+    x-axis Low Reach --> High Reach
+    y-axis Low Engagement --> High Engagement
+    quadrant-1 We should expand
+    quadrant-2 Need to promote
+    quadrant-3 Re-evaluate
+    quadrant-4 May be improved
+    Campaign A: [0.3, 0.6]
+    Campaign B: [0.45, 0.23]
+    Campaign C: [0.57, 0.69]
+    Campaign D: [0.78, 0.34]""",
+    "requirementDiagram": """Requirement Diagram:
+requirementDiagram
+    requirement test_req {
+    id: 1
+    text: the test text.
+    risk: high
+    verifymethod: test
+    }
+    element test_entity {
+    type: simulation
+    }
+    test_entity - satisfies -> test_req""",
+    "gitGraph": """GitGraph:
+gitGraph:
+    commit
+    branch develop
+    commit
+    commit
+    checkout main
+    merge develop
+    commit
+    branch feature
+    commit
+    commit
+    checkout main
+    merge feature""",
+    "C4Context": """C4 Diagram:
+C4Context
+    title System Context diagram for Internet Banking System
+    Person(customerA, "Banking Customer", "A customer of the bank")
+    System(SystemAA, "Internet Banking System", "Allows customers to view information")
+    System_Ext(SystemC, "E-mail system", "The internal email system")
+    Rel(customerA, SystemAA, "Uses")
+    Rel(SystemAA, SystemC, "Sends e-mails", "SMTP")""",
+    "mindmap": """Mindmap:
+mindmap
+  root((mindmap))
+    Origins
+      Long history
+      Popularisation
+        British popular psychology author Tony Buzan
+    Research
+      On effectiveness<br/>and features
+      On Automatic creation
+        Uses
+            Creative techniques
+            Strategic planning
+            Argument mapping""",
+    "timeline": """Timeline:
+timeline
+    title History of Social Media
+    2002 : LinkedIn
+    2004 : Facebook
+    2005 : YouTube
+    2006 : Twitter
+    2010 : Instagram
+    2011 : Snapchat""",
+    "zenuml": """ZenUML:
+zenuml
+    title Order Processing
+    Customer.placeOrder() {
+        OrderService.validateOrder()
+        if(valid) {
+            PaymentService.processPayment()
+            if(success) {
+                InventoryService.reserveItems()
+                ShippingService.scheduleDelivery()
+                return "Order confirmed"
+            } else {
+                return "Payment failed"
+            }
+        } else {
+            return "Invalid order"
+        }
+    }""",
+    "sankey-beta": """Sankey:
+sankey-beta
+    Electricity,Residential,80
+    Electricity,Commercial,65  
+    Electricity,Industrial,75
+    Residential,Heating,45
+    Residential,Cooling,25
+    Residential,Appliances,10""",
+    "xychart-beta": """XY Chart:
+xychart-beta
+    title "Sales Revenue"
+    x-axis [jan, feb, mar, apr, may, jun, jul]
+    y-axis "Revenue (in $)" 0 --> 10000
+    bar [5000, 6000, 7500, 8200, 9500, 10000, 8500]
+    line [4000, 5000, 6000, 7000, 8000, 9000, 8000]""",
+    "block-beta": """Block Diagram:
+block-beta
+columns 3
+  A B C
+  D E F
+  G H I
+
+Block Diagram with Labels:
+block-beta
+columns 3
+  A["Block A"] B["Block B"] C["Block C"]
+  D["Block D"] E["Block E"] F["Block F"]
+
+Block Diagram Simple Layout:
+block-beta
+  Frontend Backend Database
+  Mobile API Cache""",
+    "packet-beta": """Packet Diagram:
+packet-beta
+    title Packet Structure
+    0-7: "Version"
+    8-15: "Type"
+    16-31: "Length"
+    32-63: "Payload\"""",
+    "kanban": """Kanban:
+kanban
+  Todo
+    [Create README]
+    [Write Tests]
+  In Progress
+    [Implement Feature A]
+    [Fix Bug #123]
+  Done
+    [Deploy to Production]
+    [Update Documentation]""",
+    "architecture-beta": """Architecture:
+architecture-beta
+    group public_api(cloud)[Public API]
+    group private_api(server)[Private API]
+    
+    service web(database)[Web Server] in public_api
+    service api(server)[API Gateway] in public_api
+    service database1(database)[Database] in private_api
+    service cache1(disk)[Cache] in private_api
+    
+    web:R --> L:api
+    api:B --> T:database1
+    api:B --> T:cache1""",
+    "radar-beta": """Radar Chart:
+radar-beta
+    title Skills Assessment
+    axis communication["Communication"], technical["Technical"], leadership["Leadership"]
+    axis problemSolving["Problem Solving"], creativity["Creativity"]
+    
+    curve alice["Alice"]{90, 85, 80, 88, 75}
+    curve bob["Bob"]{75, 90, 85, 80, 82}
+    
+    graticule circle
+    max 100
+
+Radar Chart Restaurant Example:
+radar-beta
+    title Restaurant Comparison
+    axis food["Food Quality"], service["Service"], price["Price"]
+    axis ambiance["Ambiance"]
+    
+    curve a["Restaurant A"]{4, 3, 2, 4}
+    curve b["Restaurant B"]{3, 4, 3, 3}
+    curve c["Restaurant C"]{2, 3, 4, 2}
+    curve d["Restaurant D"]{2, 2, 4, 3}
+    
+    graticule polygon
+    max 5""",
+    "treemap-beta": """Treemap:
+treemap-beta
+    "Section 1"
+        "Leaf 1.1": 12
+        "Section 1.2"
+            "Leaf 1.2.1": 12
+    "Section 2"
+        "Leaf 2.1": 20
+        "Leaf 2.2": 25""",
+}
+
+_CLASS_VS_ER_RULES = """CLASS DIAGRAMS vs ER DIAGRAMS - DO NOT CONFUSE THEM:
+- classDiagram uses: -->, <|--, *--, o--, <|.., <.., with optional multiplicity like "1" --> "*"
+- erDiagram uses: ||--o{, ||--||, }o--||, etc.
+- NEVER use ER syntax (||--o{) in a class diagram!
+- NEVER use class syntax (-->) in an ER diagram!"""
+
+MERMAID_TYPE_RULES: Dict[str, str] = {
+    "flowchart": """- For complex flowcharts, consider using subgraphs to group related nodes:
+  subgraph GroupName
+      node1 --> node2
+  end
+- Subgraphs help organize complex processes and improve diagram readability
+- When using colors in flowcharts, ensure proper contrast:
+  * Use light fill colors with dark text (color:#000 or color:#333)
+  * Use dark fill colors with light text (color:#fff or color:#f0f0f0)
+  * Apply styles with :::className syntax and define classDef
+  * Example: classDef errorStyle fill:#ffebee,stroke:#c62828,color:#000
+- Color coding helps distinguish different types of nodes (start, process, error, success, end)""",
+    "classDiagram": _CLASS_VS_ER_RULES + """
+- Relationships between classes (like User and Order) use class syntax: User "1" --> "*" Order : places""",
+    "erDiagram": _CLASS_VS_ER_RULES + """
+- Relationships between entities (like User and Order) use ER syntax: User ||--o{ Order : places""",
+}
+
+
+# Smallest prompt prefix the provider's cache stores: 1024 tokens, 2048 on
+# Haiku models. A cache_control marker on anything shorter does nothing.
+MIN_CACHEABLE_TOKENS = 2048
+
+
+def _type_prompt(diagram_type: str) -> str:
+    """Examples and rules for one diagram type."""
+    sections = [
+        f"DIAGRAM TYPE: {diagram_type} - {MERMAID_TYPE_DESCRIPTIONS[diagram_type]}",
+        f"MERMAID SYNTAX EXAMPLES:\n\n{MERMAID_EXAMPLES[diagram_type]}",
+    ]
+    if diagram_type in MERMAID_TYPE_RULES:
+        sections.append(f"DIAGRAM-SPECIFIC RULES:\n{MERMAID_TYPE_RULES[diagram_type]}")
+    return "\n\n".join(sections)
+
+
+def _all_types_prompt() -> str:
+    """Every type's examples and rules, for diagram types we have no slice for."""
+    supported = "\n".join(f"- {t}: {d}" for t, d in MERMAID_TYPE_DESCRIPTIONS.items())
+    examples = "\n\n".join(MERMAID_EXAMPLES.values())
+    rules = "\n".join(MERMAID_TYPE_RULES.values())
+    return (f"SUPPORTED DIAGRAM TYPES:\n{supported}\n\n"
+            f"MERMAID SYNTAX EXAMPLES:\n\n{examples}\n\n"
+            f"DIAGRAM-SPECIFIC RULES:\n{rules}")
+
+
+def _estimated_tokens(text: str) -> int:
+    # About four characters per token; errs low for this code-heavy text
+    return len(text) // 4
+
+
+def build_system_blocks(diagram_type: str) -> List[Dict]:
+    """System prompt for one diagram type as content blocks.
+
+    The shared core comes first, then the examples and rules for the chosen
+    type only. A core plus one type's slice is a few hundred tokens, below
+    the minimum the prompt cache stores, so it is sent uncached. Only a
+    prompt that reaches MIN_CACHEABLE_TOKENS (the all-types fallback for an
+    unknown type) gets a cache breakpoint, on its last block.
+    """
+    type_prompt = _type_prompt(diagram_type) if diagram_type in MERMAID_EXAMPLES else _all_types_prompt()
+    blocks = [
+        {"type": "text", "text": MERMAID_CORE_PROMPT},
+        {"type": "text", "text": type_prompt},
+    ]
+    if _estimated_tokens(MERMAID_CORE_PROMPT + type_prompt) >= MIN_CACHEABLE_TOKENS:
+        blocks[-1]["cache_control"] = {"type": "ephemeral"}
+    return blocks
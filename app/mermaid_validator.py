@@ -0,0 +1,392 @@
+import re
+import time
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+# ER cardinality arrows (||--o{, }o--||, ...) are only valid in erDiagram
+ER_ARROW_PATTERN = re.compile(r"(?:\|\||\|o|o\||\}o|\}\|)(?:--|\.\.)(?:\|\||o\||\|o|o\{|\|\{)")
+
+ER_RELATION_PATTERN = re.compile(
+    r'^[\w\-"]+(?:\s+[\w\-"]+)*\s*(?:\|\||\|o|o\||\}o|\}\|)(?:--|\.\.)(?:\|\||o\||\|o|o\{|\|\{)\s*'
+    r'[\w\-"]+(?:\s+[\w\-"]+)*\s*:\s*\S.*$'
+)
+
+FLOWCHART_HEADER_PATTERN = re.compile(r"^(?:flowchart|graph)(?:\s+(?:TD|TB|BT|RL|LR))?\s*;?$")
+
+# An edge that ends (or starts) with a bare arrow is missing a node
+FLOWCHART_DANGLING_PATTERN = re.compile(r"(?:-->|---|==>|===|-\.->|-\.-|--o|--x)\s*(?:\|[^|]*\|)?\s*;?$")
+FLOWCHART_LEADING_ARROW_PATTERN = re.compile(r"^(?:-->|---|==>|-\.->)")
+
+CLASS_DANGLING_PATTERN = re.compile(r'(?:<\|--|\*--|o--|-->|--|\.\.>|\.\.\|>|\.\.)\s*(?:"[^"]*")?\s*$')
+
+SEQUENCE_ARROW_PATTERN = re.compile(r"(?:-->>|->>|-->|->|--x|-x|--\)|-\))")
+SEQUENCE_MISSING_TARGET_PATTERN = re.compile(SEQUENCE_ARROW_PATTERN.pattern + r"\s*[+-]?\s*:")
+SEQUENCE_BLOCKS = ("loop", "alt", "opt", "par", "critical", "break", "rect", "box")
+SEQUENCE_BLOCK_BRANCHES = ("else", "and", "option")
+SEQUENCE_KEYWORDS = ("participant", "actor", "note", "activate", "deactivate", "autonumber",
+                     "title", "create", "destroy", "links", "link", "properties", "details")
+
+GANTT_KEYWORDS = ("title", "dateformat", "axisformat", "tickinterval", "excludes", "includes",
+                  "todaymarker", "weekday", "weekend", "section", "inclusiveenddates", "topaxis",
+                  "displaymode", "click")
+
+PIE_SLICE_PATTERN = re.compile(r'^"[^"]*"\s*:\s*\d+(?:\.\d+)?$')
+
+QUOTED_PATTERN = re.compile(r'"[^"]*"')
+BRACKET_PAIRS = {"[": "]", "(": ")", "{": "}"}
+
+# Keeps the per-error list short enough to paste into a repair request
+MAX_ERRORS = 8
+
+
+class MermaidValidationResult:
+    """Outcome of validating one diagram."""
+
+    def __init__(self, diagram_type: str, errors: List[str], elapsed_us: float, checked: bool):
+        self.diagram_type = diagram_type
+        self.errors = errors
+        self.elapsed_us = elapsed_us
+        # False when the diagram type has no structural checks (header only)
+        self.checked = checked
+
+    @property
+    def valid(self) -> bool:
+        return not self.errors
+
+    def to_dict(self) -> Dict:
+        return {
+            "diagram_type": self.diagram_type,
+            "valid": self.valid,
+            "errors": self.errors,
+            "elapsed_us": round(self.elapsed_us, 1),
+            "checked": self.checked,
+        }
+
+
+def _body_lines(code: str) -> Tuple[str, List[Tuple[int, str]]]:
+    """Return the header line and the (line number, stripped text) body lines.
+
+    Front matter, %%{init}%% directives, comments and blank lines are skipped.
+    """
+    lines = code.split("\n")
+    i = 0
+    if lines and lines[0].strip() == "---":
+        i = 1
+        while i < len(lines) and lines[i].strip() != "---":
+            i += 1
+        i += 1
+
+    header = ""
+    body = []
+    for number in range(i, len(lines)):
+        stripped = lines[number].strip()
+        if not stripped or stripped.startswith("%%"):
+            continue
+        if not header:
+            header = stripped
+        else:
+            body.append((number + 1, stripped))
+    return header, body
+
+
+def _bracket_error(text: str) -> Optional[str]:
+    """Check [], () and {} nesting on one line, ignoring quoted labels."""
+    text = QUOTED_PATTERN.sub('""', text)
+    # Edge labels: -->|label|
+    text = re.sub(r"\|[^|]*\|", "", text)
+    # Asymmetric node shape: id>label]
+    text = re.sub(r"(\w)>", r"\1[", text)
+    stack = []
+    for char in text:
+        if char in BRACKET_PAIRS:
+            stack.append(BRACKET_PAIRS[char])
+        elif char in ")]}":
+            if not stack or stack.pop() != char:
+                return f"unbalanced '{char}'"
+    if stack:
+        return f"missing '{stack[-1]}'"
+    return None
+
+
+def _check_flowchart(header: str, body: List[Tuple[int, str]]) -> List[str]:
+    errors = []
+    if not FLOWCHART_HEADER_PATTERN.match(header):
+        errors.append(f"line 1: invalid flowchart header {header!r} (use e.g. 'flowchart TD')")
+
+    open_subgraphs: List[int] = []
+    for number, line in body:
+        first_word = line.split()[0]
+        if first_word == "subgraph":
+            open_subgraphs.append(number)
+            continue
+        if line == "end":
+            if not open_subgraphs:
+                errors.append(f"line {number}: 'end' without a matching 'subgraph'")
+            else:
+                open_subgraphs.pop()
+            continue
+        if first_word in ("classDef", "class", "style", "linkStyle", "click", "direction"):
+            continue
+
+        if ER_ARROW_PATTERN.search(line):
+            errors.append(f"line {number}: ER relationship arrow in a flowchart: {line!r}")
+            continue
+        if FLOWCHART_DANGLING_PATTERN.search(line):
+            errors.append(f"line {number}: edge has no target node: {line!r}")
+        elif FLOWCHART_LEADING_ARROW_PATTERN.match(line):
+            errors.append(f"line {number}: edge has no source node: {line!r}")
+        bracket_error = _bracket_error(line)
+        if bracket_error:
+            errors.append(f"line {number}: {bracket_error} in {line!r}")
+
+    for number in open_subgraphs:
+        errors.append(f"line {number}: 'subgraph' is never closed with 'end'")
+    return errors
+
+
+def _check_sequence(header: str, body: List[Tuple[int, str]]) -> List[str]:
+    errors = []
+    open_blocks: List[Tuple[int, str]] = []
+    for number, line in body:
+        first_word = line.split()[0].lower().rstrip(":")
+        if first_word in SEQUENCE_BLOCKS:
+            open_blocks.append((number, first_word))
+        elif first_word in SEQUENCE_BLOCK_BRANCHES:
+            if not open_blocks:
+                errors.append(f"line {number}: '{first_word}' outside of a block")
+        elif line == "end":
+            if not open_blocks:
+                errors.append(f"line {number}: 'end' without a matching block")
+            else:
+                open_blocks.pop()
+        elif first_word in SEQUENCE_KEYWORDS:
+            continue
+        elif SEQUENCE_ARROW_PATTERN.search(line):
+            if ":" not in line:
+                errors.append(f"line {number}: message has no ': text': {line!r}")
+            elif SEQUENCE_ARROW_PATTERN.match(line) or SEQUENCE_MISSING_TARGET_PATTERN.search(line):
+                errors.append(f"line {number}: message is missing a participant: {line!r}")
+        else:
+            errors.append(f"line {number}: unrecognised statement: {line!r}")
+
+    for number, block in open_blocks:
+        errors.append(f"line {number}: '{block}' block is never closed with 'end'")
+    if not body:
+        errors.append("diagram has no participants or messages")
+    return errors
+
+
+def _check_class(header: str, body: List[Tuple[int, str]]) -> List[str]:
+    errors = []
+    # Class and namespace blocks
+    open_blocks: List[int] = []
+    for number, line in body:
+        if ER_ARROW_PATTERN.search(line):
+            errors.append(
+                f"line {number}: ER relationship syntax is not valid in a class diagram: {line!r} "
+                f"(use -->, <|--, *--, o-- with optional \"1\" / \"*\" multiplicity)"
+            )
+            continue
+        if line.endswith("{"):
+            open_blocks.append(number)
+            continue
+        if line == "}":
+            if not open_blocks:
+                errors.append(f"line {number}: '}}' without a matching class block")
+            else:
+                open_blocks.pop()
+            continue
+        if CLASS_DANGLING_PATTERN.search(line):
+            errors.append(f"line {number}: relationship has no target class: {line!r}")
+
+    for number in open_blocks:
+        errors.append(f"line {number}: class block is never closed with '}}'")
+    return errors
+
+
+def _check_state(header: str, body: List[Tuple[int, str]]) -> List[str]:
+    errors = []
+    open_states: List[int] = []
+    for number, line in body:
+        if ER_ARROW_PATTERN.search(line):
+            errors.append(f"line {number}: ER relationship arrow in a state diagram: {line!r}")
+            continue
+        if line.endswith("{"):
+            open_states.append(number)
+        elif line == "}":
+            if not open_states:
+                errors.append(f"line {number}: '}}' without a matching composite state")
+            else:
+                open_states.pop()
+        elif "-->" in line:
+            source, _, target = line.partition("-->")
+            if not source.strip() or not target.split(":")[0].strip():
+                errors.append(f"line {number}: transition is missing a state: {line!r}")
+
+    for number in open_states:
+        errors.append(f"line {number}: composite state is never closed with '}}'")
+    return errors
+
+
+def _check_er(header: str, body: List[Tuple[int, str]]) -> List[str]:
+    errors = []
+    open_entity: Optional[int] = None
+    for number, line in body:
+        if open_entity is not None:
+            if line == "}":
+                open_entity = None
+            elif len(line.split()) < 2:
+                errors.append(f"line {number}: attribute needs a type and a name: {line!r}")
+            continue
+        if line.endswith("{"):
+            open_entity = number
+            continue
+        if line.split()[0] in ("title", "direction"):
+            continue
+        if re.search(r"<\|--|\*--|(?<![|}])o--|-->|\.\.>", line):
+            errors.append(
+                f"line {number}: class diagram arrow in an ER diagram: {line!r} "
+                f"(use cardinality syntax such as ||--o{{)"
+            )
+        elif ER_ARROW_PATTERN.search(line) and not ER_RELATION_PATTERN.match(line):
+            errors.append(f"line {number}: relationship needs 'ENTITY ||--o{{ ENTITY : label': {line!r}")
+        elif not ER_ARROW_PATTERN.search(line) and not re.fullmatch(r'[\w\-"]+', line):
+            errors.append(f"line {number}: unrecognised statement: {line!r}")
+
+    if open_entity is not None:
+        errors.append(f"line {open_entity}: entity block is never closed with '}}'")
+    return errors
+
+
+def _check_gantt(header: str, body: List[Tuple[int, str]]) -> List[str]:
+    errors = []
+    tasks = 0
+    for number, line in body:
+        first_word = line.split()[0]
+        if first_word.lower() in GANTT_KEYWORDS or first_word in GANTT_KEYWORDS:
+            continue
+        if ":" not in line:
+            errors.append(f"line {number}: task needs 'Name : [tags,] [id,] start, duration': {line!r}")
+            continue
+        name, _, spec = line.partition(":")
+        if not name.strip() or not spec.strip():
+            errors.append(f"line {number}: task is missing a name or schedule: {line!r}")
+        tasks += 1
+    if not tasks:
+        errors.append("gantt chart has no tasks")
+    return errors
+
+
+def _check_pie(header: str, body: List[Tuple[int, str]]) -> List[str]:
+    errors = []
+    if not re.match(r"^pie(?:\s+showData)?(?:\s+title\s+.+)?$", header):
+        errors.append(f"line 1: invalid pie header {header!r}")
+    slices = 0
+    for number, line in body:
+        if line.startswith("title ") or line == "showData":
+            continue
+        if PIE_SLICE_PATTERN.match(line):
+            slices += 1
+        else:
+            errors.append(f"line {number}: slice must be '\"Label\" : positive number': {line!r}")
+    if not slices:
+        errors.append("pie chart has no slices")
+    return errors
+
+
+def _check_mindmap(header: str, body: List[Tuple[int, str]], code: str) -> List[str]:
+    errors = []
+    raw_lines = code.split("\n")
+    root_indent = None
+    for number, line in body:
+        raw = raw_lines[number - 1]
+        indent = len(raw) - len(raw.lstrip())
+        if root_indent is None:
+            root_indent = indent
+        elif indent <= root_indent and not line.startswith("::"):
+            errors.append(f"line {number}: mindmap can only have one root, found another: {line!r}")
+        bracket_error = _bracket_error(line)
+        if bracket_error:
+            errors.append(f"line {number}: {bracket_error} in {line!r}")
+    if root_indent is None:
+        errors.append("mindmap has no root node")
+    return errors
+
+
+# Keyed by the header keyword; other diagram types only get the header check
+CHECKS: Dict[str, Callable[[str, List[Tuple[int, str]]], List[str]]] = {
+    "flowchart": _check_flowchart,
+    "graph": _check_flowchart,
+    "sequenceDiagram": _check_sequence,
+    "classDiagram": _check_class,
+    "stateDiagram-v2": _check_state,
+    "stateDiagram": _check_state,
+    "erDiagram": _check_er,
+    "gantt": _check_gantt,
+    "pie": _check_pie,
+}
+
+
+class MermaidValidator:
+    """Structural checks for the common Mermaid diagram types.
+
+    Catches the mistakes that make the frontend renderer fail, such as ER
+    arrows in class diagrams, unbalanced subgraph/end pairs and edges with
+    a missing node, so they can be repaired before the response is sent.
+    Checks are line-based and take tens of microseconds.
+    """
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._timings_us = deque(maxlen=window)
+        self.by_type: Dict[str, Dict[str, int]] = {}
+
+    def validate(self, code: str, diagram_type: Optional[str] = None) -> MermaidValidationResult:
+        start = time.perf_counter()
+        header, body = _body_lines(code)
+        keyword = header.split()[0].rstrip(":") if header else ""
+
+        # The header decides which checks run; a well-formed diagram of a
+        # different type than requested still renders, so it is not an error.
+        errors: List[str] = []
+        checked = keyword in CHECKS or keyword == "mindmap"
+        if not header:
+            errors.append("diagram is empty")
+        else:
+            if keyword == "mindmap":
+                errors = _check_mindmap(header, body, code)
+            elif keyword in CHECKS:
+                errors = CHECKS[keyword](header, body)
+
+        elapsed_us = (time.perf_counter() - start) * 1e6
+        result = MermaidValidationResult(diagram_type or keyword, errors[:MAX_ERRORS], elapsed_us, checked)
+
+        with self._lock:
+            self._timings_us.append(elapsed_us)
+            stats = self.by_type.setdefault(result.diagram_type, {"checked": 0, "invalid": 0})
+            stats["checked"] += 1
+            stats["invalid"] += 0 if result.valid else 1
+        return result
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            timings = sorted(self._timings_us)
+            by_type = {t: dict(s) for t, s in self.by_type.items()}
+
+        def percentile(p: float) -> float:
+            if not timings:
+                return 0.0
+            return round(timings[min(len(timings) - 1, int(len(timings) * p / 100))], 1)
+
+        return {
+            "validations": sum(s["checked"] for s in by_type.values()),
+            "invalid": sum(s["invalid"] for s in by_type.values()),
+            "latency_us": {
+                "p50": percentile(50),
+                "p90": percentile(90),
+                "p99": percentile(99),
+                "max": round(timings[-1], 1) if timings else 0.0,
+            },
+            "by_type": by_type,
+        }
@@ -0,0 +1,233 @@
+import os
+import re
+import json
+import time
+import threading
+from typing import Dict, List, Optional, Any
+
+from app.pipeline_metrics import PipelineRecord
+from app.request_log import RequestLog
+
+# Default routing table. Tiers are checked in order and the first tier whose
+# max_score is >= the prompt's complexity score wins. Override with a JSON
+# file (MODEL_ROUTES_FILE) or inline JSON (MODEL_ROUTES) of the same shape.
+DEFAULT_ROUTES = {
+    "threejs": {
+        "weights": {"length": 0.2, "controls": 0.3, "concepts": 0.35, "rag_distance": 0.15},
+        "tiers": [
+            {
+                "name": "fast",
+                "max_score": 0.3,
+                "model": "claude-3-5-haiku-20241022",
+                "fallback_model": "claude-sonnet-4-20250514",
+            },
+            {
+                "name": "large",
+                "max_score": 1.0,
+                "model": "claude-sonnet-4-20250514",
+                "fallback_model": "claude-3-5-sonnet-20241022",
+            },
+        ],
+    },
+    "mermaid": {
+        "weights": {"length": 0.4, "controls": 0.0, "concepts": 0.3, "diagram_type": 0.3},
+        "tiers": [
+            {
+                "name": "fast",
+                "max_score": 0.35,
+                "model": "claude-3-5-haiku-20241022",
+                "fallback_model": "claude-sonnet-4-20250514",
+            },
+            {
+                "name": "large",
+                "max_score": 1.0,
+                "model": "claude-sonnet-4-20250514",
+                "fallback_model": "claude-3-5-sonnet-20241022",
+            },
+        ],
+    },
+}
+
+CONTROL_PATTERN = re.compile(
+    r"\b(sliders?|dropdowns?|controls?|adjust\w*|toggles?|buttons?|parameters?|interactive|"
+    r"user input|change the|vary|configurable)\b"
+)
+
+CONCEPT_PATTERN = re.compile(
+    r"\b(simulat\w*|physics|gravity|collisions?|particles?|waves?|orbits?|fields?|forces?|"
+    r"fluids?|shaders?|springs?|pendulums?|momentum|friction|projectiles?|electric\w*|magnetic|"
+    r"molecules?|atoms?|vectors?|matri(?:x|ces)|derivatives?|integrals?|fractals?|"
+    r"terrain|lighting|shadows?|textures?|graphs?|surfaces?|relationships?|dependencies|"
+    r"states?|branches|phases?|steps?|stages?|layers?)\b"
+)
+
+# Diagram types whose syntax the small model gets wrong more often
+COMPLEX_DIAGRAM_TYPES = {
+    "C4Context", "architecture-beta", "requirementDiagram", "zenuml",
+    "block-beta", "packet-beta", "radar-beta", "treemap-beta", "sankey-beta",
+}
+
+
+class RouteDecision:
+    """Outcome of routing one request: chosen tier, models and why."""
+
+    def __init__(self, domain: str, score: float, features: Dict[str, float], tier: Dict):
+        self.domain = domain
+        self.score = score
+        self.features = features
+        self.tier = tier["name"]
+        self.model = tier["model"]
+        self.fallback_model = tier.get("fallback_model") or tier["model"]
+        self.max_tokens = tier.get("max_tokens")
+        self.decided_at = time.time()
+
+    def to_dict(self) -> Dict:
+        return {
+            "domain": self.domain,
+            "score": round(self.score, 4),
+            "features": {k: round(v, 4) for k, v in self.features.items()},
+            "tier": self.tier,
+            "model": self.model,
+            "fallback_model": self.fallback_model,
+        }
+
+
+def _load_routes() -> Dict:
+    routes_file = os.getenv("MODEL_ROUTES_FILE")
+    routes_json = os.getenv("MODEL_ROUTES")
+
+    try:
+        if routes_file:
+            with open(routes_file, "r") as f:
+                routes = json.load(f)
+        elif routes_json:
+            routes = json.loads(routes_json)
+        else:
+            return DEFAULT_ROUTES
+    except Exception as e:
+        print(f"Failed to load model routes, using defaults: {e}")
+        return DEFAULT_ROUTES
+
+    # Domains not mentioned in the override keep their defaults
+    return {**DEFAULT_ROUTES, **routes}
+
+
+class ModelRouter:
+    """Score prompt complexity locally and pick a model tier before the LLM call."""
+
+    def __init__(self, routes: Optional[Dict] = None, log_path: Optional[str] = None,
+                 enabled: Optional[bool] = None):
+        self.routes = routes or _load_routes()
+        if enabled is None:
+            enabled = os.getenv("MODEL_ROUTING", "on").lower() not in ("0", "off", "false")
+        self.enabled = enabled
+        self.log_path = log_path if log_path is not None else os.getenv(
+            "MODEL_ROUTING_LOG", os.path.join("logs", "model_routing.jsonl")
+        )
+        # Written and rotated by a background thread, off the request path
+        self.log = RequestLog(
+            self.log_path, max_bytes=int(os.getenv("MODEL_ROUTING_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+        ) if self.log_path else None
+        self._lock = threading.Lock()
+
+        # Per-tier outcome aggregates, keyed by "domain/tier"
+        self.outcomes: Dict[str, Dict[str, Any]] = {}
+
+    def _features(self, prompt: str, rag_distance: Optional[float],
+                  diagram_type: Optional[str]) -> Dict[str, float]:
+        prompt_lower = prompt.lower()
+        words = len(prompt_lower.split())
+        controls = len(CONTROL_PATTERN.findall(prompt_lower))
+        concepts = len(set(CONCEPT_PATTERN.findall(prompt_lower)))
+
+        features = {
+            "length": min(words / 60.0, 1.0),
+            "controls": min(controls / 3.0, 1.0),
+            "concepts": min(concepts / 4.0, 1.0),
+        }
+        if rag_distance is not None:
+            # Chroma returns squared L2 on normalised vectors (0 = identical, 2 = orthogonal);
+            # a close reference example makes the task easier.
+            features["rag_distance"] = min(max(rag_distance, 0.0) / 1.5, 1.0)
+        if diagram_type is not None:
+            features["diagram_type"] = 1.0 if diagram_type in COMPLEX_DIAGRAM_TYPES else 0.0
+        return features
+
+    def _score(self, features: Dict[str, float], weights: Dict[str, float]) -> float:
+        # Renormalise over the features we actually have so that a missing
+        # RAG distance does not make every prompt look simpler.
+        used = {name: w for name, w in weights.items() if name in features and w > 0}
+        total = sum(used.values())
+        if not total:
+            return 1.0
+        return sum(features[name] * w for name, w in used.items()) / total
+
+    def route(self, domain: str, prompt: str, rag_distance: Optional[float] = None,
+              diagram_type: Optional[str] = None) -> RouteDecision:
+        config = self.routes.get(domain) or DEFAULT_ROUTES[domain]
+        tiers = config["tiers"]
+
+        features = self._features(prompt, rag_distance, diagram_type)
+        score = self._score(features, config.get("weights", {}))
+
+        if not self.enabled:
+            tier = tiers[-1]
+        else:
+            tier = next((t for t in tiers if score <= t.get("max_score", 1.0)), tiers[-1])
+
+        decision = RouteDecision(domain, score, features, tier)
+        print(f"DEBUG: Routed {domain} request to {decision.tier} ({decision.model}), score {score:.3f}")
+        return decision
+
+    def record_outcome(self, decision: RouteDecision, record: PipelineRecord,
+                       success: bool, quality: Optional[str] = None):
+        """Log the decision together with what it cost and whether it worked."""
+        key = f"{decision.domain}/{decision.tier}"
+        with self._lock:
+            stats = self.outcomes.setdefault(key, {
+                "requests": 0,
+                "successes": 0,
+                "fallbacks": 0,
+                "total_time": 0.0,
+                "output_tokens": 0,
+                "input_tokens": 0,
+                "quality": {},
+            })
+            stats["requests"] += 1
+            stats["successes"] += 1 if success else 0
+            stats["fallbacks"] += 1 if record.model_role == "fallback" else 0
+            stats["total_time"] += record.total_time
+            stats["output_tokens"] += record.tokens["output"]
+            stats["input_tokens"] += record.tokens["input"]
+            if quality:
+                stats["quality"][quality] = stats["quality"].get(quality, 0) + 1
+
+        if self.log is None:
+            return
+
+        self.log.write({
+            "timestamp": decision.decided_at,
+            "request_id": record.request_id,
+            **decision.to_dict(),
+            "model_used": record.model,
+            "model_role": record.model_role,
+            "success": success,
+            "quality": quality,
+            "total_time": round(record.total_time, 4),
+            "llm_total": round(record.stages.get("llm_total", 0.0), 4),
+            "tokens": record.tokens,
+        })
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            summary = {}
+            for key, stats in self.outcomes.items():
+                requests = max(stats["requests"], 1)
+                summary[key] = {
+                    **stats,
+                    "quality": dict(stats["quality"]),
+                    "success_rate": stats["successes"] / requests,
+                    "avg_time": stats["total_time"] / requests,
+                    "avg_output_tokens": stats["output_tokens"] / requests,
+                }
+        return {"enabled": self.enabled, "tiers": summary}
@@ -0,0 +1,151 @@
+import re
+import math
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.pipeline_metrics import PipelineRecord, stream_message
+
+# Words too common to say anything about how long an answer will be
+_STOPWORDS = {
+    "the", "and", "for", "with", "that", "this", "from", "into", "create", "make",
+    "show", "using", "use", "which", "what", "how", "diagram", "visualization",
+}
+
+
+def _prompt_features(prompt: str) -> frozenset:
+    words = re.findall(r"[a-z0-9]+", prompt.lower())
+    return frozenset(w for w in words if len(w) > 2 and w not in _STOPWORDS)
+
+
+class OutputBudget:
+    """Size max_tokens from the output lengths of similar past prompts.
+
+    Keeps a bounded history of (prompt words, output tokens) per namespace and
+    budgets a new prompt at the p90 of its nearest neighbours plus headroom.
+    Until enough similar prompts have been seen the default ceiling is used.
+    """
+
+    def __init__(self, default_tokens: int, min_tokens: int = 512, headroom: float = 1.3,
+                 history: int = 500, neighbours: int = 10, min_samples: int = 3,
+                 min_similarity: float = 0.25):
+        self.default_tokens = default_tokens
+        self.min_tokens = min_tokens
+        self.headroom = headroom
+        self.neighbours = neighbours
+        self.min_samples = min_samples
+        self.min_similarity = min_similarity
+        self._history_size = history
+        self._history: Dict[str, deque] = {}
+
+        self.stats = {
+            "suggested": 0,
+            "defaulted": 0,
+            "observed": 0,
+        }
+
+    def _similar(self, features: frozenset, namespace: str) -> List[Tuple[float, int]]:
+        scored = []
+        for past_features, tokens in self._history.get(namespace, ()):
+            union = len(features | past_features)
+            if not union:
+                continue
+            similarity = len(features & past_features) / union
+            if similarity >= self.min_similarity:
+                scored.append((similarity, tokens))
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return scored[:self.neighbours]
+
+    def suggest(self, prompt: str, namespace: str = "default") -> int:
+        """Return the max_tokens to request for this prompt."""
+        neighbours = self._similar(_prompt_features(prompt), namespace)
+        if len(neighbours) < self.min_samples:
+            self.stats["defaulted"] += 1
+            return self.default_tokens
+
+        lengths = sorted(tokens for _, tokens in neighbours)
+        p90 = lengths[max(0, math.ceil(0.9 * len(lengths)) - 1)]
+        budget = int(p90 * self.headroom)
+        # Round up to a multiple of 256 so small fluctuations don't matter
+        budget = ((budget + 255) // 256) * 256
+
+        self.stats["suggested"] += 1
+        return max(self.min_tokens, min(self.default_tokens, budget))
+
+    def observe(self, prompt: str, output_tokens: int, namespace: str = "default"):
+        """Record how many output tokens a complete answer needed."""
+        if output_tokens <= 0:
+            return
+        if namespace not in self._history:
+            self._history[namespace] = deque(maxlen=self._history_size)
+        self._history[namespace].append((_prompt_features(prompt), output_tokens))
+        self.stats["observed"] += 1
+
+
+def _response_text(response: Any) -> str:
+    return "".join(
+        getattr(block, "text", "") for block in response.content
+        if getattr(block, "type", "text") == "text"
+    )
+
+
+async def complete_with_continuation(
+    client: Any,
+    messages: List[Dict],
+    max_tokens: int,
+    record: Optional[PipelineRecord] = None,
+    role: str = "primary",
+    prefill: str = "",
+    max_continuations: int = 2,
+    continuation_tokens: Optional[int] = None,
+    **kwargs
+) -> Tuple[str, Optional[str], int]:
+    """Generate text, continuing from where the model stopped if it ran out of tokens.
+
+    ``prefill`` is sent as the start of the assistant turn and included in the
+    returned text. When the model stops on a stop sequence, the matched sequence
+    is appended so callers see the same text they would without it.
+
+    Returns (text, stop_reason, output_tokens).
+    """
+    # The API rejects assistant turns that end in whitespace
+    prefill = prefill.rstrip()
+    generated = ""
+    output_tokens = 0
+    stop_reason = None
+    tokens = max_tokens
+
+    for attempt in range(max_continuations + 1):
+        partial = (prefill + generated).rstrip()
+        call_messages = list(messages)
+        if partial:
+            call_messages.append({"role": "assistant", "content": partial})
+
+        response = await stream_message(
+            client,
+            record,
+            role=role,
+            messages=call_messages,
+            max_tokens=tokens,
+            **kwargs
+        )
+
+        generated = partial[len(prefill):] + _response_text(response)
+        stop_reason = getattr(response, "stop_reason", None)
+        usage = getattr(response, "usage", None)
+        output_tokens += getattr(usage, "output_tokens", 0) or 0
+
+        if stop_reason != "max_tokens":
+            break
+
+        print(f"DEBUG: Output cut off at {tokens} tokens, continuing (attempt {attempt + 1})")
+        if record is not None:
+            record.continuations += 1
+        tokens = continuation_tokens or max_tokens
+
+    if stop_reason == "stop_sequence" and getattr(response, "stop_sequence", None):
+        generated += response.stop_sequence
+
+    if record is not None:
+        record.stop_reason = stop_reason
+
+    return prefill + generated, stop_reason, output_tokens
@@ -0,0 +1,192 @@
+import math
+import time
+import uuid
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Any
+
+
+# Stages every request record reports, in pipeline order
+STAGES = [
+    "response_cache",
+    "retrieval",
+    "cache_lookup",
+    "context_assembly",
+    "llm_ttft",
+    "llm_total",
+    "post_processing",
+]
+
+TOKEN_FIELDS = ["input", "output", "cache_creation", "cache_read"]
+
+
+class PipelineRecord:
+    """Per-request stage timings, token usage and model choice."""
+
+    def __init__(self, endpoint: str):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.endpoint = endpoint
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.total_time = 0.0
+        self.stages: Dict[str, float] = {}
+        self.tokens = {field: 0 for field in TOKEN_FIELDS}
+        self.model: Optional[str] = None
+        self.model_role: Optional[str] = None  # "primary" or "fallback"
+        self.llm_calls = 0
+        self.stop_reason: Optional[str] = None
+        self.continuations = 0
+        self.error: Optional[str] = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a block of code and add it to the named stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def record_usage(self, message: Any, role: str):
+        """Add token usage from an Anthropic response and note the model used."""
+        self.llm_calls += 1
+        self.model = getattr(message, "model", None) or self.model
+        self.model_role = role
+
+        usage = getattr(message, "usage", None)
+        if usage is None:
+            return
+        self.tokens["input"] += getattr(usage, "input_tokens", 0) or 0
+        self.tokens["output"] += getattr(usage, "output_tokens", 0) or 0
+        self.tokens["cache_creation"] += getattr(usage, "cache_creation_input_tokens", 0) or 0
+        self.tokens["cache_read"] += getattr(usage, "cache_read_input_tokens", 0) or 0
+
+    def finish(self):
+        self.total_time = time.perf_counter() - self._start
+
+    def to_dict(self) -> Dict:
+        return {
+            "request_id": self.request_id,
+            "endpoint": self.endpoint,
+            "started_at": self.started_at,
+            "total_time": self.total_time,
+            "stages": dict(self.stages),
+            "tokens": dict(self.tokens),
+            "model": self.model,
+            "model_role": self.model_role,
+            "llm_calls": self.llm_calls,
+            "stop_reason": self.stop_reason,
+            "continuations": self.continuations,
+            "error": self.error,
+        }
+
+
+async def stream_message(client: Any, record: Optional[PipelineRecord] = None,
+                         role: str = "primary", **kwargs) -> Any:
+    """Call messages.stream and return the final message.
+
+    Streaming lets us measure time-to-first-token; the final message carries
+    the same content and usage as a plain messages.create call.
+    """
+    start = time.perf_counter()
+    first_token = None
+
+    try:
+        async with client.messages.stream(**kwargs) as stream:
+            async for event in stream:
+                if first_token is None and event.type == "text":
+                    first_token = time.perf_counter()
+            message = await stream.get_final_message()
+    finally:
+        if record is not None:
+            record.add_stage("llm_total", time.perf_counter() - start)
+
+    if record is not None:
+        if first_token is not None:
+            record.add_stage("llm_ttft", first_token - start)
+        record.record_usage(message, role)
+
+    return message
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100.0 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+
+def _summarize(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50": _percentile(values, 50),
+        "p90": _percentile(values, 90),
+        "p99": _percentile(values, 99),
+        "max": values[-1] if values else 0.0,
+        "mean": sum(values) / len(values) if values else 0.0,
+    }
+
+
+class PipelineMetrics:
+    """Rolling window of request records with percentile summaries."""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._records: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, record: PipelineRecord):
+        record.finish()
+        with self._lock:
+            if record.endpoint not in self._records:
+                self._records[record.endpoint] = deque(maxlen=self.window)
+            self._records[record.endpoint].append(record)
+
+    def recent(self, limit: int = 20) -> List[Dict]:
+        with self._lock:
+            records = [r for records in self._records.values() for r in records]
+        records.sort(key=lambda r: r.started_at, reverse=True)
+        return [r.to_dict() for r in records[:limit]]
+
+    def summary(self) -> Dict:
+        with self._lock:
+            snapshot = {endpoint: list(records) for endpoint, records in self._records.items()}
+
+        summary = {}
+        for endpoint, records in snapshot.items():
+            stage_names = [s for s in STAGES if any(s in r.stages for r in records)]
+            stage_names += sorted({s for r in records for s in r.stages} - set(stage_names))
+
+            models: Dict[str, int] = {}
+            for r in records:
+                if r.model:
+                    key = f"{r.model} ({r.model_role})"
+                    models[key] = models.get(key, 0) + 1
+
+            summary[endpoint] = {
+                "requests": len(records),
+                "errors": sum(1 for r in records if r.error),
+                "continued": sum(1 for r in records if r.continuations),
+                "truncated": sum(1 for r in records if r.stop_reason == "max_tokens"),
+                "total_time": _summarize([r.total_time for r in records]),
+                "stages": {
+                    name: _summarize([r.stages[name] for r in records if name in r.stages])
+                    for name in stage_names
+                },
+                "tokens": {
+                    field: {
+                        **_summarize([r.tokens[field] for r in records if r.llm_calls]),
+                        "total": sum(r.tokens[field] for r in records),
+                    }
+                    for field in TOKEN_FIELDS
+                },
+                "models": models,
+            }
+
+        return {"window": self.window, "endpoints": summary}
@@ -0,0 +1,176 @@
+import json
+import time
+import uuid
+import asyncio
+from typing import Dict, List, Optional
+
+from app.anthropic_client import AnthropicClient
+from app.model_router import ModelRouter
+from app.pipeline_metrics import PipelineRecord
+from rag.rag_engine import RAGEngine
+
+# Quality scores written to the code cache. Entries need > 0.5 to be served
+# by semantic lookups, so code the validator had to patch still qualifies.
+QUALITY_CLEAN = 1.0
+QUALITY_FIXED = 0.8
+
+
+def load_prompts(path: str) -> List[Dict]:
+    """Read prompts from a text file (one per line) or JSONL ({"prompt": ..., "context": ...})."""
+    prompts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if path.endswith(".jsonl"):
+                data = json.loads(line)
+                prompts.append({"prompt": data["prompt"], "context": data.get("context") or ""})
+            else:
+                prompts.append({"prompt": line, "context": ""})
+    return prompts
+
+
+class PregenerationJob:
+    """Generate answers for known prompts ahead of time and store them in the code cache.
+
+    Retrieval for all prompts runs as one batched search; generations go
+    through a bounded worker pool with an optional requests-per-minute cap.
+    Only results that pass code extraction and validation are cached.
+    """
+
+    def __init__(
+        self,
+        rag_engine: RAGEngine,
+        anthropic_client: AnthropicClient,
+        model_router: Optional[ModelRouter] = None,
+        concurrency: int = 4,
+        requests_per_minute: Optional[float] = None,
+        temperature: float = 0.7,
+        k: int = 5,
+        skip_cached: bool = True
+    ):
+        self.rag_engine = rag_engine
+        self.cache = rag_engine.cache
+        self.anthropic_client = anthropic_client
+        self.model_router = model_router
+        self.concurrency = max(1, concurrency)
+        self.min_interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self.temperature = temperature
+        self.k = k
+        self.skip_cached = skip_cached
+        self.job_id = uuid.uuid4().hex[:12]
+
+        self._rate_lock = asyncio.Lock()
+        self._next_start = 0.0
+
+    async def _throttle(self):
+        """Space out request starts to respect requests_per_minute."""
+        if not self.min_interval:
+            return
+        async with self._rate_lock:
+            now = time.monotonic()
+            wait = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.min_interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _generate_one(self, item: Dict, docs: List[Dict], semaphore: asyncio.Semaphore) -> Dict:
+        prompt, extra_context = item["prompt"], item["context"]
+        async with semaphore:
+            await self._throttle()
+            record = PipelineRecord("pregenerate")
+            try:
+                context = "\n\n".join(doc["content"] for doc in docs)
+                if extra_context:
+                    context += f"\n\nAdditional context: {extra_context}"
+
+                route = None
+                if self.model_router is not None:
+                    distances = [doc["distance"] for doc in docs if doc.get("distance") is not None]
+                    route = self.model_router.route(
+                        "threejs", prompt, rag_distance=min(distances) if distances else None
+                    )
+
+                response = await self.anthropic_client.generate_threejs_code(
+                    prompt=prompt,
+                    context=context,
+                    temperature=self.temperature,
+                    record=record,
+                    route=route
+                )
+            except Exception as e:
+                print(f"❌ Generation failed for {prompt[:60]!r}: {e}")
+                return {"prompt": prompt, "status": "failed", "error": str(e)}
+            finally:
+                record.finish()
+
+        code = response["code"]
+        if not code or code.startswith("// Error"):
+            return {"prompt": prompt, "status": "rejected", "error": "code could not be extracted"}
+        quality = QUALITY_FIXED if code.startswith("// WARNING: Fixed violations") else QUALITY_CLEAN
+
+        self.cache.cache_code_result(
+            prompt,
+            extra_context,
+            self.temperature,
+            code,
+            quality_score=quality,
+            source="pregenerate",
+            provenance={
+                "job_id": self.job_id,
+                "model": record.model,
+                "model_role": record.model_role,
+                "tokens": record.tokens,
+                "rag_sources": [doc.get("metadata", {}).get("filename") for doc in docs],
+                "generated_at": time.time(),
+            }
+        )
+        return {"prompt": prompt, "status": "cached", "quality": quality, "time": record.total_time}
+
+    async def run(self, prompts: List[Dict]) -> Dict:
+        start = time.time()
+
+        # Drop duplicates and prompts that already have an exact cache entry
+        seen = set()
+        pending = []
+        skipped = 0
+        for item in prompts:
+            key = (item["prompt"].lower().strip(), item["context"])
+            if key in seen:
+                continue
+            seen.add(key)
+            if self.skip_cached and self.cache.has_code_result(item["prompt"], item["context"], self.temperature):
+                skipped += 1
+                continue
+            pending.append(item)
+
+        print(f"📦 Job {self.job_id}: {len(pending)} prompts to generate, {skipped} already cached")
+
+        results = []
+        if pending:
+            all_docs = self.rag_engine.search_many([item["prompt"] for item in pending], k=self.k)
+            semaphore = asyncio.Semaphore(self.concurrency)
+            tasks = [
+                self._generate_one(item, docs, semaphore)
+                for item, docs in zip(pending, all_docs)
+            ]
+            for done in asyncio.as_completed(tasks):
+                result = await done
+                results.append(result)
+                print(f"  [{len(results)}/{len(pending)}] {result['status']}: {result['prompt'][:60]}")
+
+        summary = {
+            "job_id": self.job_id,
+            "total": len(prompts),
+            "unique": len(seen),
+            "skipped_cached": skipped,
+            "cached": sum(1 for r in results if r["status"] == "cached"),
+            "rejected": sum(1 for r in results if r["status"] == "rejected"),
+            "failed": sum(1 for r in results if r["status"] == "failed"),
+            "elapsed": time.time() - start,
+            "results": results,
+        }
+        print(f"✅ Job {self.job_id} done in {summary['elapsed']:.1f}s: "
+              f"{summary['cached']} cached, {summary['rejected']} rejected, {summary['failed']} failed")
+        return summary
@@ -0,0 +1,83 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+from typing import Dict, List, Optional
+
+
+def rotated_path(path: str) -> str:
+    """Where the previous log goes on rotation: requests.jsonl -> requests.1.jsonl."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.1{ext}"
+
+
+class RequestLog:
+    """Append JSON lines to a file off the request path.
+
+    Used for captured /generate prompts (append) and for the model routing
+    log (write). Both only queue the line; a background thread writes
+    whatever has queued up in one go. Once the file reaches max_bytes it is
+    moved to rotated_path() (replacing the previous one) and a new file is
+    started, so the log stays under about twice max_bytes. A full queue
+    drops lines instead of blocking a request. Queued lines are flushed at
+    exit.
+    """
+
+    def __init__(self, path: str, max_bytes: Optional[int] = None, max_pending: int = 10000):
+        self.path = path
+        self.max_bytes = max_bytes or int(os.getenv("REQUEST_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+        self._queue: "queue.Queue[str]" = queue.Queue(maxsize=max_pending)
+        self._write_lock = threading.Lock()
+        self.stats = {"written": 0, "dropped": 0, "rotations": 0, "errors": 0}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self._worker = threading.Thread(target=self._run, name=f"{os.path.basename(path)}-writer", daemon=True)
+        self._worker.start()
+        atexit.register(self.flush)
+
+    def append(self, prompt: str, context: Optional[str]):
+        self.write({"prompt": prompt, "context": context or "", "timestamp": time.time()})
+
+    def write(self, entry: Dict):
+        line = json.dumps(entry) + "\n"
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def _run(self):
+        while True:
+            lines = [self._queue.get()]
+            self._write(lines + self._drain())
+
+    def _drain(self) -> List[str]:
+        lines = []
+        while True:
+            try:
+                lines.append(self._queue.get_nowait())
+            except queue.Empty:
+                return lines
+
+    def flush(self):
+        """Write everything queued so far (the writer thread does this on its own)."""
+        self._write(self._drain())
+
+    def _write(self, lines: List[str]):
+        if not lines:
+            return
+        with self._write_lock:
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                    os.replace(self.path, rotated_path(self.path))
+                    self.stats["rotations"] += 1
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("".join(lines))
+                self.stats["written"] += len(lines)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Failed to write {self.path}: {e}")
+
+    def get_stats(self) -> Dict:
+        return {**self.stats, "pending": self._queue.qsize(), "max_bytes": self.max_bytes}
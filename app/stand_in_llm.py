@@ -0,0 +1,158 @@
+import re
+import uuid
+import asyncio
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _message_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+
+
+class _StandInStream:
+    """Mimics the async context manager returned by messages.stream."""
+
+    def __init__(self, message: SimpleNamespace, latency: float):
+        self._message = message
+        self._latency = latency
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def __aiter__(self):
+        return self._events()
+
+    async def _events(self):
+        yield SimpleNamespace(type="message_start")
+        await asyncio.sleep(self._latency)
+        yield SimpleNamespace(type="text", text=self._message.content[0].text)
+        yield SimpleNamespace(type="message_stop")
+
+    async def get_final_message(self) -> SimpleNamespace:
+        return self._message
+
+
+class _StandInMessages:
+    def __init__(self, owner: "StandInAnthropic"):
+        self._owner = owner
+
+    def stream(self, **kwargs) -> _StandInStream:
+        return _StandInStream(self._owner._respond(**kwargs), self._owner.latency)
+
+    async def create(self, **kwargs) -> SimpleNamespace:
+        await asyncio.sleep(self._owner.latency)
+        return self._owner._respond(**kwargs)
+
+
+class StandInAnthropic:
+    """Local stand-in for AsyncAnthropic used for offline runs and testing.
+
+    Returns small deterministic answers shaped like the real ones: Three.js
+    code that honours the CODE prefill and stop sequences, Mermaid diagrams
+    for diagram prompts, and usage numbers estimated from text length.
+    Enable with LLM_BACKEND=stand-in or pass an instance to a client.
+    """
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.messages = _StandInMessages(self)
+        self.calls: List[Dict] = []
+
+    def _respond(self, model: str, messages: List[Dict], max_tokens: int,
+                 system: Any = None, stop_sequences: Optional[List[str]] = None,
+                 **kwargs) -> SimpleNamespace:
+        self.calls.append({"model": model, "messages": messages, "max_tokens": max_tokens})
+
+        user_text = next(
+            (_message_text(m["content"]) for m in reversed(messages) if m["role"] == "user"), ""
+        )
+        prefill = messages[-1]["content"] if messages[-1]["role"] == "assistant" else ""
+
+        # Diagram requests, including repair turns later in the same conversation
+        first_user_text = next((_message_text(m["content"]) for m in messages if m["role"] == "user"), "")
+        diagram = re.search(r"Create a (\S+) diagram for: (.+)", first_user_text)
+        if diagram:
+            text = self._diagram(diagram.group(1), diagram.group(2))
+            if prefill:
+                text = "\n" + text + "\n```"
+        elif "<<<<<<< SEARCH" in _message_text(system or "") and not prefill:
+            text = "<<<<<<< SEARCH\n\n=======\n// stand-in edit\n>>>>>>> REPLACE"
+        else:
+            request = user_text.rsplit("User request:", 1)[-1].strip()
+            text = self._code(request[:80])
+            if not prefill:
+                text = "CODE:\n```javascript" + text
+
+        stop_reason, stop_sequence = "end_turn", None
+        for sequence in stop_sequences or []:
+            index = text.find(sequence)
+            if index != -1:
+                text, stop_reason, stop_sequence = text[:index], "stop_sequence", sequence
+                break
+
+        if _estimate_tokens(text) > max_tokens:
+            text, stop_reason, stop_sequence = text[:max_tokens * 4], "max_tokens", None
+
+        input_text = _message_text(system or "") + "".join(_message_text(m["content"]) for m in messages)
+        return SimpleNamespace(
+            id=f"msg_standin_{uuid.uuid4().hex[:12]}",
+            model=f"stand-in:{model}",
+            role="assistant",
+            content=[SimpleNamespace(type="text", text=text)],
+            stop_reason=stop_reason,
+            stop_sequence=stop_sequence,
+            usage=SimpleNamespace(
+                input_tokens=_estimate_tokens(input_text),
+                output_tokens=_estimate_tokens(text),
+            ),
+        )
+
+    def _code(self, request: str) -> str:
+        request = request.replace("*/", "")
+        return f"""
+/* Stand-in response for: {request} */
+scene.background = new THREE.Color(0x79ecff);
+camera.position.set(5, 5, 5);
+camera.lookAt(0, 0, 0);
+
+const ambientLight = new THREE.AmbientLight(0xffffff, 0.6);
+scene.add(ambientLight);
+
+const geometry = new THREE.BoxGeometry(1, 1, 1);
+const material = new THREE.MeshPhongMaterial({{ color: 0xff0000 }});
+const mesh = new THREE.Mesh(geometry, material);
+scene.add(mesh);
+
+function animate() {{
+    mesh.rotation.y += 0.01;
+    if (controls) {{
+        controls.update();
+    }}
+}}
+return animate;
+```
+
+This stand-in code adds a rotating cube."""
+
+    def _diagram(self, diagram_type: str, prompt: str) -> str:
+        label = re.sub(r"[^\w ]", "", prompt)[:40] or "Diagram"
+        samples = {
+            "flowchart": f"flowchart TD\n    A[{label}] --> B[Step 1]\n    B --> C[Step 2]",
+            "sequenceDiagram": f"sequenceDiagram\n    participant A as {label}\n    A->>B: Request\n    B-->>A: Response",
+            "classDiagram": "classDiagram\n    class Item {\n        +String name\n    }\n    Item <|-- Part",
+            "stateDiagram-v2": "stateDiagram-v2\n    [*] --> Start\n    Start --> [*]",
+            "erDiagram": "erDiagram\n    ITEM ||--o{ PART : contains",
+            "gantt": f"gantt\n    title {label}\n    dateFormat YYYY-MM-DD\n    Step 1 :s1, 2024-01-01, 3d",
+            "pie": f"pie title {label}\n    \"A\" : 60\n    \"B\" : 40",
+            "mindmap": f"mindmap\n  root(({label}))\n    Idea",
+        }
+        return samples.get(diagram_type, f"{diagram_type}\n    %% stand-in diagram for {label}")
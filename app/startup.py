@@ -0,0 +1,65 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Set when this module is first imported, i.e. near the start of the process
+PROCESS_START = time.perf_counter()
+
+
+class StartupState:
+    """Timing and readiness of the background startup.
+
+    The server binds first; models, clients and indexes load afterwards in
+    named phases. ready flips once the warm-up query has gone through, and
+    report() gives the per-phase breakdown for /ready and the startup log.
+    """
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.ready = False
+        self.error: Optional[str] = None
+        self.ready_after: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def mark(self, name: str):
+        """Record a point in time as a phase measured from process start."""
+        with self._lock:
+            self.phases[name] = time.perf_counter() - PROCESS_START
+
+    def mark_ready(self):
+        self.ready_after = time.perf_counter() - PROCESS_START
+        self.ready = True
+
+    def mark_failed(self, error: Exception):
+        self.error = f"{type(error).__name__}: {error}"
+
+    @property
+    def status(self) -> str:
+        if self.ready:
+            return "ready"
+        return "failed" if self.error else "starting"
+
+    def report(self) -> Dict:
+        with self._lock:
+            phases = {name: round(seconds, 3) for name, seconds in self.phases.items()}
+        return {
+            "status": self.status,
+            "ready_after": round(self.ready_after, 3) if self.ready_after is not None else None,
+            "uptime": round(time.perf_counter() - PROCESS_START, 3),
+            "phases": phases,
+            "error": self.error,
+        }
+
+    def summary_line(self) -> str:
+        parts = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+        return f"🚀 Ready after {self.ready_after:.2f}s ({parts})"
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Accuracy and latency of the Mermaid diagram type classifier.
+
+Compares DiagramTypeClassifier with the if/elif chain it replaced on two
+labeled prompt sets: diagram_type_labels.jsonl, which the cue weights were
+tuned against, and diagram_type_heldout.jsonl, which they were not. Only
+the held-out accuracy says how well the cues generalize.
+
+    python benchmarks/bench_diagram_classifier.py [--repeat 2000]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.diagram_classifier import DiagramTypeClassifier
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+LABEL_SETS = {
+    "tuning": os.path.join(BENCH_DIR, "diagram_type_labels.jsonl"),
+    "held-out": os.path.join(BENCH_DIR, "diagram_type_heldout.jsonl"),
+}
+
+
+def legacy_classify(prompt: str) -> str:
+    """The original chain from main.py, kept here as the baseline."""
+    diagram_type = "flowchart"
+    prompt_lower = prompt.lower()
+    
+    if any(word in prompt_lower for word in ["sequence", "interaction", "communication"]):
+        diagram_type = "sequenceDiagram"
+    elif any(word in prompt_lower for word in ["class", "uml", "inheritance"]):
+        diagram_type = "classDiagram"
+    elif any(word in prompt_lower for word in ["state", "transition", "fsm", "finite state"]):
+        diagram_type = "stateDiagram-v2"
+    elif any(word in prompt_lower for word in ["entity", "database", "er diagram", "erd"]):
+        diagram_type = "erDiagram"
+    elif any(word in prompt_lower for word in ["journey", "user journey", "customer journey"]):
+        diagram_type = "journey"
+    elif any(word in prompt_lower for word in ["gantt", "project timeline", "schedule"]):
+        diagram_type = "gantt"
+    elif any(word in prompt_lower for word in ["pie", "percentage", "distribution"]):
+        diagram_type = "pie"
+    elif any(word in prompt_lower for word in ["quadrant", "four quadrants", "2x2 matrix"]):
+        diagram_type = "quadrantChart"
+    elif any(word in prompt_lower for word in ["requirement", "requirements"]):
+        diagram_type = "requirementDiagram"
+    elif any(word in prompt_lower for word in ["git", "branch", "commit", "merge"]):
+        diagram_type = "gitGraph"
+    elif any(word in prompt_lower for word in ["c4", "context diagram", "system context"]):
+        diagram_type = "C4Context"
+    elif any(word in prompt_lower for word in ["mindmap", "mind map", "brainstorm"]):
+        diagram_type = "mindmap"
+    elif any(word in prompt_lower for word in ["timeline", "chronology", "history"]):
+        diagram_type = "timeline"
+    elif any(word in prompt_lower for word in ["zenuml", "zen", "uml sequence"]):
+        diagram_type = "zenuml"
+    elif any(word in prompt_lower for word in ["sankey", "flow diagram", "energy flow"]):
+        diagram_type = "sankey-beta"
+    elif any(word in prompt_lower for word in ["xy chart", "xy graph", "bar chart", "line chart"]):
+        diagram_type = "xychart-beta"
+    elif any(word in prompt_lower for word in ["block", "blocks", "grid"]):
+        diagram_type = "block-beta"
+    elif any(word in prompt_lower for word in ["packet", "network packet", "data packet"]):
+        diagram_type = "packet-beta"
+    elif any(word in prompt_lower for word in ["kanban", "task board", "todo board"]):
+        diagram_type = "kanban"
+    elif any(word in prompt_lower for word in ["architecture", "system architecture"]):
+        diagram_type = "architecture-beta"
+    elif any(word in prompt_lower for word in ["radar", "spider", "skills", "assessment"]):
+        diagram_type = "radar-beta"
+    elif any(word in prompt_lower for word in ["treemap", "tree map", "hierarchical"]):
+        diagram_type = "treemap-beta"
+    
+    return diagram_type
+
+
+def load_labels(path):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate(name, classify, labels, repeat):
+    correct = 0
+    errors = []
+    for item in labels:
+        predicted = classify(item["prompt"])
+        if predicted == item["type"]:
+            correct += 1
+        else:
+            errors.append((item["prompt"], item["type"], predicted))
+    
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in labels:
+            classify(item["prompt"])
+    elapsed = time.perf_counter() - start
+    per_prompt_us = elapsed / (repeat * len(labels)) * 1e6
+    
+    print(f"{name:<12} accuracy {correct}/{len(labels)} ({correct / len(labels):.1%})  "
+          f"{per_prompt_us:.1f} µs/prompt")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000, help="Timing iterations over the labeled set")
+    parser.add_argument("--show-errors", action="store_true", help="List misclassified prompts")
+    args = parser.parse_args()
+    
+    classifier = DiagramTypeClassifier()
+    
+    for set_name, path in LABEL_SETS.items():
+        labels = load_labels(path)
+        print(f"\n{set_name} set ({os.path.basename(path)}, {len(labels)} prompts)")
+        legacy_errors = evaluate("legacy", legacy_classify, labels, args.repeat)
+        new_errors = evaluate("classifier", classifier.classify, labels, args.repeat)
+        
+        if args.show_errors:
+            for name, errors in (("legacy", legacy_errors), ("classifier", new_errors)):
+                print(f"\n{name} errors:")
+                for prompt, expected, predicted in errors:
+                    print(f"  {prompt!r}: expected {expected}, got {predicted}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Hit rate and latency of the local Khan Academy catalog.
+
+Syncs the recorded fixture into a temporary catalog and looks up the
+labeled topics in khan_catalog_labels.jsonl. Topics labeled null are not
+in the fixture and should fall through to the live API.
+
+    python benchmarks/bench_khan_catalog.py [--no-embeddings] [--repeat 200]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.khan_catalog import KhanCatalog, CatalogSync, RecordedYouTube
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_PATH = os.path.join(BENCH_DIR, "khan_catalog_fixture.json")
+LABELS_PATH = os.path.join(BENCH_DIR, "khan_catalog_labels.jsonl")
+
+
+def load_labels():
+    with open(LABELS_PATH, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--no-embeddings", action="store_true", help="Lexical search only")
+    parser.add_argument("--repeat", type=int, default=200, help="Timing iterations over the labeled set")
+    parser.add_argument("--show-errors", action="store_true", help="List wrong or missed lookups")
+    args = parser.parse_args()
+
+    embed_fn = None
+    if not args.no_embeddings:
+        from rag.embedding_service import create_sentence_encoder
+        embed_fn = create_sentence_encoder().encode
+
+    labels = load_labels()
+    with tempfile.TemporaryDirectory() as tmp:
+        catalog = KhanCatalog(db_path=os.path.join(tmp, "catalog.db"), embed_fn=embed_fn)
+        CatalogSync(RecordedYouTube(FIXTURE_PATH), catalog).run()
+
+        served = correct = 0
+        errors = []
+        for item in labels:
+            best, confident = catalog.best_match(item["topic"])
+            if confident:
+                served += 1
+                if best["video_id"] == item["video_id"]:
+                    correct += 1
+                else:
+                    errors.append((item["topic"], item["video_id"], best["video_id"], best["score"]))
+            elif item["video_id"] is not None:
+                errors.append((item["topic"], item["video_id"], None, best["score"] if best else 0.0))
+
+        timings = []
+        for _ in range(args.repeat):
+            for item in labels:
+                start = time.perf_counter()
+                catalog.best_match(item["topic"])
+                timings.append(time.perf_counter() - start)
+        timings.sort()
+
+    in_catalog = sum(1 for item in labels if item["video_id"] is not None)
+    print(f"served locally {served}/{len(labels)}  correct {correct}/{in_catalog}  "
+          f"wrong {served - correct}  ({'lexical' if embed_fn is None else 'vector+lexical'})")
+    print(f"latency p50 {timings[len(timings) // 2] * 1e3:.2f} ms  "
+          f"p95 {timings[int(len(timings) * 0.95)] * 1e3:.2f} ms")
+
+    if args.show_errors:
+        for topic, expected, got, score in errors:
+            print(f"  {topic!r}: expected {expected}, got {got} (score {score:.2f})")
+
+
+if __name__ == "__main__":
+    main()
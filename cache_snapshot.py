@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import json
+import argparse
+from dotenv import load_dotenv
+from rag.cache_snapshot import (
+    export_snapshot, import_snapshot, read_snapshot_header, SnapshotError, SNAPSHOT_TABLES
+)
+from rag.rag_engine import read_index_version
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import SmartCache contents as a versioned snapshot")
+    parser.add_argument("--db", default="cache/cache.db", help="Cache database")
+    parser.add_argument("--chroma", default="./chroma_db", help="Chroma directory the RAG index version is read from")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Write a snapshot of the hot cache entries")
+    export_parser.add_argument("path", help="Snapshot file (gzip JSONL)")
+    export_parser.add_argument("--days", type=int, default=None, help="Only entries used within this many days")
+    export_parser.add_argument("--min-usage", type=int, default=1, help="Only entries used at least this many times")
+    export_parser.add_argument("--limit", type=int, default=None, help="Keep the busiest N entries per table")
+    export_parser.add_argument("--table", action="append", choices=list(SNAPSHOT_TABLES),
+                               help="Only export this table (repeatable)")
+
+    import_parser = subparsers.add_parser("import", help="Merge a snapshot into the cache")
+    import_parser.add_argument("path", help="Snapshot file (gzip JSONL)")
+    import_parser.add_argument("--skip-rag-on-mismatch", action="store_true",
+                               help="If the RAG index differs, drop the RAG entries and import the rest")
+
+    inspect_parser = subparsers.add_parser("inspect", help="Print a snapshot's header")
+    inspect_parser.add_argument("path", help="Snapshot file (gzip JSONL)")
+    args = parser.parse_args()
+
+    # Load environment variables
+    load_dotenv()
+
+    if args.command == "inspect":
+        print(json.dumps(read_snapshot_header(args.path), indent=2))
+        return
+
+    index_version = read_index_version(args.chroma)
+    if args.command == "export":
+        header = export_snapshot(args.db, args.path, index_version, days=args.days,
+                                 min_usage=args.min_usage, limit=args.limit, tables=args.table)
+        counts = ", ".join(f"{table} {count}" for table, count in header["counts"].items())
+        print(f"📦 Wrote {args.path} (index {index_version}): {counts}")
+        return
+
+    try:
+        result = import_snapshot(args.db, args.path, index_version,
+                                 skip_rag_on_mismatch=args.skip_rag_on_mismatch)
+    except SnapshotError as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+    for table, counts in result["tables"].items():
+        print(f"  {table}: {counts['imported']} imported, {counts['existing']} already present, "
+              f"{counts['skipped']} skipped")
+
+if __name__ == "__main__":
+    main()
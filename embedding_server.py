@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+import asyncio
+import argparse
+from dotenv import load_dotenv
+from rag.embedding_service import EmbeddingServer, SENTENCE_MODEL, CHROMA_MODEL
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve embeddings to all API workers on this host over a Unix socket")
+    parser.add_argument("--socket", default=None, help="Socket path (default: EMBEDDING_SERVICE_SOCKET or /tmp/threejs-embeddings.sock)")
+    parser.add_argument("--models", nargs="+", default=[SENTENCE_MODEL, CHROMA_MODEL],
+                        choices=[SENTENCE_MODEL, CHROMA_MODEL], help="Models to load")
+    parser.add_argument("--max-batch", type=int, default=64, help="Maximum texts per forward pass")
+    parser.add_argument("--max-wait-ms", type=float, default=2.0, help="How long to gather concurrent requests into one batch")
+    args = parser.parse_args()
+    
+    # Load environment variables
+    load_dotenv()
+    
+    server = EmbeddingServer(
+        socket_path=args.socket,
+        models=args.models,
+        max_batch=args.max_batch,
+        max_wait_ms=args.max_wait_ms
+    )
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        print(f"Embedding server stopped: {server.get_stats()}")
+
+if __name__ == "__main__":
+    main()
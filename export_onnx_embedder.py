@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import argparse
+import numpy as np
+from rag.embedding_service import EMBEDDING_MODEL
+from rag.onnx_embedder import (
+    OnnxEmbedder, compare_embeddings, DEFAULT_MODEL_DIR, MODEL_FILE, REFERENCE_FILE
+)
+
+# Texts the accuracy check runs over when no --eval-file is given
+EVAL_FILES = [
+    os.path.join("benchmarks", "diagram_type_labels.jsonl"),
+    os.path.join("benchmarks", "khan_catalog_labels.jsonl"),
+]
+
+# Stored with fp32 vectors for the startup self-test
+PROBE_TEXTS = [
+    "create rotating cube with lighting",
+    "particle system with animation",
+    "3D mathematical function plotting",
+    "physics simulation bouncing balls",
+    "Show the photosynthesis process as a flowchart",
+    "sequence diagram of a login handshake",
+    "database schema for an online store",
+    "Newton's second law of motion",
+    "the Pythagorean theorem",
+    "vector field visualization with arrows",
+    "solar system with orbiting planets",
+    "how a bill becomes a law",
+]
+
+def load_eval_texts(paths):
+    texts = []
+    for path in paths:
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    texts.append(item.get("prompt") or item.get("topic") or item.get("text"))
+    return [text for text in texts if text]
+
+def export(model, out_dir, opset):
+    import torch
+
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+    tokenizer.save_pretrained(out_dir)
+
+    fp32_path = os.path.join(out_dir, "model_fp32.onnx")
+    sample = tokenizer(["export sample text"], return_tensors="pt")
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset
+        )
+    return fp32_path
+
+def quantize(fp32_path, int8_path):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the sentence embedding model to int8 ONNX and check it against fp32")
+    parser.add_argument("--out", default=DEFAULT_MODEL_DIR, help="Model directory (ONNX_EMBEDDING_MODEL_DIR)")
+    parser.add_argument("--eval-file", action="append", help="JSONL with prompt/topic/text fields for the accuracy check (repeatable)")
+    parser.add_argument("--opset", type=int, default=14, help="ONNX opset version")
+    parser.add_argument("--keep-fp32", action="store_true", help="Keep the intermediate fp32 ONNX file")
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(args.out, exist_ok=True)
+    model = SentenceTransformer(EMBEDDING_MODEL)
+
+    print(f"Exporting {EMBEDDING_MODEL} to {args.out}...")
+    fp32_path = export(model, args.out, args.opset)
+    int8_path = os.path.join(args.out, MODEL_FILE)
+    quantize(fp32_path, int8_path)
+    print(f"  fp32 {os.path.getsize(fp32_path) / 1e6:.1f} MB -> int8 {os.path.getsize(int8_path) / 1e6:.1f} MB")
+    if not args.keep_fp32:
+        os.remove(fp32_path)
+
+    # Reference vectors for the startup self-test
+    np.savez(
+        os.path.join(args.out, REFERENCE_FILE),
+        texts=np.array(PROBE_TEXTS),
+        vectors=model.encode(PROBE_TEXTS, normalize_embeddings=True)
+    )
+
+    # Accuracy and speed against the fp32 PyTorch model
+    texts = PROBE_TEXTS + load_eval_texts(args.eval_file or [p for p in EVAL_FILES if os.path.exists(p)])
+    onnx_embedder = OnnxEmbedder(model_dir=args.out)
+
+    start = time.perf_counter()
+    fp32 = model.encode(texts, normalize_embeddings=True)
+    fp32_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    int8 = onnx_embedder.encode(texts)
+    int8_seconds = time.perf_counter() - start
+
+    report = compare_embeddings(fp32, int8)
+    report["fp32_ms_per_text"] = fp32_seconds / len(texts) * 1000
+    report["int8_ms_per_text"] = int8_seconds / len(texts) * 1000
+    report["intra_op_threads"] = onnx_embedder.intra_op_threads
+    with open(os.path.join(args.out, "accuracy.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"✅ {report['texts']} texts: mean cosine {report['mean_cosine']:.4f}, "
+          f"min {report['min_cosine']:.4f}, nearest-neighbour agreement {report['neighbor_agreement']:.1%}")
+    print(f"   fp32 {report['fp32_ms_per_text']:.2f} ms/text, int8 {report['int8_ms_per_text']:.2f} ms/text")
+
+    self_test = onnx_embedder.self_test()
+    if not self_test["passed"]:
+        print(f"⚠️ Self-test fails: min cosine {self_test['min_cosine']:.4f} < {self_test['threshold']}")
+
+if __name__ == "__main__":
+    main()
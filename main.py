@@ -1,21 +1,53 @@
-from fastapi import FastAPI, HTTPException, Request, Response
+# Imported first so the startup timing log measures from process start
+from app.startup import StartupState
+from fastapi import FastAPI, HTTPException, Request, Response, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 import os
 import json
+import time
+import hashlib
+import asyncio
 from pathlib import Path
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from googleapiclient.discovery import build
-from app.anthropic_client import AnthropicClient
-from app.mermaid_client import MermaidClient
-from rag.rag_engine import RAGEngine
+from app.pipeline_metrics import PipelineMetrics, PipelineRecord
+from app.model_router import ModelRouter
+from app.diagram_classifier import DiagramTypeClassifier
+from app.khan_video import KhanVideoFinder, KhanVideoNotFound
+from app.khan_catalog import KhanCatalog
+from app.degraded_mode import CircuitBreaker, StaleWhileRevalidate, UpstreamUnavailable
+from app.admission import Bulkhead, Overloaded, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from app.job_queue import JobStore, JobWorkerPool, RetryLater, TERMINAL_STATUSES
+from app.request_log import RequestLog
+from rag.query_canonicalizer import canonicalize_query
 
 # Load environment variables
 load_dotenv('.env.example')
 
+startup = StartupState()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Bind first and load models in the background (STARTUP_MODE=eager loads before binding)."""
+    startup.mark("import")
+    warm_start = None
+    if os.getenv("STARTUP_MODE", "background").lower() == "eager":
+        _initialize()
+        startup.mark_ready()
+        print(startup.summary_line())
+        job_workers.start()
+    else:
+        warm_start = asyncio.create_task(_warm_start())
+    yield
+    if warm_start is not None:
+        warm_start.cancel()
+    # Jobs cut off here are queued again on the next start
+    await job_workers.stop()
+
 # Set up FastAPI with full OpenAPI documentation
 app = FastAPI(
     title="ThreeJS Code Generator",
@@ -25,7 +57,8 @@ app = FastAPI(
     docs_url="/docs",
     redoc_url="/redoc",
     # OpenAPI documentation
-    openapi_tags=[]
+    openapi_tags=[],
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -58,6 +91,20 @@ class GenerateRequest(BaseModel):
 
 class GenerateResponse(BaseModel):
     code: str
+    cache_hit: Optional[str] = Field(None, description="'exact' or 'semantic' when served from the response cache")
+    stale: bool = Field(False, description="Served from the cache because Claude was slow or unavailable")
+    stale_reason: Optional[str] = Field(None, description="'deadline', 'upstream_error', 'circuit_open' or 'overloaded'")
+
+class RefineRequest(BaseModel):
+    previous_code: str = Field(..., description="Code returned by an earlier /generate or /refine call")
+    instruction: str = Field(..., description="The change to make, e.g. 'make the cube red'")
+    temperature: Optional[float] = 0.3
+    use_rag: bool = Field(False, description="Retrieve one reference example for the change request")
+
+class RefineResponse(BaseModel):
+    code: str
+    mode: str = Field(..., description="'edit' if targeted edits were applied, 'rewrite' if the model returned the full code")
+    edits_applied: int = 0
 
 class TopicRequest(BaseModel):
     topic: str = Field(..., description="The topic to search for Khan Academy videos")
@@ -67,50 +114,425 @@ class KhanVideoResponse(BaseModel):
     url: str
     description: str
     duration: Optional[str] = None
+    source: Optional[str] = Field(None, description="'catalog' (local index) or 'api' (YouTube search)")
 
 class MermaidRequest(BaseModel):
     prompt: str = Field(..., description="The prompt describing what Mermaid diagram to generate")
     type: str = Field("mermaid", description="Type field (should be 'mermaid')")
 
+class MermaidBatchItem(BaseModel):
+    prompt: str = Field(..., description="The prompt describing what Mermaid diagram to generate")
+    diagram_type: Optional[str] = Field(None, description="Explicit Mermaid diagram type; classified from the prompt when omitted")
+    id: Optional[str] = Field(None, description="Caller's identifier, echoed back in the result")
+
+class MermaidBatchRequest(BaseModel):
+    items: List[MermaidBatchItem] = Field(..., min_length=1)
+    concurrency: Optional[int] = Field(None, ge=1, description="Parallel LLM calls (capped by MERMAID_BATCH_CONCURRENCY)")
+
 class MermaidResponse(BaseModel):
     code: str
     success: Optional[bool] = True
+    cache_hit: Optional[str] = Field(None, description="'exact', 'semantic' or 'miss'")
+    stale: bool = Field(False, description="Served from the cache because Claude was slow or unavailable")
+    stale_reason: Optional[str] = Field(None, description="'deadline', 'upstream_error', 'circuit_open' or 'overloaded'")
+
+class MermaidJobRequest(BaseModel):
+    prompt: str = Field(..., description="The prompt describing what Mermaid diagram to generate")
+    diagram_type: Optional[str] = Field(None, description="Explicit Mermaid diagram type; classified from the prompt when omitted")
+
+class JobResponse(BaseModel):
+    job_id: str
+    kind: str = Field(..., description="'generate' or 'generate-mermaid'")
+    status: str = Field(..., description="'queued', 'running', 'succeeded' or 'failed'")
+    deduplicated: bool = Field(False, description="An identical job already existed; its ID is returned instead of a new one")
+    attempts: int = 0
+    created_at: float
+    finished_at: Optional[float] = None
+    expires_at: Optional[float] = Field(None, description="When the result is deleted (unix time)")
+    result: Optional[Dict[str, Any]] = Field(None, description="The /generate or /generate-mermaid response body once succeeded")
+    error: Optional[str] = None
+
+
+# Built by _initialize() once the server is up; endpoints that use them
+# depend on require_ready
+anthropic_client = None
+mermaid_client = None
+rag_engine = None
+
+# Cached code is only served for near-identical prompts; small wording
+# changes ("red cube" vs "blue cube") must not return the wrong scene.
+CODE_CACHE_SIMILARITY = float(os.getenv("CODE_CACHE_SIMILARITY", "0.95"))
+# Degraded mode: when Claude misses the deadline or the circuit is open, the
+# closest cached answer under these relaxed thresholds is served as stale
+STALE_CODE_SIMILARITY = float(os.getenv("STALE_CODE_SIMILARITY", "0.85"))
+STALE_DIAGRAM_MARGIN = float(os.getenv("STALE_DIAGRAM_MARGIN", "0.05"))
+UPSTREAM_RETRY_AFTER = os.getenv("UPSTREAM_RETRY_AFTER", "30")
+claude_breaker = CircuitBreaker("claude")
+code_degraded = StaleWhileRevalidate(
+    "generate", claude_breaker, deadline=float(os.getenv("GENERATE_DEADLINE", "45"))
+)
+diagram_degraded = StaleWhileRevalidate(
+    "generate-mermaid", claude_breaker, deadline=float(os.getenv("MERMAID_DEADLINE", "20"))
+)
+MERMAID_BATCH_CONCURRENCY = int(os.getenv("MERMAID_BATCH_CONCURRENCY", "8"))
+MERMAID_BATCH_MAX_ITEMS = int(os.getenv("MERMAID_BATCH_MAX_ITEMS", "100"))
+pipeline_metrics = PipelineMetrics(window=int(os.getenv("PIPELINE_METRICS_WINDOW", "1000")))
+model_router = ModelRouter()
+
+# Admission control: each LLM-backed endpoint has its own bulkhead, so a
+# spike on one cannot starve the others. Cache hits are answered before
+# admission and never queue.
+generate_bulkhead = Bulkhead(
+    "generate",
+    max_concurrent=int(os.getenv("GENERATE_MAX_CONCURRENT", "16")),
+    max_queue=int(os.getenv("GENERATE_MAX_QUEUE", "64")),
+    queue_timeout=float(os.getenv("GENERATE_QUEUE_TIMEOUT", "10"))
+)
+mermaid_bulkhead = Bulkhead(
+    "generate-mermaid",
+    max_concurrent=int(os.getenv("MERMAID_MAX_CONCURRENT", "32")),
+    max_queue=int(os.getenv("MERMAID_MAX_QUEUE", "128")),
+    queue_timeout=float(os.getenv("MERMAID_QUEUE_TIMEOUT", "5"))
+)
+khan_bulkhead = Bulkhead(
+    "find-khan-video",
+    max_concurrent=int(os.getenv("KHAN_MAX_CONCURRENT", "8")),
+    max_queue=int(os.getenv("KHAN_MAX_QUEUE", "32")),
+    queue_timeout=float(os.getenv("KHAN_QUEUE_TIMEOUT", "5"))
+)
+khan_video_finder = KhanVideoFinder(bulkhead=khan_bulkhead)
+diagram_classifier = DiagramTypeClassifier()
+
+STARTUP_RETRY_AFTER = os.getenv("STARTUP_RETRY_AFTER", "5")
+WARM_UP_QUERY = "create rotating cube with lighting"
+# JSONL of /generate prompts; the startup cache warm-up replays the most
+# frequent ones. Written by a background thread and rotated at
+# REQUEST_LOG_MAX_BYTES.
+REQUEST_LOG = os.getenv("REQUEST_LOG")
+request_log = RequestLog(REQUEST_LOG) if REQUEST_LOG else None
+
+def _initialize():
+    """Load the LLM clients, embedding models and indexes, then run a warm-up query."""
+    global anthropic_client, mermaid_client, rag_engine
+    with startup.phase("llm_clients"):
+        from app.anthropic_client import AnthropicClient
+        from app.mermaid_client import MermaidClient
+        anthropic_client = AnthropicClient()
+        mermaid_client = MermaidClient()
+    
+    with startup.phase("rag_engine"):
+        from rag.rag_engine import RAGEngine
+        rag_engine = RAGEngine("dataset")
+    
+    # Snapshots seed a node-local SQLite cache; a shared backend is already warm
+    snapshot_path = os.getenv("CACHE_SNAPSHOT")
+    if snapshot_path and os.path.exists(snapshot_path) and rag_engine.cache.backend.name == "sqlite":
+        with startup.phase("cache_snapshot"):
+            # Seed a fresh replica with another replica's cache; local entries win
+            from rag.cache_snapshot import import_snapshot, SnapshotError
+            try:
+                result = import_snapshot(
+                    rag_engine.cache.db_path, snapshot_path, rag_engine.index_version(),
+                    skip_rag_on_mismatch=os.getenv("CACHE_SNAPSHOT_PARTIAL") == "1",
+                    diagram_max_entries=rag_engine.cache.diagram_max_entries
+                )
+                imported = sum(table["imported"] for table in result["tables"].values())
+                print(f"📦 Imported {imported} cache entries from {snapshot_path}")
+            except SnapshotError as e:
+                print(f"⚠️ Cache snapshot rejected: {e}")
+    
+    with startup.phase("khan_catalog"):
+        # Local catalog of the channel's videos (filled by sync_khan_catalog.py)
+        khan_video_finder.catalog = KhanCatalog(embed_fn=rag_engine.cache.embedder.encode)
+    
+    # Nearest-centroid embedding fallback for prompts with no keyword cues is opt-in
+    if os.getenv("DIAGRAM_TYPE_EMBEDDINGS") == "1":
+        diagram_classifier.embed_fn = rag_engine.cache.embedder.encode
+    
+    with startup.phase("warm_up"):
+        # The first encode and query pay for kernel setup and loading the HNSW
+        # index; do them here instead of in the first user's request
+        rag_engine.cache.embedder.encode(WARM_UP_QUERY)
+        rag_engine.embedding_function([WARM_UP_QUERY])
+        if rag_engine.collection.count():
+            rag_engine.collection.query(query_texts=[WARM_UP_QUERY], n_results=1)
+    
+    if os.getenv("CACHE_WARMUP", "on").lower() != "off":
+        with startup.phase("cache_warmup"):
+            from app.cache_warmer import CacheWarmer
+            CacheWarmer(rag_engine).run()
+
+async def _warm_start():
+    try:
+        await asyncio.to_thread(_initialize)
+        startup.mark_ready()
+        print(startup.summary_line())
+        job_workers.start()
+    except Exception as e:
+        startup.mark_failed(e)
+        print(f"❌ Startup failed: {startup.error}")
 
+def _capture_request(prompt: str, context: Optional[str]):
+    if request_log is not None:
+        request_log.append(prompt, context)
 
-anthropic_client = AnthropicClient()
-mermaid_client = MermaidClient()
-rag_engine = RAGEngine("dataset")
+def require_ready():
+    """503 with Retry-After until the background startup has finished."""
+    if not startup.ready:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service is {startup.status}",
+            headers={"Retry-After": STARTUP_RETRY_AFTER}
+        )
 
 @app.get("/")
 async def root():
     return {"message": "ThreeJS Code Generator API"}
 
-@app.post("/generate", response_model=GenerateResponse)
-async def generate_threejs_code(request: GenerateRequest):
+async def _generate_code(request: GenerateRequest, record: PipelineRecord) -> GenerateResponse:
+    """Retrieve examples, route and call Claude; clean code is added to the code cache.
+    
+    Records its own pipeline metrics, since after a missed deadline it
+    finishes in the background.
+    """
+    route = None
+    quality = None
     try:
-        relevant_docs = rag_engine.search(request.prompt, k=5)
+        with record.stage("retrieval"):
+            relevant_docs = await asyncio.to_thread(rag_engine.search, request.prompt, k=5, record=record)
+        
+        distances = [doc["distance"] for doc in relevant_docs if doc.get("distance") is not None]
+        route = model_router.route(
+            "threejs",
+            request.prompt,
+            rag_distance=min(distances) if distances else None
+        )
         
-        context = "\n\n".join([doc["content"] for doc in relevant_docs])
-        if request.context:
-            context += f"\n\nAdditional context: {request.context}"
+        with record.stage("context_assembly"):
+            context = "\n\n".join([doc["content"] for doc in relevant_docs])
+            if request.context:
+                context += f"\n\nAdditional context: {request.context}"
         
         response = await anthropic_client.generate_threejs_code(
             prompt=request.prompt,
             context=context,
-            temperature=request.temperature
+            temperature=request.temperature,
+            record=record,
+            route=route
         )
         
+        if response["code"].startswith("// Error"):
+            quality = "extract_failed"
+        elif response["code"].startswith("// WARNING: Fixed violations"):
+            quality = "fixed_violations"
+        else:
+            quality = "clean"
+            # Unrated (quality 0.0): served again for the same prompt, and as
+            # the stale fallback for similar prompts while Claude is down
+            await asyncio.to_thread(
+                rag_engine.cache.cache_code_result,
+                request.prompt,
+                request.context or "",
+                request.temperature,
+                response["code"],
+                source="live",
+                provenance={"model": record.model}
+            )
+        
         return GenerateResponse(
             code=response["code"],
         )
+    except Exception as e:
+        record.error = str(e)
+        raise
+    finally:
+        pipeline_metrics.record(record)
+        if route is not None:
+            model_router.record_outcome(route, record, success=record.error is None, quality=quality)
+
+async def _stale_code(request: GenerateRequest) -> Optional[GenerateResponse]:
+    """Closest cached code under the relaxed degraded-mode threshold, unrated entries included."""
+    cached = await asyncio.to_thread(
+        rag_engine.cache.get_code_result,
+        request.prompt,
+        request.context or "",
+        request.temperature,
+        similarity_threshold=STALE_CODE_SIMILARITY,
+        min_quality=None
+    )
+    if not cached:
+        return None
+    code, cache_metadata = cached
+    return GenerateResponse(code=code, cache_hit=cache_metadata["cache_hit"], stale=True)
+
+@app.post("/generate", response_model=GenerateResponse, dependencies=[Depends(require_ready)])
+async def generate_threejs_code(request: GenerateRequest):
+    record = PipelineRecord("generate")
+    _capture_request(request.prompt, request.context)
+    try:
+        # Lookups and searches run in worker threads so concurrent requests
+        # can share embedding batches instead of blocking the event loop
+        with record.stage("response_cache"):
+            cached = await asyncio.to_thread(
+                rag_engine.cache.get_code_result,
+                request.prompt,
+                request.context or "",
+                request.temperature,
+                similarity_threshold=CODE_CACHE_SIMILARITY
+            )
+    except Exception as e:
+        record.error = str(e)
+        pipeline_metrics.record(record)
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if cached:
+        pipeline_metrics.record(record)
+        code, cache_metadata = cached
+        print(f"🚀 Code cache hit ({cache_metadata['cache_hit']}) for: {request.prompt[:50]}...")
+        return GenerateResponse(code=code, cache_hit=cache_metadata["cache_hit"])
+    
+    slot = None
+    try:
+        async with generate_bulkhead.slot(PRIORITY_INTERACTIVE) as slot:
+            # The generation keeps its slot if it outlives a stale answer
+            response, stale_reason = await code_degraded.run(
+                ("generate", request.prompt, request.context or "", request.temperature),
+                fresh=lambda: slot.hold(_generate_code(request, record)),
+                stale=lambda: _stale_code(request),
+                refresh=lambda: _generate_code(request, PipelineRecord("generate-refresh"))
+            )
+    except Overloaded as e:
+        # Shed: a stale answer beats a 503
+        response, stale_reason = await _stale_code(request), "overloaded"
+        if response is None:
+            record.error = str(e)
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except UpstreamUnavailable as e:
+        record.error = str(e)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": UPSTREAM_RETRY_AFTER})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # _generate_code records its own metrics once it has started
+        if slot is None or not slot.held:
+            pipeline_metrics.record(record)
+    
+    if stale_reason:
+        response.stale_reason = stale_reason
+        print(f"🕰️ Serving stale code ({stale_reason}) for: {request.prompt[:50]}...")
+    return response
+
+@app.post("/refine", response_model=RefineResponse, dependencies=[Depends(require_ready)])
+async def refine_threejs_code(request: RefineRequest):
+    """Edit previously generated code instead of regenerating it from scratch."""
+    record = PipelineRecord("refine")
+    route = None
+    try:
+        context = None
+        if request.use_rag:
+            with record.stage("retrieval"):
+                # Not cached: a one-document entry would answer later /generate searches with k=5
+                relevant_docs = await asyncio.to_thread(
+                    rag_engine.search, request.instruction, k=1, record=record, cache_results=False
+                )
+            with record.stage("context_assembly"):
+                # A single, trimmed example is enough to show an unfamiliar API
+                context = "\n\n".join(doc["content"][:4000] for doc in relevant_docs) or None
+        
+        route = model_router.route("threejs", request.instruction)
+        
+        async with generate_bulkhead.slot(PRIORITY_INTERACTIVE):
+            response = await anthropic_client.refine_threejs_code(
+                previous_code=request.previous_code,
+                instruction=request.instruction,
+                context=context,
+                temperature=request.temperature,
+                record=record,
+                route=route
+            )
+        
+        return RefineResponse(**response)
+    except Overloaded as e:
+        record.error = str(e)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        record.error = str(e)
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        pipeline_metrics.record(record)
+        if route is not None:
+            model_router.record_outcome(route, record, success=record.error is None)
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
-@app.post("/index-dataset")
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 200 once models are loaded and warm, 503 before that (or if startup failed)."""
+    report = startup.report()
+    if not startup.ready:
+        return JSONResponse(status_code=503, content=report, headers={"Retry-After": STARTUP_RETRY_AFTER})
+    return report
+
+@app.get("/metrics/pipeline")
+async def get_pipeline_metrics(recent: int = 0):
+    """Rolling per-stage latency and token percentiles for LLM-backed endpoints."""
+    summary = pipeline_metrics.summary()
+    if recent > 0:
+        summary["recent"] = pipeline_metrics.recent(limit=recent)
+    return summary
+
+@app.get("/metrics/embeddings", dependencies=[Depends(require_ready)])
+async def get_embedding_metrics():
+    """Embedding micro-batching: batch size, queue wait and gather window histograms."""
+    return rag_engine.get_embedding_stats()
+
+@app.get("/metrics/cache", dependencies=[Depends(require_ready)])
+async def get_cache_metrics():
+    """SmartCache sizes and hit rates, with the in-process L1 and SQLite L2 reported separately."""
+    return await asyncio.to_thread(rag_engine.cache.get_cache_stats)
+
+@app.get("/metrics/upstream")
+async def get_upstream_metrics():
+    """Claude circuit breaker state and how often stale cached answers were served."""
+    return {
+        "breaker": claude_breaker.get_stats(),
+        "generate": code_degraded.get_stats(),
+        "generate_mermaid": diagram_degraded.get_stats(),
+    }
+
+@app.get("/metrics/admission")
+async def get_admission_metrics():
+    """Per-endpoint bulkheads: active slots, queue depth by priority lane and shed counts."""
+    return {bulkhead.name: bulkhead.get_stats() for bulkhead in (generate_bulkhead, mermaid_bulkhead, khan_bulkhead)}
+
+@app.get("/metrics/jobs")
+async def get_job_metrics():
+    """Job queue: jobs per status, worker outcomes and result TTL."""
+    return await asyncio.to_thread(job_workers.get_stats)
+
+@app.get("/metrics/khan-video")
+async def get_khan_video_metrics():
+    """Khan Academy video lookups: cache hits and YouTube API calls made."""
+    return khan_video_finder.get_stats()
+
+@app.get("/metrics/js-gate", dependencies=[Depends(require_ready)])
+async def get_js_gate_metrics():
+    """JavaScript syntax gate latency, cache hits, parse failures and per-rule fix counts."""
+    return anthropic_client.js_gate.get_stats()
+
+@app.get("/metrics/mermaid-validation", dependencies=[Depends(require_ready)])
+async def get_mermaid_validation_metrics():
+    """Local Mermaid validation latency (microseconds), failure counts and repair outcomes."""
+    return mermaid_client.get_validation_stats()
+
+@app.get("/metrics/routing")
+async def get_routing_metrics():
+    """Per-tier outcomes of the model router."""
+    return model_router.get_stats()
+
+@app.post("/index-dataset", dependencies=[Depends(require_ready)])
 async def index_dataset():
     try:
         rag_engine.index_documents()
@@ -157,171 +579,396 @@ async def get_logo():
     """Redirect to static logo for compatibility with older integrations."""
     return FileResponse("static/logo.png")
 
-@app.post("/generate-mermaid", response_model=MermaidResponse)
-async def generate_mermaid_diagram(request: MermaidRequest):
-    """Generate Mermaid diagram code for frontend consumption."""
+async def _cached_diagram(prompt: str, diagram_type: str, record: PipelineRecord) -> Optional[MermaidResponse]:
+    """Serve a diagram from the diagram cache, or None on a miss."""
+    with record.stage("response_cache"):
+        cached = await asyncio.to_thread(rag_engine.cache.get_diagram_result, prompt, diagram_type)
+    if not cached:
+        return None
+    mermaid_code, cache_metadata = cached
+    print(f"🚀 Diagram cache hit ({cache_metadata['cache_hit']}) for: {prompt[:50]}...")
+    return MermaidResponse(code=mermaid_code, success=True, cache_hit=cache_metadata["cache_hit"])
+
+async def _fresh_diagram(prompt: str, diagram_type: str, record: PipelineRecord) -> MermaidResponse:
+    """Route, generate and cache one diagram; errors are raised."""
+    route = None
     try:
-        # Determine diagram type from prompt or default to flowchart
-        diagram_type = "flowchart"
-        prompt_lower = request.prompt.lower()
-        
-        if any(word in prompt_lower for word in ["sequence", "interaction", "communication"]):
-            diagram_type = "sequenceDiagram"
-        elif any(word in prompt_lower for word in ["class", "uml", "inheritance"]):
-            diagram_type = "classDiagram"
-        elif any(word in prompt_lower for word in ["state", "transition", "fsm", "finite state"]):
-            diagram_type = "stateDiagram-v2"
-        elif any(word in prompt_lower for word in ["entity", "database", "er diagram", "erd"]):
-            diagram_type = "erDiagram"
-        elif any(word in prompt_lower for word in ["journey", "user journey", "customer journey"]):
-            diagram_type = "journey"
-        elif any(word in prompt_lower for word in ["gantt", "project timeline", "schedule"]):
-            diagram_type = "gantt"
-        elif any(word in prompt_lower for word in ["pie", "percentage", "distribution"]):
-            diagram_type = "pie"
-        elif any(word in prompt_lower for word in ["quadrant", "four quadrants", "2x2 matrix"]):
-            diagram_type = "quadrantChart"
-        elif any(word in prompt_lower for word in ["requirement", "requirements"]):
-            diagram_type = "requirementDiagram"
-        elif any(word in prompt_lower for word in ["git", "branch", "commit", "merge"]):
-            diagram_type = "gitgraph"
-        elif any(word in prompt_lower for word in ["c4", "context diagram", "system context"]):
-            diagram_type = "C4Context"
-        elif any(word in prompt_lower for word in ["mindmap", "mind map", "brainstorm"]):
-            diagram_type = "mindmap"
-        elif any(word in prompt_lower for word in ["timeline", "chronology", "history"]):
-            diagram_type = "timeline"
-        elif any(word in prompt_lower for word in ["zenuml", "zen", "uml sequence"]):
-            diagram_type = "zenuml"
-        elif any(word in prompt_lower for word in ["sankey", "flow diagram", "energy flow"]):
-            diagram_type = "sankey-beta"
-        elif any(word in prompt_lower for word in ["xy chart", "xy graph", "bar chart", "line chart"]):
-            diagram_type = "xychart-beta"
-        elif any(word in prompt_lower for word in ["block", "blocks", "grid"]):
-            diagram_type = "block-beta"
-        elif any(word in prompt_lower for word in ["packet", "network packet", "data packet"]):
-            diagram_type = "packet-beta"
-        elif any(word in prompt_lower for word in ["kanban", "task board", "todo board"]):
-            diagram_type = "kanban"
-        elif any(word in prompt_lower for word in ["architecture", "system architecture"]):
-            diagram_type = "architecture-beta"
-        elif any(word in prompt_lower for word in ["radar", "spider", "skills", "assessment"]):
-            diagram_type = "radar"
-        elif any(word in prompt_lower for word in ["treemap", "tree map", "hierarchical"]):
-            diagram_type = "treemap-beta"
+        route = model_router.route("mermaid", prompt, diagram_type=diagram_type)
         
         # Use the specialized Mermaid client
         response = await mermaid_client.generate_mermaid_diagram(
-            prompt=request.prompt,
+            prompt=prompt,
             diagram_type=diagram_type,
             context=None,
-            temperature=0.3
+            temperature=0.3,
+            record=record,
+            route=route
         )
         
         mermaid_code = response["mermaid_code"]
         
+        # Diagrams that failed validation are never admitted to the cache
+        if response["valid"]:
+            await asyncio.to_thread(rag_engine.cache.cache_diagram_result, prompt, diagram_type, mermaid_code)
+        
         return MermaidResponse(
             code=mermaid_code,
-            success=True
+            success=True,
+            cache_hit="miss"
         )
     except Exception as e:
+        record.error = str(e)
+        raise
+    finally:
+        if route is not None:
+            # Callers hand the record to pipeline_metrics later (a batch only
+            # at its end), so stamp its total time before logging the outcome
+            record.finish()
+            model_router.record_outcome(route, record, success=record.error is None)
+
+async def _refresh_diagram(prompt: str, diagram_type: str):
+    record = PipelineRecord("generate-mermaid-refresh")
+    try:
+        await _fresh_diagram(prompt, diagram_type, record)
+    finally:
+        pipeline_metrics.record(record)
+
+async def _stale_diagram(prompt: str, diagram_type: str) -> Optional[MermaidResponse]:
+    """Closest cached diagram of the same type under the relaxed degraded-mode threshold."""
+    from rag.smart_cache import DIAGRAM_SIMILARITY_THRESHOLDS
+    threshold = DIAGRAM_SIMILARITY_THRESHOLDS.get(diagram_type, DIAGRAM_SIMILARITY_THRESHOLDS["default"])
+    cached = await asyncio.to_thread(
+        rag_engine.cache.get_diagram_result, prompt, diagram_type,
+        similarity_threshold=threshold - STALE_DIAGRAM_MARGIN
+    )
+    if not cached:
+        return None
+    mermaid_code, cache_metadata = cached
+    return MermaidResponse(code=mermaid_code, success=True, cache_hit=cache_metadata["cache_hit"], stale=True)
+
+async def _generate_diagram(prompt: str, diagram_type: str, record: PipelineRecord,
+                            priority: int = PRIORITY_INTERACTIVE) -> MermaidResponse:
+    """Generate one diagram, falling back to a stale cached one; errors become an error flowchart.
+    
+    Raises Overloaded when the mermaid bulkhead sheds the request and
+    there is no stale diagram to serve.
+    """
+    try:
+        async with mermaid_bulkhead.slot(priority) as slot:
+            result, stale_reason = await diagram_degraded.run(
+                ("generate-mermaid", prompt, diagram_type),
+                fresh=lambda: slot.hold(_fresh_diagram(prompt, diagram_type, record)),
+                stale=lambda: _stale_diagram(prompt, diagram_type),
+                refresh=lambda: _refresh_diagram(prompt, diagram_type)
+            )
+    except Overloaded as e:
+        result, stale_reason = await _stale_diagram(prompt, diagram_type), "overloaded"
+        if result is None:
+            record.error = str(e)
+            raise
+    except Exception as e:
+        record.error = str(e)
         return MermaidResponse(
             code=f"flowchart TD\n    A[Error: {str(e)}]",
             success=False
         )
+    if stale_reason:
+        result.stale_reason = stale_reason
+        print(f"🕰️ Serving stale diagram ({stale_reason}) for: {prompt[:50]}...")
+    return result
 
-@app.post("/find-khan-video", response_model=KhanVideoResponse)
-async def find_khan_video(request: TopicRequest):
-    """Find the best Khan Academy video for a given topic using YouTube API."""
-    youtube_api_key = os.getenv("YOUTUBE_API_KEY")
-    
-    # Debug: Print what we got
-    print(f"DEBUG: YOUTUBE_API_KEY = '{youtube_api_key}' (length: {len(youtube_api_key) if youtube_api_key else 0})")
+@app.post("/generate-mermaid", response_model=MermaidResponse, dependencies=[Depends(require_ready)])
+async def generate_mermaid_diagram(request: MermaidRequest):
+    """Generate Mermaid diagram code for frontend consumption."""
+    record = PipelineRecord("generate-mermaid")
+    try:
+        # Determine diagram type from prompt or default to flowchart
+        with record.stage("classification"):
+            diagram_type = diagram_classifier.classify(request.prompt)
+        
+        cached = await _cached_diagram(request.prompt, diagram_type, record)
+        if cached:
+            return cached
+        
+        return await _generate_diagram(request.prompt, diagram_type, record)
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        record.error = str(e)
+        return MermaidResponse(
+            code=f"flowchart TD\n    A[Error: {str(e)}]",
+            success=False
+        )
+    finally:
+        pipeline_metrics.record(record)
+
+@app.post("/generate-mermaid/batch", dependencies=[Depends(require_ready)])
+async def generate_mermaid_batch(request: MermaidBatchRequest):
+    """Generate many diagrams at once, streaming NDJSON lines as each one completes.
     
-    if not youtube_api_key or youtube_api_key.strip() == "":
+    Prompts without an explicit type are classified in one pass. Repeated
+    prompts are generated once. Cache hits are streamed first, and the
+    misses fan out to the LLM with bounded concurrency.
+    """
+    if len(request.items) > MERMAID_BATCH_MAX_ITEMS:
         raise HTTPException(
-            status_code=500, 
-            detail="YouTube API key not configured. Please set YOUTUBE_API_KEY environment variable."
+            status_code=413,
+            detail=f"At most {MERMAID_BATCH_MAX_ITEMS} diagrams per batch"
         )
     
-    try:
-        # Build YouTube API client
-        youtube = build("youtube", "v3", developerKey=youtube_api_key)
-        
-        # Khan Academy's YouTube channel ID
-        khan_channel_id = "UC4a-Gbdw7vOaccHmFo40b9g"
-        
-        # Search for videos in Khan Academy channel
-        search_query = f"Khan Academy {request.topic}"
-        
-        search_response = youtube.search().list(
-            q=search_query,
-            channelId=khan_channel_id,
-            part="snippet",
-            maxResults=5,
-            order="relevance",
-            type="video"
-        ).execute()
-        
-        if not search_response.get('items'):
-            raise HTTPException(
-                status_code=404,
-                detail=f"No Khan Academy videos found for topic: {request.topic}"
-            )
+    start = time.perf_counter()
+    prompts = [item.prompt for item in request.items]
+    diagram_types = [item.diagram_type for item in request.items]
+    
+    unclassified = [i for i, diagram_type in enumerate(diagram_types) if not diagram_type]
+    for i, diagram_type in zip(unclassified, diagram_classifier.classify_many([prompts[i] for i in unclassified])):
+        diagram_types[i] = diagram_type
+    
+    # Same prompt and type (ignoring case and whitespace) is generated once
+    groups: Dict[tuple, List[int]] = {}
+    for i, prompt in enumerate(prompts):
+        groups.setdefault((" ".join(prompt.lower().split()), diagram_types[i]), []).append(i)
+    
+    concurrency = min(request.concurrency or MERMAID_BATCH_CONCURRENCY, MERMAID_BATCH_CONCURRENCY)
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    def lines(indices: List[int], result: MermaidResponse) -> str:
+        return "".join(
+            json.dumps({
+                "index": i,
+                "id": request.items[i].id,
+                "diagram_type": diagram_types[i],
+                "code": result.code,
+                "success": result.success,
+                "cache_hit": result.cache_hit,
+                "stale": result.stale,
+                "duplicate_of": indices[0] if i != indices[0] else None,
+            }) + "\n"
+            for i in indices
+        )
+    
+    async def generate_group(indices: List[int]):
+        async with semaphore:
+            record = PipelineRecord("generate-mermaid-batch")
+            try:
+                return indices, await _generate_diagram(
+                    prompts[indices[0]], diagram_types[indices[0]], record, priority=PRIORITY_BATCH
+                )
+            except Overloaded as e:
+                return indices, MermaidResponse(code=f"flowchart TD\n    A[Error: {str(e)}]", success=False)
+            finally:
+                pipeline_metrics.record(record)
+    
+    async def stream():
+        counts = {"succeeded": 0, "failed": 0, "cache_hits": 0}
         
-        # Get the best match (first result is most relevant)
-        best_video = search_response['items'][0]
-        video_id = best_video['id']['videoId']
+        def tally(indices: List[int], result: MermaidResponse):
+            counts["succeeded" if result.success else "failed"] += len(indices)
+            if result.cache_hit in ("exact", "semantic"):
+                counts["cache_hits"] += len(indices)
         
-        # Get additional video details (duration, etc.)
-        video_details = youtube.videos().list(
-            part="contentDetails,snippet",
-            id=video_id
-        ).execute()
+        # All cache lookups at once, so their prompt embeddings share a batch
+        records = [PipelineRecord("generate-mermaid-batch") for _ in groups]
+        lookups = await asyncio.gather(*(
+            _cached_diagram(prompts[indices[0]], diagram_types[indices[0]], record)
+            for indices, record in zip(groups.values(), records)
+        ))
         
-        if video_details.get('items'):
-            duration = video_details['items'][0]['contentDetails'].get('duration', '')
-            # Convert ISO 8601 duration to readable format (PT4M13S -> 4:13)
-            duration = parse_duration(duration)
-        else:
-            duration = None
+        misses = []
+        for indices, record, cached in zip(groups.values(), records, lookups):
+            if cached:
+                pipeline_metrics.record(record)
+                tally(indices, cached)
+                yield lines(indices, cached)
+            else:
+                misses.append(indices)
         
-        return KhanVideoResponse(
-            title=best_video['snippet']['title'],
-            url=f"https://youtube.com/watch?v={video_id}",
-            description=best_video['snippet']['description'][:200] + "..." if len(best_video['snippet']['description']) > 200 else best_video['snippet']['description'],
-            duration=duration
-        )
+        tasks = [asyncio.ensure_future(generate_group(indices)) for indices in misses]
+        try:
+            for done in asyncio.as_completed(tasks):
+                indices, result = await done
+                tally(indices, result)
+                yield lines(indices, result)
+        finally:
+            # Client went away: stop generating what nobody will read
+            for task in tasks:
+                task.cancel()
         
-    except Exception as e:
-        if isinstance(e, HTTPException):
-            raise e
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error searching Khan Academy videos: {str(e)}"
+        yield json.dumps({
+            "done": True,
+            "total": len(prompts),
+            "unique": len(groups),
+            "generated": len(misses),
+            **counts,
+            "elapsed": round(time.perf_counter() - start, 3),
+        }) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+async def _upstream_job(bulkhead: Bulkhead, call):
+    """Run a job's LLM call in the batch lane of its bulkhead; shed or circuit open means retry later."""
+    try:
+        async with bulkhead.slot(PRIORITY_BATCH):
+            if not claude_breaker.allow():
+                raise RetryLater("upstream circuit is open", claude_breaker.reset_timeout)
+            try:
+                result = await call()
+            except Exception:
+                claude_breaker.record_failure()
+                raise
+    except Overloaded as e:
+        raise RetryLater(str(e), e.retry_after)
+    claude_breaker.record_success()
+    return result
+
+async def _run_generate_job(payload: Dict) -> Dict:
+    """The /generate pipeline without a deadline; a clean result lands in the code cache."""
+    request = GenerateRequest(**payload)
+    record = PipelineRecord("jobs-generate")
+    with record.stage("response_cache"):
+        cached = await asyncio.to_thread(
+            rag_engine.cache.get_code_result,
+            request.prompt,
+            request.context or "",
+            request.temperature,
+            similarity_threshold=CODE_CACHE_SIMILARITY
         )
+    if cached:
+        pipeline_metrics.record(record)
+        code, cache_metadata = cached
+        return GenerateResponse(code=code, cache_hit=cache_metadata["cache_hit"]).model_dump()
+    response = await _upstream_job(generate_bulkhead, lambda: _generate_code(request, record))
+    return response.model_dump()
 
-def parse_duration(iso_duration: str) -> Optional[str]:
-    """Convert ISO 8601 duration (PT4M13S) to readable format (4:13)."""
-    if not iso_duration:
-        return None
+async def _run_mermaid_job(payload: Dict) -> Dict:
+    """The /generate-mermaid pipeline without a deadline; a valid diagram lands in the diagram cache."""
+    request = MermaidJobRequest(**payload)
+    record = PipelineRecord("jobs-generate-mermaid")
+    try:
+        diagram_type = request.diagram_type or diagram_classifier.classify(request.prompt)
+        result = await _cached_diagram(request.prompt, diagram_type, record)
+        if result is None:
+            result = await _upstream_job(
+                mermaid_bulkhead, lambda: _fresh_diagram(request.prompt, diagram_type, record)
+            )
+        return {**result.model_dump(), "diagram_type": diagram_type}
+    finally:
+        pipeline_metrics.record(record)
+
+# Jobs are kept in a SQLite file (shareable by several processes) and
+# drained by workers that start once the models are loaded; submitting
+# works before that
+job_store = JobStore()
+job_workers = JobWorkerPool(job_store, {
+    "generate": _run_generate_job,
+    "generate-mermaid": _run_mermaid_job,
+})
+JOB_EVENTS_KEEPALIVE = float(os.getenv("JOB_EVENTS_KEEPALIVE", "15"))
+# Waiters are woken by this process's workers; a job run by another
+# process sharing JOB_DB is noticed by re-reading it this often
+JOB_STATUS_POLL = float(os.getenv("JOB_STATUS_POLL", "2"))
+
+def _job_key(kind: str, *parts) -> str:
+    """Dedup key: the same request (up to prompt canonicalization) maps to the same job."""
+    return hashlib.sha256(json.dumps([kind, *parts]).encode()).hexdigest()
+
+def _job_response(job: Dict) -> JobResponse:
+    return JobResponse(
+        job_id=job["id"],
+        kind=job["kind"],
+        status=job["status"],
+        deduplicated=job.get("deduplicated", False),
+        attempts=job["attempts"],
+        created_at=job["created_at"],
+        finished_at=job["finished_at"],
+        expires_at=job["expires_at"],
+        result=job["result"],
+        error=job["error"]
+    )
+
+async def _submit_job(kind: str, payload: Dict, dedup_key: str, response: Response) -> JobResponse:
+    job = await asyncio.to_thread(job_store.submit, kind, payload, dedup_key)
+    job_workers.notify_submitted()
+    response.headers["Location"] = f"/jobs/{job['id']}"
+    return _job_response(job)
+
+@app.post("/jobs/generate", response_model=JobResponse, status_code=202)
+async def submit_generate_job(request: GenerateRequest, response: Response):
+    """Queue a /generate request and return a job ID to poll or subscribe to."""
+    _capture_request(request.prompt, request.context)
+    dedup_key = _job_key("generate", canonicalize_query(request.prompt), request.context or "", request.temperature)
+    return await _submit_job("generate", request.model_dump(), dedup_key, response)
+
+@app.post("/jobs/generate-mermaid", response_model=JobResponse, status_code=202)
+async def submit_mermaid_job(request: MermaidJobRequest, response: Response):
+    """Queue a /generate-mermaid request and return a job ID to poll or subscribe to."""
+    dedup_key = _job_key("generate-mermaid", " ".join(request.prompt.lower().split()), request.diagram_type)
+    return await _submit_job("generate-mermaid", request.model_dump(), dedup_key, response)
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str, wait: float = 0):
+    """Job status and, once finished, its result. wait=N long-polls up to N seconds (max 60) for completion."""
+    deadline = time.monotonic() + min(max(wait, 0), 60)
+    job = await asyncio.to_thread(job_store.get, job_id)
+    while job is not None and job["status"] not in TERMINAL_STATUSES and time.monotonic() < deadline:
+        await job_workers.wait(job_id, min(deadline - time.monotonic(), JOB_STATUS_POLL))
+        job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return _job_response(job)
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Server-sent events: one event per status change, ending with 'succeeded' or 'failed'.
     
-    import re
+    A client that drops can reconnect to the same URL; it gets the current
+    status straight away.
+    """
+    if await asyncio.to_thread(job_store.get, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
     
-    # Parse PT4M13S format
-    match = re.match(r'PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?', iso_duration)
-    if not match:
-        return None
+    async def events():
+        last_status = None
+        last_sent = time.monotonic()
+        while True:
+            job = await asyncio.to_thread(job_store.get, job_id)
+            if job is None:
+                yield "event: expired\ndata: {}\n\n"
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                last_sent = time.monotonic()
+                yield f"event: {last_status}\ndata: {_job_response(job).model_dump_json()}\n\n"
+                if last_status in TERMINAL_STATUSES:
+                    return
+            elif time.monotonic() - last_sent >= JOB_EVENTS_KEEPALIVE:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+            await job_workers.wait(job_id, min(JOB_STATUS_POLL, JOB_EVENTS_KEEPALIVE))
     
-    hours, minutes, seconds = match.groups()
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/find-khan-video", response_model=KhanVideoResponse, dependencies=[Depends(require_ready)])
+async def find_khan_video(request: TopicRequest):
+    """Find the best Khan Academy video for a given topic using YouTube API."""
+    if not khan_video_finder.has_source():
+        raise HTTPException(
+            status_code=500, 
+            detail="YouTube API key not configured. Please set YOUTUBE_API_KEY environment variable."
+        )
     
-    # Convert to readable format
-    if hours:
-        return f"{hours}:{minutes or '00'}:{seconds or '00'}"
-    elif minutes:
-        return f"{minutes}:{seconds.zfill(2) if seconds else '00'}"
-    else:
-        return f"0:{seconds or '00'}"
+    try:
+        video = await khan_video_finder.find(request.topic)
+        return KhanVideoResponse(**video)
+    except KhanVideoNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error searching Khan Academy videos: {str(e)}"
+        )
 
 
 
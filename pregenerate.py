@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+import json
+import asyncio
+import argparse
+from dotenv import load_dotenv
+from app.anthropic_client import AnthropicClient
+from app.model_router import ModelRouter
+from app.pregenerate import PregenerationJob, load_prompts
+from app.stand_in_llm import StandInAnthropic
+from rag.rag_engine import RAGEngine
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate Three.js code for known prompts into the response cache")
+    parser.add_argument("prompt_file", help="Text file with one prompt per line, or JSONL with a 'prompt' field")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum generations in flight")
+    parser.add_argument("--rpm", type=float, default=None, help="Maximum generation requests started per minute")
+    parser.add_argument("--temperature", type=float, default=0.7, help="Temperature used for generation and the cache key")
+    parser.add_argument("--k", type=int, default=5, help="Number of RAG examples per prompt")
+    parser.add_argument("--force", action="store_true", help="Regenerate prompts that are already cached")
+    parser.add_argument("--stand-in", action="store_true", help="Use the local stand-in LLM instead of Claude")
+    parser.add_argument("--summary", help="Write the job summary as JSON to this path")
+    args = parser.parse_args()
+    
+    # Load environment variables
+    load_dotenv()
+    
+    prompts = load_prompts(args.prompt_file)
+    print(f"Loaded {len(prompts)} prompts from {args.prompt_file}")
+    
+    rag_engine = RAGEngine("dataset")
+    anthropic_client = AnthropicClient(client=StandInAnthropic() if args.stand_in else None)
+    
+    job = PregenerationJob(
+        rag_engine,
+        anthropic_client,
+        model_router=ModelRouter(),
+        concurrency=args.concurrency,
+        requests_per_minute=args.rpm,
+        temperature=args.temperature,
+        k=args.k,
+        skip_cached=not args.force
+    )
+    summary = asyncio.run(job.run(prompts))
+    
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == "__main__":
+    main()
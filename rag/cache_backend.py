@@ -0,0 +1,868 @@
+import os
+import json
+import math
+import time
+import pickle
+import sqlite3
+import fnmatch
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+
+# Storage layout of SmartCache's tables. Entries are dicts keyed by these
+# column names; embeddings come back as float32 arrays and RAG results as
+# lists of dicts, whatever the backend stores them as. Semantic candidates
+# can be restricted to a group: entries with the same values in the
+# "group" columns (a code match must share the context and temperature).
+CACHE_TABLES = {
+    "rag_cache": {
+        "key": "query_hash",
+        "text": "query_text",
+        "embedding": "query_embedding",
+        "order": "usage_count DESC, success_rate DESC",
+    },
+    "code_cache": {
+        "key": "prompt_hash",
+        "text": "prompt_text",
+        "embedding": "prompt_embedding",
+        "order": "quality_score DESC, usage_count DESC",
+        "group": ("context_hash", "temperature"),
+    },
+    "diagram_cache": {
+        "key": "diagram_hash",
+        "text": "prompt_text",
+        "embedding": "prompt_embedding",
+        "order": "usage_count DESC, last_used DESC",
+        "group": ("diagram_type",),
+    },
+}
+
+
+def group_name(group: Union[str, Sequence]) -> str:
+    """One string for a group's values; a single string value is its own name.
+
+    Numbers are written as floats (0.7 and 0.70 name the same group) and
+    None as "null", e.g. a request that leaves the temperature unset.
+    """
+    values = (group,) if isinstance(group, str) else tuple(group)
+    return "|".join(
+        value if isinstance(value, str) else json.dumps(None if value is None else float(value))
+        for value in values
+    )
+
+
+class CacheBackend:
+    """Storage for SmartCache's rag, code and diagram entries.
+
+    SmartCache keeps the matching logic (hashing, similarity, thresholds);
+    a backend only stores entries, counts usage and ranks candidates.
+    Entries older than ttls[table] seconds (from when they were written)
+    are treated as absent.
+    """
+
+    name = "base"
+
+    def __init__(self, ttls: Optional[Dict[str, int]] = None):
+        self.ttls = ttls or {}
+
+    def get(self, table: str, key: str) -> Optional[Dict]:
+        return self.get_many(table, [key]).get(key)
+
+    def get_many(self, table: str, keys: List[str]) -> Dict[str, Dict]:
+        raise NotImplementedError
+
+    def get_embeddings(self, table: str, keys: List[str]) -> Dict[str, np.ndarray]:
+        raise NotImplementedError
+
+    def insert(self, table: str, key: str, entry: Dict) -> bool:
+        """Store a new entry; an existing one is left alone. Returns whether it was added."""
+        raise NotImplementedError
+
+    def upsert(self, table: str, key: str, entry: Dict):
+        """Store an entry, replacing the fields of an existing one and restarting its TTL."""
+        raise NotImplementedError
+
+    def update(self, table: str, key: str, fields: Dict):
+        raise NotImplementedError
+
+    def record_usage(self, table: str, counts: Dict[str, int]):
+        """Add counts[key] to usage_count and mark the entries as just used, in one round trip."""
+        raise NotImplementedError
+
+    def top_keys(self, table: str, limit: Optional[int], group: Optional[Union[str, Sequence]] = None,
+                 min_quality: Optional[float] = None) -> List[str]:
+        """Keys of the best ranked live entries (see CACHE_TABLES order), optionally within a group.
+
+        group holds one value per group column (a plain string for a
+        one-column group); limit=None returns every matching key.
+        """
+        raise NotImplementedError
+
+    def hot(self, table: str, limit: int, days: Optional[int] = None) -> List[Dict]:
+        """The most used entries (text, embedding, usage_count, last_used) used within `days`."""
+        raise NotImplementedError
+
+    def evict(self, table: str, max_entries: int):
+        """Drop the least recently used entries beyond max_entries."""
+        raise NotImplementedError
+
+    def cleanup(self, days: int):
+        """Drop old, rarely used RAG and code entries and expired entries."""
+        raise NotImplementedError
+
+    def table_stats(self, table: str) -> Dict:
+        """count, avg_usage, avg_success_rate, avg_quality and recent (used in the last 24 hours)."""
+        raise NotImplementedError
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """The local SQLite database (cache/cache.db); one per node."""
+
+    name = "sqlite"
+
+    def __init__(self, db_path: str, ttls: Optional[Dict[str, int]] = None):
+        from .smart_cache import init_database
+
+        super().__init__(ttls)
+        self.db_path = db_path
+        init_database(db_path)
+
+    def _live(self, table: str) -> tuple:
+        ttl = self.ttls.get(table)
+        if not ttl:
+            return "1", ()
+        return "created_at > datetime('now', ?)", (f"-{int(ttl)} seconds",)
+
+    @staticmethod
+    def _decode(table: str, columns: List[str], row: tuple) -> Dict:
+        entry = dict(zip(columns, row))
+        embedding_column = CACHE_TABLES[table]["embedding"]
+        if entry.get(embedding_column) is not None:
+            entry[embedding_column] = pickle.loads(entry[embedding_column])
+        if entry.get("results") is not None:
+            entry["results"] = pickle.loads(entry["results"])
+        return entry
+
+    @staticmethod
+    def _encode(table: str, entry: Dict) -> Dict:
+        encoded = dict(entry)
+        embedding_column = CACHE_TABLES[table]["embedding"]
+        if embedding_column in encoded:
+            encoded[embedding_column] = pickle.dumps(encoded[embedding_column])
+        if "results" in encoded:
+            encoded["results"] = pickle.dumps(encoded["results"])
+        return encoded
+
+    def get_many(self, table: str, keys: List[str]) -> Dict[str, Dict]:
+        if not keys:
+            return {}
+        key_column = CACHE_TABLES[table]["key"]
+        live, live_args = self._live(table)
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT * FROM {table}
+            WHERE {key_column} IN ({", ".join("?" for _ in keys)}) AND {live}
+        ''', (*keys, *live_args))
+        columns = [column[0] for column in cursor.description]
+        rows = cursor.fetchall()
+        conn.close()
+        entries = [self._decode(table, columns, row) for row in rows]
+        return {entry[key_column]: entry for entry in entries}
+
+    def get_embeddings(self, table: str, keys: List[str]) -> Dict[str, np.ndarray]:
+        if not keys:
+            return {}
+        spec = CACHE_TABLES[table]
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {spec["key"]}, {spec["embedding"]} FROM {table}
+            WHERE {spec["key"]} IN ({", ".join("?" for _ in keys)})
+        ''', keys)
+        rows = cursor.fetchall()
+        conn.close()
+        return {key: pickle.loads(blob) for key, blob in rows}
+
+    def insert(self, table: str, key: str, entry: Dict) -> bool:
+        encoded = self._encode(table, {**entry, CACHE_TABLES[table]["key"]: key})
+        columns = list(encoded)
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO {table} ({", ".join(columns)})
+            VALUES ({", ".join("?" for _ in columns)})
+        ''', [encoded[column] for column in columns])
+        inserted = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        return inserted
+
+    def upsert(self, table: str, key: str, entry: Dict):
+        key_column = CACHE_TABLES[table]["key"]
+        encoded = self._encode(table, {**entry, key_column: key})
+        columns = list(encoded)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column != key_column)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(f'''
+            INSERT INTO {table} ({", ".join(columns)})
+            VALUES ({", ".join("?" for _ in columns)})
+            ON CONFLICT({key_column}) DO UPDATE SET
+                {updates},
+                created_at = CURRENT_TIMESTAMP,
+                last_used = CURRENT_TIMESTAMP
+        ''', [encoded[column] for column in columns])
+        conn.commit()
+        conn.close()
+
+    def update(self, table: str, key: str, fields: Dict):
+        encoded = self._encode(table, fields)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(f'''
+            UPDATE {table} SET {", ".join(f"{column} = ?" for column in encoded)}
+            WHERE {CACHE_TABLES[table]["key"]} = ?
+        ''', (*encoded.values(), key))
+        conn.commit()
+        conn.close()
+
+    def record_usage(self, table: str, counts: Dict[str, int]):
+        conn = sqlite3.connect(self.db_path)
+        conn.executemany(f'''
+            UPDATE {table}
+            SET usage_count = usage_count + ?, last_used = CURRENT_TIMESTAMP
+            WHERE {CACHE_TABLES[table]["key"]} = ?
+        ''', [(count, key) for key, count in counts.items()])
+        conn.commit()
+        conn.close()
+
+    def top_keys(self, table: str, limit: Optional[int], group: Optional[Union[str, Sequence]] = None,
+                 min_quality: Optional[float] = None) -> List[str]:
+        spec = CACHE_TABLES[table]
+        live, args = self._live(table)
+        conditions = [live]
+        if group is not None:
+            values = (group,) if isinstance(group, str) else tuple(group)
+            # IS also matches NULL (an unset temperature)
+            conditions.extend(f"{column} IS ?" for column in spec["group"])
+            args += values
+        if min_quality is not None:
+            conditions.append("quality_score > ?")
+            args += (min_quality,)
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {spec["key"]} FROM {table}
+            WHERE {" AND ".join(conditions)}
+            ORDER BY {spec["order"]}
+            LIMIT ?
+        ''', (*args, -1 if limit is None else limit))
+        keys = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return keys
+
+    def hot(self, table: str, limit: int, days: Optional[int] = None) -> List[Dict]:
+        spec = CACHE_TABLES[table]
+        window = f"-{int(days)} days" if days else "-100 years"
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {spec["text"]}, {spec["embedding"]}, usage_count, last_used FROM {table}
+            WHERE last_used > datetime('now', ?)
+            ORDER BY usage_count DESC, last_used DESC
+            LIMIT ?
+        ''', (window, limit))
+        rows = cursor.fetchall()
+        conn.close()
+        return [{"text": text, "embedding": pickle.loads(embedding), "usage_count": usage_count,
+                 "last_used": last_used or ""} for text, embedding, usage_count, last_used in rows]
+
+    def evict(self, table: str, max_entries: int):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(f'''
+            DELETE FROM {table} WHERE id IN (
+                SELECT id FROM {table}
+                ORDER BY last_used DESC, id DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (max_entries,))
+        conn.commit()
+        conn.close()
+
+    def cleanup(self, days: int):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        window = f"-{int(days)} days"
+
+        # Remove old RAG entries with low usage
+        cursor.execute('''
+            DELETE FROM rag_cache
+            WHERE last_used < datetime('now', ?) AND usage_count < 2
+        ''', (window,))
+
+        # Remove old code entries with low quality
+        cursor.execute('''
+            DELETE FROM code_cache
+            WHERE last_used < datetime('now', ?) AND quality_score < 0.3 AND usage_count < 2
+        ''', (window,))
+
+        # Remove entries past their TTL
+        for table, ttl in self.ttls.items():
+            if ttl:
+                cursor.execute(f"DELETE FROM {table} WHERE created_at < datetime('now', ?)",
+                               (f"-{int(ttl)} seconds",))
+
+        conn.commit()
+        conn.close()
+
+    def table_stats(self, table: str) -> Dict:
+        quality = "AVG(quality_score)" if table == "code_cache" else "NULL"
+        success = "AVG(success_rate)" if table == "rag_cache" else "NULL"
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT COUNT(*), AVG(usage_count), {success}, {quality},
+                   SUM(last_used > datetime('now', '-24 hours'))
+            FROM {table}
+        ''')
+        count, avg_usage, avg_success, avg_quality, recent = cursor.fetchone()
+        conn.close()
+        return {
+            "count": count or 0,
+            "avg_usage": avg_usage or 0,
+            "avg_success_rate": avg_success or 0,
+            "avg_quality": avg_quality or 0,
+            "recent": recent or 0,
+        }
+
+
+class KeyValueCacheBackend(CacheBackend):
+    """Entries in a shared key-value store (Redis or compatible), so every node sees one cache.
+
+    Each entry is a hash at {prefix}:{table}:{key}: embeddings as raw
+    float32 bytes, other fields as JSON, usage_count as an integer and
+    timestamps as epoch seconds. Sorted sets per table track the ranking
+    (:rank, plus :rank:{group} per diagram type or code context and
+    temperature, see group_name) and recency (:recent);
+    the :groups hash remembers each key's group, so its :rank:{group}
+    member can still be found once the entry itself has expired. TTLs are
+    key expiries; members of expired keys are dropped from the indexes
+    when they are next seen. Reads and writes that touch
+    several keys go through one pipeline.
+    """
+
+    name = "kv"
+
+    def __init__(self, client, prefix: str = "smartcache", ttls: Optional[Dict[str, int]] = None):
+        super().__init__(ttls)
+        self.client = client
+        self.prefix = prefix
+
+    # Keys and encoding
+
+    def _entry_key(self, table: str, key: str) -> str:
+        return f"{self.prefix}:{table}:{key}"
+
+    def _index_key(self, table: str, index: str, group: Optional[str] = None) -> str:
+        suffix = f":{group}" if group is not None else ""
+        return f"{self.prefix}:{table}:{index}{suffix}"
+
+    @staticmethod
+    def _group_of(table: str, entry: Dict) -> Optional[str]:
+        columns = CACHE_TABLES[table].get("group")
+        if not columns or any(column not in entry for column in columns):
+            return None
+        return group_name([entry[column] for column in columns])
+
+    @staticmethod
+    def _rank(table: str, entry: Dict) -> float:
+        # Code candidates rank by quality (to 3 decimals) before usage; usage is assumed < 1e6
+        usage = int(entry.get("usage_count") or 0)
+        if table == "code_cache":
+            return round(float(entry.get("quality_score") or 0.0) * 1000) * 1e6 + usage
+        return usage
+
+    @staticmethod
+    def _text(value) -> str:
+        return value.decode() if isinstance(value, bytes) else value
+
+    def _encode(self, table: str, entry: Dict) -> Dict:
+        embedding_column = CACHE_TABLES[table]["embedding"]
+        mapping = {}
+        for column, value in entry.items():
+            if column == embedding_column:
+                mapping[column] = np.asarray(value, dtype=np.float32).tobytes()
+            elif column == "usage_count":
+                mapping[column] = int(value)
+            else:
+                mapping[column] = json.dumps(value, default=_json_default)
+        return mapping
+
+    def _decode(self, table: str, raw: Dict) -> Dict:
+        embedding_column = CACHE_TABLES[table]["embedding"]
+        entry = {}
+        for column, value in raw.items():
+            column = self._text(column)
+            if column == embedding_column:
+                entry[column] = np.frombuffer(value, dtype=np.float32).copy()
+            elif column == "usage_count":
+                entry[column] = int(value)
+            else:
+                entry[column] = json.loads(value)
+        return entry
+
+    def _groups(self, table: str, keys: List[str]) -> Dict[str, str]:
+        """Group of each key, from :groups (or the entry, for keys written before it existed)."""
+        group_columns = CACHE_TABLES[table].get("group")
+        if not group_columns or not keys:
+            return {}
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hmget(self._index_key(table, "groups"), keys)
+        for key in keys:
+            pipe.hmget(self._entry_key(table, key), list(group_columns))
+        recorded, *current = pipe.execute()
+        groups = {}
+        for key, group, values in zip(keys, recorded, current):
+            if group is not None:
+                groups[key] = self._text(group)
+                continue
+            fallback = self._group_of(table, {column: json.loads(value) for column, value in zip(group_columns, values)
+                                              if value is not None})
+            if fallback is not None:
+                groups[key] = fallback
+        return groups
+
+    def _forget(self, table: str, keys: Iterable[str]):
+        """Drop index members (and entries) for keys that expired or were evicted."""
+        keys = list(keys)
+        if not keys:
+            return
+        groups = self._groups(table, keys)
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.delete(self._entry_key(table, key))
+            pipe.zrem(self._index_key(table, "rank"), key)
+            pipe.zrem(self._index_key(table, "recent"), key)
+            if key in groups:
+                pipe.zrem(self._index_key(table, "rank", groups[key]), key)
+        if groups:
+            pipe.hdel(self._index_key(table, "groups"), *groups)
+        pipe.execute()
+
+    # CacheBackend
+
+    def get_many(self, table: str, keys: List[str]) -> Dict[str, Dict]:
+        if not keys:
+            return {}
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(self._entry_key(table, key))
+        entries = {}
+        missing = []
+        for key, raw in zip(keys, pipe.execute()):
+            if raw:
+                entries[key] = self._decode(table, raw)
+            else:
+                missing.append(key)
+        self._forget(table, missing)
+        return entries
+
+    def get_embeddings(self, table: str, keys: List[str]) -> Dict[str, np.ndarray]:
+        if not keys:
+            return {}
+        embedding_column = CACHE_TABLES[table]["embedding"]
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hget(self._entry_key(table, key), embedding_column)
+        vectors = {}
+        missing = []
+        for key, value in zip(keys, pipe.execute()):
+            if value is None:
+                missing.append(key)
+            else:
+                vectors[key] = np.frombuffer(value, dtype=np.float32).copy()
+        self._forget(table, missing)
+        return vectors
+
+    def _write(self, table: str, key: str, entry: Dict, replace: bool) -> bool:
+        spec = CACHE_TABLES[table]
+        entry_key = self._entry_key(table, key)
+        # Claiming the key field first makes a concurrent insert from another node a no-op
+        created = bool(self.client.hsetnx(entry_key, spec["key"], json.dumps(key)))
+        if not created and not replace:
+            return False
+
+        # New or replaced: either way the TTL and created_at start over
+        now = time.time()
+        fields = dict(entry)
+        fields["last_used"] = now
+        fields["created_at"] = now
+        usage = int(fields.pop("usage_count", 1))
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hset(entry_key, mapping=self._encode(table, fields))
+        pipe.hsetnx(entry_key, "usage_count", usage)
+        ttl = self.ttls.get(table)
+        if ttl:
+            pipe.expire(entry_key, int(ttl))
+        pipe.hget(entry_key, "usage_count")
+        usage = int(pipe.execute()[-1])
+
+        rank = self._rank(table, {**entry, "usage_count": usage})
+        group = self._group_of(table, entry)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zadd(self._index_key(table, "rank"), {key: rank})
+        pipe.zadd(self._index_key(table, "recent"), {key: now})
+        if group is not None:
+            pipe.zadd(self._index_key(table, "rank", group), {key: rank})
+            pipe.hset(self._index_key(table, "groups"), key, group)
+        pipe.execute()
+        return created
+
+    def insert(self, table: str, key: str, entry: Dict) -> bool:
+        return self._write(table, key, entry, replace=False)
+
+    def upsert(self, table: str, key: str, entry: Dict):
+        self._write(table, key, entry, replace=True)
+
+    def update(self, table: str, key: str, fields: Dict):
+        entry_key = self._entry_key(table, key)
+        if not self.client.exists(entry_key):
+            return
+        self.client.hset(entry_key, mapping=self._encode(table, fields))
+        if table == "code_cache" and "quality_score" in fields:
+            current = self.get(table, key)
+            if current:
+                rank = self._rank(table, current)
+                self.client.zadd(self._index_key(table, "rank"), {key: rank})
+                group = self._group_of(table, current)
+                if group is not None:
+                    self.client.zadd(self._index_key(table, "rank", group), {key: rank})
+
+    def record_usage(self, table: str, counts: Dict[str, int]):
+        if not counts:
+            return
+        group_columns = list(CACHE_TABLES[table].get("group") or ())
+        keys = list(counts)
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(self._entry_key(table, key), [CACHE_TABLES[table]["key"], *group_columns])
+        found = pipe.execute()
+
+        now = time.time()
+        live = []
+        pipe = self.client.pipeline(transaction=False)
+        for key, (claimed, *values) in zip(keys, found):
+            if claimed is None:
+                continue
+            group = self._group_of(table, {column: json.loads(value) for column, value in zip(group_columns, values)
+                                           if value is not None})
+            live.append(key)
+            entry_key = self._entry_key(table, key)
+            pipe.hincrby(entry_key, "usage_count", counts[key])
+            pipe.hset(entry_key, "last_used", json.dumps(now))
+            pipe.zincrby(self._index_key(table, "rank"), counts[key], key)
+            pipe.zadd(self._index_key(table, "recent"), {key: now})
+            if group is not None:
+                pipe.zincrby(self._index_key(table, "rank", group), counts[key], key)
+        pipe.execute()
+        self._forget(table, [key for key in keys if key not in live])
+
+    def top_keys(self, table: str, limit: Optional[int], group: Optional[Union[str, Sequence]] = None,
+                 min_quality: Optional[float] = None) -> List[str]:
+        index = self._index_key(table, "rank", None if group is None else group_name(group))
+        if min_quality is not None:
+            floor = (math.floor(min_quality * 1000) + 1) * 1e6
+            if limit is None:
+                members = self.client.zrevrangebyscore(index, "+inf", floor)
+            else:
+                members = self.client.zrevrangebyscore(index, "+inf", floor, start=0, num=limit)
+        else:
+            members = self.client.zrevrange(index, 0, -1 if limit is None else limit - 1)
+        return [self._text(member) for member in members]
+
+    def hot(self, table: str, limit: int, days: Optional[int] = None) -> List[Dict]:
+        spec = CACHE_TABLES[table]
+        cutoff = time.time() - days * 86400 if days else 0
+        # The busiest few times over, then keep those used within the window
+        keys = [self._text(member) for member in self.client.zrevrange(self._index_key(table, "rank"), 0, limit * 4 - 1)]
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(self._entry_key(table, key), [spec["text"], spec["embedding"], "usage_count", "last_used"])
+        hot = []
+        for text, embedding, usage_count, last_used in pipe.execute():
+            if text is None or embedding is None:
+                continue
+            last_used = json.loads(last_used) if last_used is not None else 0
+            if last_used < cutoff:
+                continue
+            hot.append({"text": json.loads(text), "embedding": np.frombuffer(embedding, dtype=np.float32).copy(),
+                        "usage_count": int(usage_count or 0), "last_used": last_used})
+        hot.sort(key=lambda entry: (entry["usage_count"], entry["last_used"]), reverse=True)
+        return hot[:limit]
+
+    def evict(self, table: str, max_entries: int):
+        recent = self._index_key(table, "recent")
+        excess = self.client.zcard(recent) - max_entries
+        if excess <= 0:
+            return
+        keys = [self._text(member) for member in self.client.zrange(recent, 0, excess - 1)]
+        self._forget(table, keys)
+
+    def cleanup(self, days: int):
+        cutoff = time.time() - days * 86400
+        for table, rule in (("rag_cache", lambda usage, quality: usage < 2),
+                            ("code_cache", lambda usage, quality: quality < 0.3 and usage < 2),
+                            ("diagram_cache", lambda usage, quality: False)):
+            old = [self._text(member) for member in
+                   self.client.zrangebyscore(self._index_key(table, "recent"), "-inf", cutoff)]
+            pipe = self.client.pipeline(transaction=False)
+            for key in old:
+                pipe.hmget(self._entry_key(table, key), ["usage_count", "quality_score"])
+            stale = []
+            for key, (usage, quality) in zip(old, pipe.execute()):
+                # Expired (usage is None) or matching the cleanup rule
+                if usage is None or rule(int(usage), json.loads(quality) if quality else 0.0):
+                    stale.append(key)
+            self._forget(table, stale)
+
+    def table_stats(self, table: str) -> Dict:
+        keys = [self._text(member) for member in self.client.zrange(self._index_key(table, "recent"), 0, -1)]
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(self._entry_key(table, key), ["usage_count", "success_rate", "quality_score", "last_used"])
+        rows = [row for row in pipe.execute() if row[0] is not None]
+        day_ago = time.time() - 86400
+
+        def average(values):
+            values = [json.loads(value) for value in values if value is not None]
+            return sum(values) / len(values) if values else 0
+
+        return {
+            "count": len(rows),
+            "avg_usage": sum(int(row[0]) for row in rows) / max(len(rows), 1),
+            "avg_success_rate": average(row[1] for row in rows),
+            "avg_quality": average(row[2] for row in rows),
+            "recent": sum(1 for row in rows if row[3] is not None and json.loads(row[3]) > day_ago),
+        }
+
+
+def _json_default(value):
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
+
+
+class InMemoryKV:
+    """In-process stand-in for the subset of the redis-py client KeyValueCacheBackend uses.
+
+    Values come back as bytes and keys expire, as with Redis, so the
+    backend can be exercised without a server (CACHE_BACKEND=memory).
+    It is not shared between processes.
+    """
+
+    def __init__(self):
+        self._data: Dict[str, Any] = {}
+        self._expires: Dict[str, float] = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _bytes(value) -> bytes:
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode()
+
+    def _alive(self, name: str):
+        expires = self._expires.get(name)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(name, None)
+            self._expires.pop(name, None)
+        return self._data.get(name)
+
+    @staticmethod
+    def _bound(value, upper: bool) -> tuple:
+        if isinstance(value, (bytes, str)):
+            text = value.decode() if isinstance(value, bytes) else value
+            if text in ("+inf", "inf"):
+                return math.inf, False
+            if text == "-inf":
+                return -math.inf, False
+            if text.startswith("("):
+                return float(text[1:]), True
+            return float(text), False
+        return float(value), False
+
+    def _in_range(self, score: float, low, high) -> bool:
+        low, low_open = self._bound(low, False)
+        high, high_open = self._bound(high, True)
+        return (score > low if low_open else score >= low) and (score < high if high_open else score <= high)
+
+    # Keys
+
+    def exists(self, *names) -> int:
+        with self._lock:
+            return sum(1 for name in names if self._alive(name) is not None)
+
+    def delete(self, *names) -> int:
+        with self._lock:
+            removed = 0
+            for name in names:
+                if self._data.pop(name, None) is not None:
+                    removed += 1
+                self._expires.pop(name, None)
+            return removed
+
+    def expire(self, name: str, seconds: int) -> bool:
+        with self._lock:
+            if self._alive(name) is None:
+                return False
+            self._expires[name] = time.monotonic() + seconds
+            return True
+
+    def scan_iter(self, match: str = "*"):
+        with self._lock:
+            names = [name for name in list(self._data) if self._alive(name) is not None]
+        return iter([name.encode() for name in names if fnmatch.fnmatchcase(name, match)])
+
+    # Hashes
+
+    def hset(self, name: str, key=None, value=None, mapping: Optional[Dict] = None) -> int:
+        with self._lock:
+            fields = self._alive(name)
+            if fields is None:
+                fields = self._data[name] = {}
+            items = dict(mapping or {})
+            if key is not None:
+                items[key] = value
+            added = sum(1 for field in items if self._bytes(field) not in fields)
+            for field, field_value in items.items():
+                fields[self._bytes(field)] = self._bytes(field_value)
+            return added
+
+    def hsetnx(self, name: str, key, value) -> int:
+        with self._lock:
+            fields = self._alive(name)
+            if fields is not None and self._bytes(key) in fields:
+                return 0
+            return self.hset(name, key, value)
+
+    def hget(self, name: str, key):
+        with self._lock:
+            return (self._alive(name) or {}).get(self._bytes(key))
+
+    def hmget(self, name: str, keys: List) -> List:
+        with self._lock:
+            fields = self._alive(name) or {}
+            return [fields.get(self._bytes(key)) for key in keys]
+
+    def hgetall(self, name: str) -> Dict:
+        with self._lock:
+            return dict(self._alive(name) or {})
+
+    def hdel(self, name: str, *keys) -> int:
+        with self._lock:
+            fields = self._alive(name) or {}
+            return sum(1 for key in keys if fields.pop(self._bytes(key), None) is not None)
+
+    def hincrby(self, name: str, key, amount: int = 1) -> int:
+        with self._lock:
+            value = int(self.hget(name, key) or 0) + amount
+            self.hset(name, key, value)
+            return value
+
+    # Sorted sets
+
+    def _zset(self, name: str) -> Dict[bytes, float]:
+        zset = self._alive(name)
+        if zset is None:
+            zset = self._data[name] = {}
+        return zset
+
+    def _sorted(self, name: str, reverse: bool) -> List:
+        zset = self._alive(name) or {}
+        return sorted(zset, key=lambda member: (zset[member], member), reverse=reverse)
+
+    def zadd(self, name: str, mapping: Dict) -> int:
+        with self._lock:
+            zset = self._zset(name)
+            added = sum(1 for member in mapping if self._bytes(member) not in zset)
+            for member, score in mapping.items():
+                zset[self._bytes(member)] = float(score)
+            return added
+
+    def zincrby(self, name: str, amount: float, value) -> float:
+        with self._lock:
+            zset = self._zset(name)
+            member = self._bytes(value)
+            zset[member] = zset.get(member, 0.0) + amount
+            return zset[member]
+
+    def zrem(self, name: str, *values) -> int:
+        with self._lock:
+            zset = self._alive(name) or {}
+            return sum(1 for value in values if zset.pop(self._bytes(value), None) is not None)
+
+    def zcard(self, name: str) -> int:
+        with self._lock:
+            return len(self._alive(name) or {})
+
+    @staticmethod
+    def _slice(members: List, start: int, end: int) -> List:
+        return members[start:] if end == -1 else members[start:end + 1]
+
+    def zrange(self, name: str, start: int, end: int) -> List[bytes]:
+        with self._lock:
+            return self._slice(self._sorted(name, reverse=False), start, end)
+
+    def zrevrange(self, name: str, start: int, end: int) -> List[bytes]:
+        with self._lock:
+            return self._slice(self._sorted(name, reverse=True), start, end)
+
+    def zrangebyscore(self, name: str, min, max, start: Optional[int] = None, num: Optional[int] = None) -> List[bytes]:
+        with self._lock:
+            zset = self._alive(name) or {}
+            members = [member for member in self._sorted(name, reverse=False) if self._in_range(zset[member], min, max)]
+        return members[start or 0:(start or 0) + num] if num is not None else members
+
+    def zrevrangebyscore(self, name: str, max, min, start: Optional[int] = None, num: Optional[int] = None) -> List[bytes]:
+        with self._lock:
+            zset = self._alive(name) or {}
+            members = [member for member in self._sorted(name, reverse=True) if self._in_range(zset[member], min, max)]
+        return members[start or 0:(start or 0) + num] if num is not None else members
+
+    def pipeline(self, transaction: bool = False) -> "InMemoryPipeline":
+        return InMemoryPipeline(self)
+
+
+class InMemoryPipeline:
+    """Queues calls and runs them on execute(), like a redis-py pipeline."""
+
+    def __init__(self, client: InMemoryKV):
+        self._client = client
+        self._calls = []
+
+    def __getattr__(self, name: str):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._calls.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self) -> List:
+        calls, self._calls = self._calls, []
+        with self._client._lock:
+            return [method(*args, **kwargs) for method, args, kwargs in calls]
+
+
+def create_cache_backend(db_path: str, ttls: Optional[Dict[str, int]] = None) -> CacheBackend:
+    """Backend named by CACHE_BACKEND: sqlite (default), redis (CACHE_REDIS_URL) or memory."""
+    backend = os.getenv("CACHE_BACKEND", "sqlite").lower()
+    prefix = os.getenv("CACHE_KEY_PREFIX", "smartcache")
+    if backend == "redis":
+        import redis
+
+        client = redis.Redis.from_url(os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0"))
+        return KeyValueCacheBackend(client, prefix=prefix, ttls=ttls)
+    if backend == "memory":
+        return KeyValueCacheBackend(InMemoryKV(), prefix=prefix, ttls=ttls)
+    return SQLiteCacheBackend(db_path, ttls=ttls)
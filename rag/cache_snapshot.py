@@ -0,0 +1,208 @@
+import os
+import gzip
+import json
+import time
+import base64
+import pickle
+import sqlite3
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .embedding_service import EMBEDDING_MODEL
+from .smart_cache import init_database
+
+SNAPSHOT_FORMAT = "smartcache-snapshot"
+SNAPSHOT_VERSION = 1
+
+# Columns carried per table (the autoincrement id is local). Embeddings
+# travel as base64 float32, RAG results as JSON; nothing is unpickled
+# from a snapshot file.
+SNAPSHOT_TABLES = {
+    "rag_cache": {
+        "key": "query_hash",
+        "embedding": "query_embedding",
+        "columns": ["query_hash", "query_text", "query_embedding", "results", "usage_count",
+                    "success_rate", "avg_response_time", "created_at", "last_used"],
+    },
+    "code_cache": {
+        "key": "prompt_hash",
+        "embedding": "prompt_embedding",
+        "columns": ["prompt_hash", "prompt_text", "prompt_embedding", "context_hash", "generated_code",
+                    "temperature", "quality_score", "usage_count", "user_feedback", "created_at",
+                    "last_used", "source", "provenance"],
+    },
+    "diagram_cache": {
+        "key": "diagram_hash",
+        "embedding": "prompt_embedding",
+        "columns": ["diagram_hash", "prompt_text", "diagram_type", "prompt_embedding", "mermaid_code",
+                    "usage_count", "created_at", "last_used"],
+    },
+}
+
+
+class SnapshotError(ValueError):
+    """The snapshot is unreadable or was built for a different model or index."""
+
+
+def _encode_embedding(blob: bytes) -> str:
+    return base64.b64encode(np.asarray(pickle.loads(blob), dtype=np.float32).tobytes()).decode("ascii")
+
+
+def _decode_embedding(value: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(value), dtype=np.float32).copy()
+
+
+def _json_default(value):
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
+
+
+def export_snapshot(db_path: str, path: str, index_version: Optional[str], days: Optional[int] = None,
+                    min_usage: int = 1, limit: Optional[int] = None,
+                    tables: Optional[List[str]] = None) -> Dict:
+    """Write the cache entries used within `days` and at least `min_usage` times to a gzip JSONL snapshot.
+
+    The first line is a header with the format version, embedding model and
+    dimension and the RAG index version; each following line is one row.
+    `limit` keeps the busiest entries per table. Returns the header.
+    """
+    window = f"-{int(days)} days" if days else "-100 years"
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    rows = []
+    counts = {}
+    dim = None
+    for table in tables or list(SNAPSHOT_TABLES):
+        spec = SNAPSHOT_TABLES[table]
+        cursor.execute(f'''
+            SELECT {", ".join(spec["columns"])} FROM {table}
+            WHERE last_used > datetime('now', ?) AND usage_count >= ?
+            ORDER BY usage_count DESC, last_used DESC
+            LIMIT ?
+        ''', (window, min_usage, limit or -1))
+        table_rows = cursor.fetchall()
+        counts[table] = len(table_rows)
+        for values in table_rows:
+            row = dict(zip(spec["columns"], values))
+            row[spec["embedding"]] = _encode_embedding(row[spec["embedding"]])
+            if table == "rag_cache":
+                row["results"] = pickle.loads(row["results"])
+            if dim is None:
+                dim = len(base64.b64decode(row[spec["embedding"]])) // 4
+            rows.append({"table": table, **row})
+    conn.close()
+
+    header = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "embedding_model": EMBEDDING_MODEL,
+        "embedding_dim": dim,
+        "index_version": index_version,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "filters": {"days": days, "min_usage": min_usage, "limit": limit},
+        "counts": counts,
+    }
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        f.write(json.dumps(header) + "\n")
+        for row in rows:
+            f.write(json.dumps(row, default=_json_default) + "\n")
+    os.replace(tmp_path, path)
+    return header
+
+
+def read_snapshot_header(path: str) -> Dict:
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+    except (OSError, ValueError) as e:
+        raise SnapshotError(f"{path} is not a cache snapshot: {e}")
+    if header.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"{path} is not a cache snapshot")
+    return header
+
+
+def _local_embedding_dim(cursor) -> Optional[int]:
+    for table, spec in SNAPSHOT_TABLES.items():
+        cursor.execute(f'SELECT {spec["embedding"]} FROM {table} LIMIT 1')
+        row = cursor.fetchone()
+        if row:
+            return int(np.asarray(pickle.loads(row[0])).size)
+    return None
+
+
+def import_snapshot(db_path: str, path: str, index_version: Optional[str],
+                    skip_rag_on_mismatch: bool = False,
+                    diagram_max_entries: Optional[int] = None) -> Dict:
+    """Merge a snapshot into the cache database at db_path.
+
+    Rows whose hash is already present are left as they are, so local
+    entries and their usage stats win. A snapshot from another format
+    version or embedding model is rejected with SnapshotError, as is one
+    whose RAG index version differs from `index_version`; with
+    skip_rag_on_mismatch the RAG entries are dropped instead and the code
+    and diagram entries still imported. Returns per-table counts.
+    """
+    header = read_snapshot_header(path)
+    if header.get("version") != SNAPSHOT_VERSION:
+        raise SnapshotError(f"Snapshot format version {header.get('version')} is not supported "
+                            f"(expected {SNAPSHOT_VERSION})")
+    if header.get("embedding_model") != EMBEDDING_MODEL:
+        raise SnapshotError(f"Snapshot embeddings are from {header.get('embedding_model')}, "
+                            f"this cache uses {EMBEDDING_MODEL}")
+
+    skip_tables = set()
+    if header.get("index_version") != index_version and header.get("counts", {}).get("rag_cache"):
+        if not skip_rag_on_mismatch:
+            raise SnapshotError(f"Snapshot was taken against RAG index {header.get('index_version')}, "
+                                f"the local index is {index_version}")
+        skip_tables.add("rag_cache")
+
+    init_database(db_path)
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    local_dim = _local_embedding_dim(cursor)
+    if local_dim and header.get("embedding_dim") and local_dim != header["embedding_dim"]:
+        conn.close()
+        raise SnapshotError(f"Snapshot embeddings have {header['embedding_dim']} dimensions, "
+                            f"local entries have {local_dim}")
+
+    summary = {table: {"imported": 0, "existing": 0, "skipped": 0} for table in SNAPSHOT_TABLES}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        f.readline()
+        for line in f:
+            row = json.loads(line)
+            table = row.pop("table", None)
+            if table not in SNAPSHOT_TABLES:
+                continue
+            if table in skip_tables:
+                summary[table]["skipped"] += 1
+                continue
+
+            spec = SNAPSHOT_TABLES[table]
+            row[spec["embedding"]] = pickle.dumps(_decode_embedding(row[spec["embedding"]]))
+            if table == "rag_cache":
+                row["results"] = pickle.dumps(row["results"])
+            columns = [column for column in spec["columns"] if column in row]
+            cursor.execute(f'''
+                INSERT OR IGNORE INTO {table} ({", ".join(columns)})
+                VALUES ({", ".join("?" for _ in columns)})
+            ''', [row[column] for column in columns])
+            summary[table]["imported" if cursor.rowcount else "existing"] += 1
+
+    if diagram_max_entries:
+        cursor.execute('''
+            DELETE FROM diagram_cache WHERE id IN (
+                SELECT id FROM diagram_cache
+                ORDER BY last_used DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (diagram_max_entries,))
+
+    conn.commit()
+    conn.close()
+    return {"header": header, "tables": summary}
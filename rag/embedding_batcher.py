@@ -0,0 +1,160 @@
+import os
+import time
+import queue
+import bisect
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128]
+MILLISECOND_BUCKETS = [0.5, 1, 2, 5, 10, 25, 50, 100, 250]
+
+
+class Histogram:
+    """Cumulative bucket counts, Prometheus style (le = upper bound)."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def to_dict(self) -> Dict:
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "buckets": buckets,
+        }
+
+
+class EmbeddingBatcher:
+    """Coalesce concurrent encode calls into batched forward passes.
+
+    Callers block on a future while a single worker thread gathers queued
+    requests for up to window_ms (or until max_batch texts), runs one
+    encode over all of them and hands each caller its rows. A lone request
+    waits at most window_ms; under concurrency the model sees batches
+    instead of one string at a time. If a batched encode raises, each
+    request in it is encoded on its own, so only the caller whose input
+    fails gets the error. encode() matches SentenceTransformer.encode for
+    a string or a list of strings.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], Sequence], name: str = "embeddings",
+                 window_ms: Optional[float] = None, max_batch: Optional[int] = None):
+        self.encode_fn = encode_fn
+        self.name = name
+        self.window = (window_ms if window_ms is not None
+                       else float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "2"))) / 1000.0
+        self.max_batch = max_batch or int(os.getenv("EMBEDDING_MAX_BATCH", "32"))
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "texts": 0, "batches": 0, "errors": 0, "retried_separately": 0}
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait_ms = Histogram(MILLISECOND_BUCKETS)
+        self.window_ms = Histogram(MILLISECOND_BUCKETS)
+        self.encode_ms = Histogram(MILLISECOND_BUCKETS)
+
+        self._worker = threading.Thread(target=self._run, name=f"{name}-batcher", daemon=True)
+        self._worker.start()
+
+    def encode(self, sentences, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        future: Future = Future()
+        self._queue.put((texts, future, time.perf_counter()))
+        vectors = future.result()
+        return vectors[0] if single else vectors
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            gather_start = time.perf_counter()
+            count = len(batch[0][0])
+            deadline = gather_start + self.window
+            while count < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+                count += len(item[0])
+
+            dispatched = time.perf_counter()
+            texts = [text for item_texts, _, _ in batch for text in item_texts]
+            try:
+                vectors = np.asarray(self.encode_fn(texts), dtype=np.float32)
+            except Exception as e:
+                with self._lock:
+                    self.stats["errors"] += 1
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    self._encode_separately(batch)
+                continue
+            encoded = time.perf_counter()
+
+            with self._lock:
+                self.stats["requests"] += len(batch)
+                self.stats["texts"] += len(texts)
+                self.stats["batches"] += 1
+                self.batch_sizes.observe(len(texts))
+                self.window_ms.observe((dispatched - gather_start) * 1000)
+                self.encode_ms.observe((encoded - dispatched) * 1000)
+                for _, _, queued_at in batch:
+                    self.queue_wait_ms.observe((dispatched - queued_at) * 1000)
+
+            offset = 0
+            for item_texts, future, _ in batch:
+                future.set_result(vectors[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+
+    def _encode_separately(self, batch: List[tuple]):
+        """After a failed batch, encode each request alone so one bad input fails only its own caller."""
+        for item_texts, future, _ in batch:
+            try:
+                future.set_result(np.asarray(self.encode_fn(item_texts), dtype=np.float32))
+            except Exception as e:
+                future.set_exception(e)
+        with self._lock:
+            self.stats["requests"] += len(batch)
+            self.stats["retried_separately"] += len(batch)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "window_ms": self.window * 1000,
+                "max_batch": self.max_batch,
+                "avg_batch_size": self.stats["texts"] / max(self.stats["batches"], 1),
+                "batch_size": self.batch_sizes.to_dict(),
+                "queue_wait_ms": self.queue_wait_ms.to_dict(),
+                "gather_window_ms": self.window_ms.to_dict(),
+                "encode_ms": self.encode_ms.to_dict(),
+            }
+
+
+class BatchingEmbeddingFunction:
+    """Chroma embedding function whose calls go through an EmbeddingBatcher."""
+
+    def __init__(self, batcher: EmbeddingBatcher):
+        self.batcher = batcher
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        return self.batcher.encode(list(input)).tolist()
@@ -0,0 +1,360 @@
+import os
+import json
+import time
+import socket
+import struct
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Sentence model for prompt embeddings; anything that must share a vector
+# space with the cache (e.g. the Khan catalog) uses the same one
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+
+# Models the embedding server can host, by wire name
+SENTENCE_MODEL = "sentence-transformer"   # SmartCache, Khan catalog, diagram classifier
+CHROMA_MODEL = "chroma-default"           # Chroma's ONNX MiniLM, used for the threejs_docs collection
+
+DEFAULT_SOCKET_PATH = "/tmp/threejs-embeddings.sock"
+
+_HEADER = struct.Struct(">I")
+
+
+class EmbeddingServiceError(RuntimeError):
+    """The embedding server could not be reached or rejected the request."""
+
+
+_onnx_lock = threading.Lock()
+_onnx_embedder = None
+_onnx_failed = False
+
+
+def onnx_backend_enabled() -> bool:
+    return os.getenv("EMBEDDING_BACKEND", "torch") == "onnx-int8"
+
+
+def _load_onnx_embedder():
+    """The process-wide int8 ONNX embedder, or None if it is missing or fails its self-test."""
+    global _onnx_embedder, _onnx_failed
+    with _onnx_lock:
+        if _onnx_embedder is None and not _onnx_failed:
+            try:
+                from .onnx_embedder import OnnxEmbedder
+                embedder = OnnxEmbedder()
+                result = embedder.self_test()
+                print(f"🧪 ONNX int8 embedder self-test: min cosine {result['min_cosine']:.4f} "
+                      f"over {result['texts']} probes ({embedder.intra_op_threads} intra-op threads)")
+                if result["passed"]:
+                    _onnx_embedder = embedder
+                else:
+                    print(f"⚠️ ONNX int8 embedder below {result['threshold']} cosine, using PyTorch")
+                    _onnx_failed = True
+            except Exception as e:
+                print(f"⚠️ ONNX int8 embedder unavailable ({e}), using PyTorch")
+                _onnx_failed = True
+        return _onnx_embedder
+
+
+def load_sentence_encoder():
+    """Load the sentence model in this process (int8 ONNX when EMBEDDING_BACKEND=onnx-int8)."""
+    if onnx_backend_enabled():
+        embedder = _load_onnx_embedder()
+        if embedder is not None:
+            return embedder
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBEDDING_MODEL)
+
+
+def load_chroma_embedding_function():
+    """Chroma's ONNX MiniLM, or the shared int8 model when that backend is enabled."""
+    if onnx_backend_enabled():
+        embedder = _load_onnx_embedder()
+        if embedder is not None:
+            return embedder
+    from chromadb.utils import embedding_functions
+    return embedding_functions.DefaultEmbeddingFunction()
+
+
+def load_encoder(name: str) -> Callable[[List[str]], np.ndarray]:
+    """Load a model in this process and return a batch encode function."""
+    if name == SENTENCE_MODEL:
+        model = load_sentence_encoder()
+        return lambda texts: np.asarray(model.encode(texts), dtype=np.float32)
+    if name == CHROMA_MODEL:
+        function = load_chroma_embedding_function()
+        return lambda texts: np.asarray(function(texts), dtype=np.float32)
+    raise ValueError(f"Unknown embedding model: {name}")
+
+
+def _frame(payload: bytes) -> bytes:
+    return _HEADER.pack(len(payload)) + payload
+
+
+class EmbeddingServer:
+    """Owns the embedding models for every worker on the host.
+
+    Workers connect over a Unix socket. Each message is a 4-byte length
+    followed by a JSON header; vectors come back as raw float32 bytes after
+    the header. Requests for the same model that arrive within max_wait_ms
+    of each other (up to max_batch texts) share one forward pass; if that
+    pass fails, each request is encoded alone so only the one with the bad
+    input gets the error. Encoding runs on a single thread, so the model's
+    own thread pool is the only one competing for cores.
+    """
+
+    def __init__(self, socket_path: Optional[str] = None, models: Optional[List[str]] = None,
+                 max_batch: int = 64, max_wait_ms: float = 2.0):
+        self.socket_path = socket_path or os.getenv("EMBEDDING_SERVICE_SOCKET", DEFAULT_SOCKET_PATH)
+        self.model_names = models or [SENTENCE_MODEL, CHROMA_MODEL]
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.encoders: Dict[str, Callable[[List[str]], np.ndarray]] = {}
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+        self.stats = {"requests": 0, "texts": 0, "batches": 0, "max_batch_seen": 0, "encode_seconds": 0.0,
+                      "errors": 0, "retried_separately": 0}
+
+    def load_models(self):
+        for name in self.model_names:
+            start = time.time()
+            encoder = load_encoder(name)
+            # First call pays lazy initialisation (ONNX session, torch kernels)
+            dim = encoder(["warm up"]).shape[1]
+            self.encoders[name] = encoder
+            print(f"🧠 Loaded {name} ({dim} dims) in {time.time() - start:.1f}s")
+
+    async def serve(self):
+        if not self.encoders:
+            self.load_models()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        for name in self.encoders:
+            self._queues[name] = asyncio.Queue()
+            asyncio.create_task(self._batcher(name))
+
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        os.chmod(self.socket_path, 0o660)
+        print(f"✅ Embedding server listening on {self.socket_path}")
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    size = _HEADER.unpack(await reader.readexactly(_HEADER.size))[0]
+                    request = json.loads(await reader.readexactly(size))
+                except asyncio.IncompleteReadError:
+                    break
+
+                op = request.get("op", "encode")
+                try:
+                    if op == "encode":
+                        vectors = await self._encode(request["model"], request["texts"])
+                        header = {"shape": list(vectors.shape)}
+                        writer.write(_frame(json.dumps(header).encode()) + vectors.tobytes())
+                    elif op == "ping":
+                        writer.write(_frame(json.dumps({"ok": True, "models": list(self.encoders)}).encode()))
+                    elif op == "stats":
+                        writer.write(_frame(json.dumps(self.get_stats()).encode()))
+                    else:
+                        raise ValueError(f"Unknown op: {op}")
+                except Exception as e:
+                    writer.write(_frame(json.dumps({"error": str(e)}).encode()))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def _encode(self, model: str, texts: List[str]) -> np.ndarray:
+        if model not in self._queues:
+            raise ValueError(f"Model not loaded: {model}")
+        self.stats["requests"] += 1
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        future = asyncio.get_running_loop().create_future()
+        await self._queues[model].put((texts, future))
+        return await future
+
+    async def _batcher(self, model: str):
+        loop = asyncio.get_running_loop()
+        queue = self._queues[model]
+        encoder = self.encoders[model]
+        while True:
+            batch = [await queue.get()]
+            count = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+            while count < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                count += len(item[0])
+
+            texts = [text for item_texts, _ in batch for text in item_texts]
+            start = time.perf_counter()
+            try:
+                vectors = await loop.run_in_executor(self._executor, encoder, texts)
+            except Exception as e:
+                self.stats["errors"] += 1
+                if len(batch) == 1:
+                    if not batch[0][1].done():
+                        batch[0][1].set_exception(e)
+                else:
+                    await self._encode_separately(encoder, batch)
+                continue
+
+            self.stats["batches"] += 1
+            self.stats["texts"] += len(texts)
+            self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(texts))
+            self.stats["encode_seconds"] += time.perf_counter() - start
+
+            offset = 0
+            for item_texts, future in batch:
+                if not future.done():
+                    future.set_result(vectors[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+
+    async def _encode_separately(self, encoder: Callable[[List[str]], np.ndarray], batch: List[tuple]):
+        """After a failed batch, encode each request alone so one bad input fails only its own caller."""
+        loop = asyncio.get_running_loop()
+        self.stats["retried_separately"] += len(batch)
+        for item_texts, future in batch:
+            try:
+                vectors = await loop.run_in_executor(self._executor, encoder, item_texts)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            if not future.done():
+                future.set_result(vectors)
+
+    def get_stats(self) -> Dict:
+        batches = max(self.stats["batches"], 1)
+        return {
+            **self.stats,
+            "avg_batch_size": self.stats["texts"] / batches,
+            "avg_encode_ms": self.stats["encode_seconds"] / batches * 1000,
+            "models": list(self.encoders),
+        }
+
+
+class EmbeddingClient:
+    """Blocking client for EmbeddingServer; one persistent connection per thread."""
+
+    def __init__(self, socket_path: Optional[str] = None, timeout: Optional[float] = None):
+        self.socket_path = socket_path or os.getenv("EMBEDDING_SERVICE_SOCKET", DEFAULT_SOCKET_PATH)
+        self.timeout = timeout if timeout is not None else float(os.getenv("EMBEDDING_SERVICE_TIMEOUT", "10"))
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def _recv_exactly(self, sock: socket.socket, size: int) -> bytes:
+        chunks = []
+        while size:
+            chunk = sock.recv(min(size, 1 << 20))
+            if not chunk:
+                raise ConnectionError("Embedding server closed the connection")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def _call(self, request: Dict) -> Tuple[Dict, bytes]:
+        payload = _frame(json.dumps(request).encode())
+        # A worker may hold a connection from before a server restart; retry once on a fresh one
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                sock.sendall(payload)
+                size = _HEADER.unpack(self._recv_exactly(sock, _HEADER.size))[0]
+                header = json.loads(self._recv_exactly(sock, size))
+                body = b""
+                if "shape" in header:
+                    rows, dims = header["shape"]
+                    body = self._recv_exactly(sock, rows * dims * 4)
+                break
+            except OSError as e:
+                self._close()
+                if attempt:
+                    raise EmbeddingServiceError(f"Embedding server unavailable at {self.socket_path}: {e}") from e
+
+        if "error" in header:
+            raise EmbeddingServiceError(header["error"])
+        return header, body
+
+    def embed(self, model: str, texts: List[str]) -> np.ndarray:
+        header, body = self._call({"op": "encode", "model": model, "texts": texts})
+        # bytearray keeps the array writable, like the ones SentenceTransformer returns
+        return np.frombuffer(bytearray(body), dtype=np.float32).reshape(header["shape"])
+
+    def ping(self) -> Dict:
+        return self._call({"op": "ping"})[0]
+
+    def stats(self) -> Dict:
+        return self._call({"op": "stats"})[0]
+
+
+class RemoteEncoder:
+    """Stands in for SentenceTransformer: encode() accepts a string or a list."""
+
+    def __init__(self, client: EmbeddingClient, model: str = SENTENCE_MODEL):
+        self.client = client
+        self.model = model
+
+    def encode(self, sentences, **kwargs) -> np.ndarray:
+        if isinstance(sentences, str):
+            return self.client.embed(self.model, [sentences])[0]
+        return self.client.embed(self.model, list(sentences))
+
+
+class RemoteEmbeddingFunction:
+    """Chroma embedding function backed by the embedding server."""
+
+    def __init__(self, client: EmbeddingClient, model: str = CHROMA_MODEL):
+        self.client = client
+        self.model = model
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        return self.client.embed(self.model, list(input)).tolist()
+
+
+def embedding_service_socket() -> Optional[str]:
+    """Socket of the shared embedding server, or None to load models in-process."""
+    return os.getenv("EMBEDDING_SERVICE_SOCKET") or None
+
+
+def create_sentence_encoder():
+    """SentenceTransformer-compatible encoder: remote when EMBEDDING_SERVICE_SOCKET is set."""
+    socket_path = embedding_service_socket()
+    if socket_path:
+        print(f"🔌 Using embedding server at {socket_path}")
+        return RemoteEncoder(EmbeddingClient(socket_path))
+    return load_sentence_encoder()
+
+
+def create_chroma_embedding_function():
+    """Embedding function for the Chroma collection: remote when EMBEDDING_SERVICE_SOCKET is set."""
+    socket_path = embedding_service_socket()
+    if socket_path:
+        return RemoteEmbeddingFunction(EmbeddingClient(socket_path))
+    return load_chroma_embedding_function()
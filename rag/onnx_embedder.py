@@ -0,0 +1,132 @@
+import os
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+DEFAULT_MODEL_DIR = os.path.join("models", "all-MiniLM-L6-v2-int8")
+MODEL_FILE = "model_int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+# fp32 SentenceTransformer vectors for a few probe texts, written at export
+REFERENCE_FILE = "reference.npz"
+
+# all-MiniLM-L6-v2 was trained with 256-token inputs
+MAX_SEQ_LENGTH = 256
+
+
+class OnnxEmbedderError(RuntimeError):
+    """The int8 model is missing or disagrees with the fp32 reference."""
+
+
+def compare_embeddings(reference: np.ndarray, candidate: np.ndarray) -> Dict:
+    """Cosine agreement between two sets of vectors for the same texts.
+
+    neighbor_agreement is the share of texts whose nearest other text is
+    the same under both models, i.e. whether the ranking is preserved.
+    """
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True).clip(min=1e-12)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True).clip(min=1e-12)
+    cosines = np.sum(reference * candidate, axis=1)
+
+    agreement = 1.0
+    if len(reference) > 2:
+        ref_sim = reference @ reference.T
+        cand_sim = candidate @ candidate.T
+        np.fill_diagonal(ref_sim, -np.inf)
+        np.fill_diagonal(cand_sim, -np.inf)
+        agreement = float(np.mean(ref_sim.argmax(axis=1) == cand_sim.argmax(axis=1)))
+
+    return {
+        "texts": len(reference),
+        "mean_cosine": float(cosines.mean()),
+        "min_cosine": float(cosines.min()),
+        "p05_cosine": float(np.percentile(cosines, 5)),
+        "neighbor_agreement": agreement,
+    }
+
+
+def default_intra_op_threads() -> int:
+    """Split the host's cores between the uvicorn workers (WEB_CONCURRENCY)."""
+    workers = max(int(os.getenv("WEB_CONCURRENCY", "1")), 1)
+    return max((os.cpu_count() or 1) // workers, 1)
+
+
+class OnnxEmbedder:
+    """int8-quantized ONNX export of the sentence model, run with onnxruntime.
+
+    Produces the same vectors as SentenceTransformer(EMBEDDING_MODEL):
+    transformer output, mean pooling over the attention mask, then L2
+    normalisation. Thread counts are set explicitly so several workers on
+    one host do not each spin up a pool the size of the machine.
+    export_onnx_embedder.py writes the model directory.
+    """
+
+    def __init__(self, model_dir: Optional[str] = None, intra_op_threads: Optional[int] = None,
+                 inter_op_threads: Optional[int] = None, batch_size: int = 32):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_dir = model_dir or os.getenv("ONNX_EMBEDDING_MODEL_DIR", DEFAULT_MODEL_DIR)
+        model_path = os.path.join(self.model_dir, MODEL_FILE)
+        if not os.path.exists(model_path):
+            raise OnnxEmbedderError(f"{model_path} not found; run export_onnx_embedder.py first")
+
+        self.intra_op_threads = intra_op_threads or int(
+            os.getenv("ONNX_INTRA_OP_THREADS", str(default_intra_op_threads()))
+        )
+        self.inter_op_threads = inter_op_threads or int(os.getenv("ONNX_INTER_OP_THREADS", "1"))
+        self.batch_size = batch_size
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.intra_op_threads
+        options.inter_op_num_threads = self.inter_op_threads
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+        hidden = self.session.run(None, feeds)[0]
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / mask.sum(axis=1).clip(min=1e-9)
+        return pooled / np.linalg.norm(pooled, axis=1, keepdims=True).clip(min=1e-12)
+
+    def encode(self, sentences, batch_size: Optional[int] = None, **kwargs) -> np.ndarray:
+        """Same call shape as SentenceTransformer.encode: a string or a list of strings."""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        step = batch_size or self.batch_size
+        vectors = np.concatenate([
+            self._encode_batch(texts[i:i + step]) for i in range(0, len(texts), step)
+        ]).astype(np.float32)
+        return vectors[0] if single else vectors
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        """Chroma embedding function interface."""
+        return self.encode(list(input)).tolist()
+
+    def self_test(self, min_cosine: Optional[float] = None) -> Dict:
+        """Embed the export-time probe texts and check agreement with their fp32 vectors."""
+        min_cosine = min_cosine if min_cosine is not None else float(os.getenv("ONNX_MIN_COSINE", "0.98"))
+        reference = np.load(os.path.join(self.model_dir, REFERENCE_FILE))
+        start = time.perf_counter()
+        candidate = self.encode([str(text) for text in reference["texts"]])
+        result = compare_embeddings(reference["vectors"], candidate)
+        result["elapsed_ms"] = (time.perf_counter() - start) * 1000
+        result["threshold"] = min_cosine
+        result["passed"] = result["min_cosine"] >= min_cosine
+        return result
@@ -0,0 +1,92 @@
+import re
+from typing import List
+
+# Prepended to every /generate prompt by AnthropicClient; clients sometimes
+# send it (or a variant) themselves
+EDUCATIONAL_PREFIX = "Create an educational Three.js visualization for learning purposes. "
+
+# Bumped when the rules change, so old canonical keys are not mixed with new ones
+CANONICAL_VERSION = 1
+
+# Lead-ins that do not change what is being asked for
+BOILERPLATE_PATTERNS = [
+    re.compile(r"^user request:\s*", re.IGNORECASE),
+    re.compile(r"^create an educational (three\.?js |3d )?(visualization|visualisation|animation|scene)"
+               r"( for learning purposes)?[.:]?\s*((of|about|showing|on)\s+)?", re.IGNORECASE),
+    re.compile(r"\bfor (learning|educational|teaching) purposes\b", re.IGNORECASE),
+    re.compile(r"^(hi|hello|hey)\b[,!.]?\s*", re.IGNORECASE),
+    re.compile(r"^(please\s+)?(can|could|would|will) you\s+(please\s+)?", re.IGNORECASE),
+    re.compile(r"^(i want|i would like|i'd like|i need)( you)?( to)?\s+", re.IGNORECASE),
+]
+
+# Spellings of the same Three.js / 3D term; applied to the lowercased text
+# before tokenizing (multi-word forms) and per token
+PHRASE_SYNONYMS = [
+    (re.compile(r"\bthree[\s\-]?\.?js\b"), "threejs"),
+    (re.compile(r"\b([23])[\s\-]d\b"), r"\1d"),
+    (re.compile(r"\borbit[\s\-]?controls\b"), "orbitcontrols"),
+    (re.compile(r"\bparticle[\s\-]system\b"), "particle system"),
+]
+TOKEN_SYNONYMS = {
+    "colour": "color",
+    "colours": "colors",
+    "coloured": "colored",
+    "grey": "gray",
+    "visualisation": "visualization",
+    "visualise": "visualize",
+    "spinning": "rotating",
+    "revolving": "rotating",
+    "spin": "rotate",
+    "spins": "rotates",
+    "ball": "sphere",
+    "balls": "spheres",
+    "lights": "lighting",
+    "animate": "animated",
+    "animating": "animated",
+    "3-dimensional": "3d",
+    "three-dimensional": "3d",
+}
+
+# Command verbs at the start of a request ("create a ...", "show me ...")
+LEADING_VERBS = {
+    "create", "make", "generate", "build", "render", "draw", "show", "display", "visualize",
+    "design", "produce", "give", "illustrate", "demonstrate",
+}
+STOPWORDS = {"a", "an", "the", "please", "me", "us", "some", "just", "kindly", "really", "very"}
+
+# Sentence punctuation is dropped; math and code symbols are kept as tokens so
+# "x^2 + 1" and "x^3 - 1" stay apart
+_PUNCTUATION = re.compile(r"[,;:!?\"`“”]|(?<!\d)\.|\.(?!\d)")
+_SYMBOLS = re.compile(r"([()\[\]{}+*/^=<>%|])")
+
+
+def tokenize(text: str) -> List[str]:
+    text = text.lower().replace("’", "'").replace("‘", "'")
+    for pattern, replacement in PHRASE_SYNONYMS:
+        text = pattern.sub(replacement, text)
+    text = text.replace("'s ", "s ").replace("'", "")
+    text = _PUNCTUATION.sub(" ", text)
+    text = _SYMBOLS.sub(r" \1 ", text)
+    return text.split()
+
+
+def canonicalize_query(text: str) -> str:
+    """Canonical form of a prompt or query for exact cache lookups.
+
+    Strips request boilerplate (including EDUCATIONAL_PREFIX), sentence
+    punctuation, articles and politeness words and a leading command verb,
+    folds spelling variants of common Three.js terms and collapses
+    whitespace. Word order, numbers and math symbols are kept, so prompts
+    that ask for different things keep different forms.
+    """
+    stripped = text.strip()
+    for pattern in BOILERPLATE_PATTERNS:
+        stripped = pattern.sub("", stripped).strip()
+
+    tokens = [TOKEN_SYNONYMS.get(token, token) for token in tokenize(stripped)]
+    tokens = [token for token in tokens if token not in STOPWORDS]
+    while len(tokens) > 1 and tokens[0] in LEADING_VERBS:
+        tokens = tokens[1:]
+
+    # A prompt that was nothing but boilerplate keeps its plain form
+    return " ".join(tokens) or " ".join(text.lower().split())
@@ -1,23 +1,62 @@
 import os
 import time
-from typing import List, Dict, Optional
-import chromadb
-from chromadb.utils import embedding_functions
+from typing import List, Dict, Optional, TYPE_CHECKING
 import hashlib
 from .smart_cache import SmartCache
+from .embedding_service import EMBEDDING_MODEL, create_chroma_embedding_function
+from .embedding_batcher import EmbeddingBatcher, BatchingEmbeddingFunction
+
+if TYPE_CHECKING:
+    from app.pipeline_metrics import PipelineRecord
 
 # Disable ChromaDB telemetry to avoid errors
 os.environ["ANONYMIZED_TELEMETRY"] = "False"
 
+COLLECTION_NAME = "threejs_docs"
+
+def compute_index_version(ids: List[str], documents: List[str]) -> str:
+    """Fingerprint of the indexed documents; cached RAG results are only valid for the same one."""
+    digest = hashlib.sha1(EMBEDDING_MODEL.encode())
+    for doc_id, document in sorted(zip(ids, documents)):
+        digest.update(doc_id.encode())
+        digest.update(hashlib.sha1(document.encode()).digest())
+    return digest.hexdigest()[:16]
+
+def collection_index_version(collection) -> Optional[str]:
+    """Index version stored when the collection was indexed, computed from its contents for older indexes."""
+    if not collection.count():
+        return None
+    version = (collection.metadata or {}).get("index_version")
+    if version:
+        return version
+    existing = collection.get(include=["documents"])
+    return compute_index_version(existing["ids"], existing["documents"])
+
+def read_index_version(chroma_path: str = "./chroma_db") -> Optional[str]:
+    """Index version of the Chroma collection on disk, without loading any embedding model."""
+    import chromadb
+    
+    client = chromadb.PersistentClient(path=chroma_path)
+    try:
+        collection = client.get_collection(name=COLLECTION_NAME)
+    except Exception:
+        return None
+    return collection_index_version(collection)
+
 class RAGEngine:
     def __init__(self, dataset_path: str):
+        # Imported here so importing this module stays cheap
+        import chromadb
+        
         self.dataset_path = os.path.abspath(dataset_path)
         self.client = chromadb.PersistentClient(path="./chroma_db")
         
-        self.embedding_function = embedding_functions.DefaultEmbeddingFunction()
+        # Query embeddings from concurrent searches share forward passes
+        self.embedding_batcher = EmbeddingBatcher(create_chroma_embedding_function(), name="chroma")
+        self.embedding_function = BatchingEmbeddingFunction(self.embedding_batcher)
         
         self.collection = self.client.get_or_create_collection(
-            name="threejs_docs",
+            name=COLLECTION_NAME,
             embedding_function=self.embedding_function
         )
         
@@ -30,6 +69,13 @@ class RAGEngine:
             "cache_hits": 0,
             "avg_search_time": 0.0
         }
+        self._index_version: Optional[str] = None
+    
+    def index_version(self) -> Optional[str]:
+        """Version of the indexed documents (None while the collection is empty)."""
+        if self._index_version is None:
+            self._index_version = collection_index_version(self.collection)
+        return self._index_version
     
     def index_documents(self):
         print(f"Indexing from path: {self.dataset_path}")
@@ -119,17 +165,34 @@ class RAGEngine:
                 metadatas=metadatas,
                 ids=ids
             )
+            # Snapshots of the cache record this, so RAG results from another index are not imported
+            self._index_version = compute_index_version(ids, documents)
+            self.collection.modify(metadata={"index_version": self._index_version})
             print(f"Indexed {len(documents)} documents")
         else:
             print("No documents found to index")
     
-    def search(self, query: str, k: int = 3) -> List[Dict]:
+    def _covers(self, docs: List[Dict], k: int) -> bool:
+        """Whether cached results can answer a top-k search: k of them, or the whole index."""
+        return len(docs) >= k or len(docs) >= self.collection.count()
+    
+    def search(self, query: str, k: int = 3, record: Optional["PipelineRecord"] = None,
+               cache_results: bool = True) -> List[Dict]:
+        """Top-k documents for the query, from the cache when it holds at least k.
+        
+        cache_results=False still reads the cache but does not store a miss,
+        for narrow lookups (such as /refine's single example) whose short
+        result lists should not answer later, wider searches.
+        """
         start_time = time.time()
         self.metrics["total_searches"] += 1
         
         # Try to get from cache first
+        lookup_start = time.perf_counter()
         cached_result = self.cache.get_rag_result(query)
-        if cached_result:
+        if record is not None:
+            record.add_stage("cache_lookup", time.perf_counter() - lookup_start)
+        if cached_result and self._covers(cached_result[0], k):
             results, cache_metadata = cached_result
             self.metrics["cache_hits"] += 1
             
@@ -160,7 +223,8 @@ class RAGEngine:
         
         # Cache the results for future use
         search_time = time.time() - start_time
-        self.cache.cache_rag_result(query, documents, search_time)
+        if cache_results:
+            self.cache.cache_rag_result(query, documents, search_time)
         
         # Update metrics
         self.metrics["avg_search_time"] = (
@@ -171,6 +235,65 @@ class RAGEngine:
         print(f"⏱️  Search completed in {search_time:.3f}s")
         return documents
     
+    def search_many(self, queries: List[str], k: int = 3, record_usage: bool = True) -> List[List[Dict]]:
+        """Search for several queries at once.
+        
+        Cache hits are served individually; all misses go to ChromaDB in a
+        single query so their embeddings are computed in one batch.
+        record_usage=False (warm-up) leaves hit counters and usage counts alone.
+        """
+        results: List[Optional[List[Dict]]] = [None] * len(queries)
+        misses = []
+        
+        # Embed the queries without an exact hit in one batch up front; the
+        # semantic lookups below reuse them
+        exact = self.cache.has_rag_results(queries)
+        self.cache._get_embeddings([query for query, hit in zip(queries, exact) if not hit])
+        
+        for i, query in enumerate(queries):
+            if record_usage:
+                self.metrics["total_searches"] += 1
+            cached_result = self.cache.get_rag_result(query, record_usage=record_usage)
+            if cached_result and self._covers(cached_result[0], k):
+                docs, cache_metadata = cached_result
+                if record_usage:
+                    self.metrics["cache_hits"] += 1
+                for doc in docs:
+                    doc["cache_metadata"] = cache_metadata
+                results[i] = docs[:k]
+            else:
+                misses.append(i)
+        
+        if misses:
+            start_time = time.time()
+            miss_queries = [queries[i] for i in misses]
+            print(f"🔍 Batch searching ChromaDB for {len(miss_queries)} queries...")
+            batch = self.collection.query(
+                query_texts=miss_queries,
+                n_results=k
+            )
+            
+            query_embeddings = self.cache._get_embeddings(miss_queries)
+            search_time = (time.time() - start_time) / len(misses)
+            
+            for j, i in enumerate(misses):
+                documents = []
+                if batch['documents'] and batch['documents'][j]:
+                    for n in range(len(batch['documents'][j])):
+                        documents.append({
+                            "content": batch['documents'][j][n],
+                            "metadata": batch['metadatas'][j][n] if batch['metadatas'] else {},
+                            "distance": batch['distances'][j][n] if batch['distances'] else 0,
+                            "cache_metadata": {"cache_hit": "miss"}
+                        })
+                self.cache.cache_rag_result(queries[i], documents, search_time,
+                                            query_embedding=query_embeddings[j])
+                results[i] = documents
+            
+            print(f"⏱️  Batch search completed in {time.time() - start_time:.3f}s")
+        
+        return results
+    
     def get_performance_stats(self) -> Dict:
         """Get performance and cache statistics."""
         cache_stats = self.cache.get_cache_stats()
@@ -186,23 +309,19 @@ class RAGEngine:
             }
         }
     
-    def warm_cache(self):
-        """Warm up the cache with common ThreeJS queries."""
-        common_queries = [
-            "create rotating cube with lighting",
-            "sphere geometry with texture mapping", 
-            "particle system with animation",
-            "camera controls and orbit",
-            "vector field visualization",
-            "3D mathematical function plotting",
-            "physics simulation bouncing balls",
-            "wireframe geometry examples",
-            "material properties and shaders",
-            "scene lighting setup directional ambient"
-        ]
-        
-        print("🔥 Warming up RAG cache...")
-        for query in common_queries:
-            self.search(query, k=3)
-        
-        self.cache.warm_cache(common_queries)
\ No newline at end of file
+    def get_embedding_stats(self) -> Dict:
+        """Micro-batching histograms for the cache and Chroma query embedders."""
+        return {
+            "sentence": self.cache.embedder.get_stats(),
+            "chroma": self.embedding_batcher.get_stats(),
+        }
+    
+    def warm_cache(self, queries: List[str], k: int = 3, batch_size: int = 32) -> int:
+        """Run queries through the cache in batches without counting them as traffic.
+        
+        Queries that are not cached yet are searched in ChromaDB and stored.
+        Returns the number of queries warmed.
+        """
+        for start in range(0, len(queries), batch_size):
+            self.search_many(queries[start:start + batch_size], k=k, record_usage=False)
+        return len(queries)
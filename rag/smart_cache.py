@@ -2,28 +2,165 @@ import os
 import json
 import time
 import hashlib
-from typing import Dict, List, Optional, Tuple, Any
-from sentence_transformers import SentenceTransformer
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Any, Union
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 import sqlite3
-from datetime import datetime, timedelta
 import pickle
+from .embedding_service import EMBEDDING_MODEL, create_sentence_encoder
+from .embedding_batcher import EmbeddingBatcher
+from .tiered_cache import L1Cache, UsageWriteBack
+from .cache_backend import create_cache_backend
+from .query_canonicalizer import canonicalize_query, CANONICAL_VERSION
+
+# Semantic match thresholds for cached diagrams. Data-driven diagram types
+# carry numbers and dates from the prompt, so a near match is only safe
+# when the prompts are almost identical.
+DIAGRAM_SIMILARITY_THRESHOLDS = {
+    "default": 0.92,
+    "pie": 0.97,
+    "xychart-beta": 0.97,
+    "gantt": 0.97,
+    "sankey-beta": 0.97,
+    "timeline": 0.96,
+    "quadrantChart": 0.96,
+    "radar-beta": 0.96,
+    "packet-beta": 0.96,
+}
+
+def cosine_similarity(a, b) -> np.ndarray:
+    """Pairwise cosine similarity between the rows of a and b (sklearn's semantics, numpy only)."""
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    a = a / np.linalg.norm(a, axis=1, keepdims=True).clip(min=1e-12)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True).clip(min=1e-12)
+    return a @ b.T
+
+def init_database(db_path: str):
+    """Create (or migrate) the cache tables in the SQLite database at db_path."""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    # Create tables for different cache types
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rag_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            query_hash TEXT UNIQUE,
+            query_text TEXT,
+            query_embedding BLOB,
+            results BLOB,
+            usage_count INTEGER DEFAULT 1,
+            success_rate REAL DEFAULT 1.0,
+            avg_response_time REAL DEFAULT 0.0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_used TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS code_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            prompt_hash TEXT UNIQUE,
+            prompt_text TEXT,
+            prompt_embedding BLOB,
+            context_hash TEXT,
+            generated_code TEXT,
+            temperature REAL,
+            quality_score REAL DEFAULT 0.0,
+            usage_count INTEGER DEFAULT 1,
+            user_feedback REAL DEFAULT 0.0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_used TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS learning_patterns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pattern_type TEXT,
+            pattern_data BLOB,
+            effectiveness REAL DEFAULT 0.0,
+            usage_count INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS diagram_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            diagram_hash TEXT UNIQUE,
+            prompt_text TEXT,
+            diagram_type TEXT,
+            prompt_embedding BLOB,
+            mermaid_code TEXT,
+            usage_count INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_used TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Provenance columns were added after the first release; migrate old databases
+    cursor.execute('PRAGMA table_info(code_cache)')
+    code_columns = {row[1] for row in cursor.fetchall()}
+    if 'source' not in code_columns:
+        cursor.execute("ALTER TABLE code_cache ADD COLUMN source TEXT DEFAULT 'live'")
+    if 'provenance' not in code_columns:
+        cursor.execute('ALTER TABLE code_cache ADD COLUMN provenance TEXT')
+    
+    # Create indexes for faster lookups
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_query_hash ON rag_cache(query_hash)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_prompt_hash ON code_cache(prompt_hash)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_last_used ON rag_cache(last_used)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_quality_score ON code_cache(quality_score)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_code_group ON code_cache(context_hash, temperature)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_diagram_hash ON diagram_cache(diagram_hash)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_diagram_type ON diagram_cache(diagram_type, last_used)')
+    
+    conn.commit()
+    conn.close()
 
 class SmartCache:
-    def __init__(self, cache_dir: str = "cache", similarity_threshold: float = 0.85):
+    def __init__(self, cache_dir: str = "cache", similarity_threshold: float = 0.85,
+                 diagram_ttl: Optional[int] = None, diagram_max_entries: Optional[int] = None):
         self.cache_dir = cache_dir
         self.similarity_threshold = similarity_threshold
         self.db_path = os.path.join(cache_dir, "cache.db")
         
+        # Diagram cache bounds: entries expire after diagram_ttl seconds and
+        # the least recently used ones are evicted beyond diagram_max_entries
+        self.diagram_ttl = diagram_ttl or int(os.getenv("DIAGRAM_CACHE_TTL", str(7 * 24 * 3600)))
+        self.diagram_max_entries = diagram_max_entries or int(os.getenv("DIAGRAM_CACHE_MAX_ENTRIES", "5000"))
+        
         # Create cache directory if it doesn't exist
         os.makedirs(cache_dir, exist_ok=True)
         
-        # Initialize sentence transformer for semantic similarity
-        self.embedder = SentenceTransformer('all-MiniLM-L6-v2')
-        
-        # Initialize SQLite database
-        self._init_database()
+        # Initialize sentence transformer for semantic similarity (or the
+        # shared embedding server when EMBEDDING_SERVICE_SOCKET is set).
+        # Concurrent lookups are micro-batched into one forward pass.
+        self.embedder = EmbeddingBatcher(create_sentence_encoder().encode, name="sentence")
+        
+        # Every lookup embeds its text first; remember recent embeddings so
+        # repeat (and warmed-up) texts skip the model
+        self.embedding_memo_size = int(os.getenv("EMBEDDING_MEMO_SIZE", "4096"))
+        self._embedding_memo: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._memo_lock = threading.Lock()
+        
+        # Entry storage: the local SQLite database by default, or a store
+        # shared by all replicas (CACHE_BACKEND, see cache_backend.py).
+        # CACHE_ENTRY_TTL optionally expires RAG and code entries as well.
+        entry_ttl = int(os.getenv("CACHE_ENTRY_TTL", "0")) or None
+        self.backend = create_cache_backend(self.db_path, ttls={
+            "rag_cache": entry_ttl,
+            "code_cache": entry_ttl,
+            "diagram_cache": self.diagram_ttl,
+        })
+        
+        # Candidate embeddings never change for a given key; keep them
+        # locally so semantic matching only fetches the ranking from the backend
+        self.vector_cache_size = int(os.getenv("CACHE_VECTOR_CACHE_SIZE", "20000"))
+        self._vector_cache: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._vector_lock = threading.Lock()
         
         # Cache statistics
         self.stats = {
@@ -36,64 +173,13 @@ class SmartCache:
         
         # Load existing stats
         self._load_stats()
-    
-    def _init_database(self):
-        """Initialize SQLite database for caching."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create tables for different cache types
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS rag_cache (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                query_hash TEXT UNIQUE,
-                query_text TEXT,
-                query_embedding BLOB,
-                results BLOB,
-                usage_count INTEGER DEFAULT 1,
-                success_rate REAL DEFAULT 1.0,
-                avg_response_time REAL DEFAULT 0.0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_used TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS code_cache (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                prompt_hash TEXT UNIQUE,
-                prompt_text TEXT,
-                prompt_embedding BLOB,
-                context_hash TEXT,
-                generated_code TEXT,
-                temperature REAL,
-                quality_score REAL DEFAULT 0.0,
-                usage_count INTEGER DEFAULT 1,
-                user_feedback REAL DEFAULT 0.0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_used TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS learning_patterns (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                pattern_type TEXT,
-                pattern_data BLOB,
-                effectiveness REAL DEFAULT 0.0,
-                usage_count INTEGER DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create indexes for faster lookups
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_query_hash ON rag_cache(query_hash)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_prompt_hash ON code_cache(prompt_hash)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_last_used ON rag_cache(last_used)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_quality_score ON code_cache(quality_score)')
+        for key in ("l1_hits", "l2_lookups", "l2_hits"):
+            self.stats.setdefault(key, 0)
         
-        conn.commit()
-        conn.close()
+        # RAG lookups check an in-process LRU (L1) before the backend (L2).
+        # Usage counts and the stats file are written back in the background.
+        self.rag_l1 = L1Cache()
+        self.usage_writer = UsageWriteBack(self.backend, on_flush=self._save_stats)
     
     def _load_stats(self):
         """Load cache statistics from file."""
@@ -111,380 +197,481 @@ class SmartCache:
         with open(stats_file, 'w') as f:
             json.dump(self.stats, f, indent=2)
     
-    def _hash_query(self, query: str) -> str:
-        """Create hash for query string."""
+    def _hash_query(self, query: str, canonical: bool = True) -> str:
+        """Create hash for the canonical form of a query (canonical=False: lowercased and stripped only)."""
+        if canonical:
+            return hashlib.md5(f"c{CANONICAL_VERSION}|{canonicalize_query(query)}".encode()).hexdigest()
         return hashlib.md5(query.lower().strip().encode()).hexdigest()
     
-    def _hash_prompt(self, prompt: str, context: str = "", temperature: float = 0.7) -> str:
+    def _hash_prompt(self, prompt: str, context: str = "", temperature: float = 0.7,
+                     canonical: bool = True) -> str:
         """Create hash for prompt + context + temperature."""
-        combined = f"{prompt.lower().strip()}|{context}|{temperature}"
+        if canonical:
+            combined = f"c{CANONICAL_VERSION}|{canonicalize_query(prompt)}|{context}|{temperature}"
+        else:
+            combined = f"{prompt.lower().strip()}|{context}|{temperature}"
         return hashlib.md5(combined.encode()).hexdigest()
     
+    def _get_exact(self, table: str, canonical_key: str, legacy_key: str) -> Tuple[Optional[Dict], str]:
+        """Exact-tier lookup: the canonical key, then the key entries written before canonicalization used.
+        
+        One backend round trip; returns (entry or None, the key it is stored under).
+        """
+        keys = [canonical_key] if legacy_key == canonical_key else [canonical_key, legacy_key]
+        entries = self.backend.get_many(table, keys)
+        for key in keys:
+            if key in entries:
+                return entries[key], key
+        return None, canonical_key
+    
+    def _hash_diagram(self, prompt: str, diagram_type: str) -> str:
+        """Create hash for a normalized diagram prompt and its resolved type."""
+        normalized = " ".join(prompt.lower().split()).strip(" .!?")
+        return hashlib.md5(f"{diagram_type}|{normalized}".encode()).hexdigest()
+    
+    def _memo_get(self, text: str) -> Optional[np.ndarray]:
+        with self._memo_lock:
+            embedding = self._embedding_memo.get(text)
+            if embedding is not None:
+                self._embedding_memo.move_to_end(text)
+            return embedding
+    
+    def remember_embeddings(self, pairs: List[Tuple[str, np.ndarray]]):
+        """Store already computed embeddings (e.g. from cache rows) in the memo."""
+        with self._memo_lock:
+            for text, embedding in pairs:
+                self._embedding_memo[text] = embedding
+                self._embedding_memo.move_to_end(text)
+            while len(self._embedding_memo) > self.embedding_memo_size:
+                self._embedding_memo.popitem(last=False)
+    
     def _get_embedding(self, text: str) -> np.ndarray:
         """Get sentence embedding for semantic similarity."""
-        return self.embedder.encode(text)
-    
-    def _find_similar_rag_queries(self, query: str, query_embedding: np.ndarray, limit: int = 5) -> List[Tuple]:
-        """Find similar RAG queries using semantic similarity."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT query_hash, query_text, query_embedding, results, usage_count, success_rate
-            FROM rag_cache 
-            ORDER BY usage_count DESC, success_rate DESC
-            LIMIT 50
-        ''')
-        
-        candidates = []
-        for row in cursor.fetchall():
-            cached_embedding = pickle.loads(row[2])
-            similarity = cosine_similarity([query_embedding], [cached_embedding])[0][0]
-            
-            if similarity >= self.similarity_threshold:
-                candidates.append((similarity, row))
-        
-        conn.close()
-        
-        # Sort by similarity score descending
-        candidates.sort(key=lambda x: x[0], reverse=True)
-        return candidates[:limit]
+        embedding = self._memo_get(text)
+        if embedding is None:
+            embedding = self.embedder.encode(text)
+            self.remember_embeddings([(text, embedding)])
+        return embedding
     
-    def _find_similar_code_prompts(self, prompt: str, prompt_embedding: np.ndarray, limit: int = 3) -> List[Tuple]:
-        """Find similar code generation prompts using semantic similarity."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT prompt_hash, prompt_text, prompt_embedding, generated_code, 
-                   quality_score, usage_count, user_feedback
-            FROM code_cache 
-            WHERE quality_score > 0.5
-            ORDER BY quality_score DESC, usage_count DESC
-            LIMIT 30
-        ''')
-        
-        candidates = []
-        for row in cursor.fetchall():
-            cached_embedding = pickle.loads(row[2])
-            similarity = cosine_similarity([prompt_embedding], [cached_embedding])[0][0]
-            
-            if similarity >= self.similarity_threshold:
-                candidates.append((similarity, row))
-        
-        conn.close()
-        
+    def _get_embeddings(self, texts: List[str]) -> List[np.ndarray]:
+        """Get sentence embeddings for several texts in one batched forward pass."""
+        if not texts:
+            return []
+        embeddings = [self._memo_get(text) for text in texts]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            computed = self.embedder.encode([texts[i] for i in missing])
+            for i, embedding in zip(missing, computed):
+                embeddings[i] = embedding
+            self.remember_embeddings([(texts[i], embeddings[i]) for i in missing])
+        return embeddings
+    
+    def _candidate_vectors(self, table: str, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Stored embeddings for candidate keys, from the local vector cache where possible."""
+        vectors = {}
+        with self._vector_lock:
+            for key in keys:
+                vector = self._vector_cache.get((table, key))
+                if vector is not None:
+                    self._vector_cache.move_to_end((table, key))
+                    vectors[key] = vector
+        missing = [key for key in keys if key not in vectors]
+        if missing:
+            fetched = self.backend.get_embeddings(table, missing)
+            vectors.update(fetched)
+            with self._vector_lock:
+                for key, vector in fetched.items():
+                    self._vector_cache[(table, key)] = vector
+                while len(self._vector_cache) > self.vector_cache_size:
+                    self._vector_cache.popitem(last=False)
+        return vectors
+    
+    def _find_similar(self, table: str, embedding: np.ndarray, threshold: float, limit: int,
+                      scan: Optional[int] = None, group: Optional[Union[str, Tuple]] = None,
+                      min_quality: Optional[float] = None) -> List[Tuple[float, str]]:
+        """(similarity, key) of the entries that reach threshold, most similar first.
+        
+        scan bounds the search to the best ranked entries; None compares
+        against every live entry (in the group), which the local vector
+        cache keeps cheap.
+        """
+        keys = self.backend.top_keys(table, scan, group=group, min_quality=min_quality)
+        vectors = self._candidate_vectors(table, keys)
+        keys = [key for key in keys if key in vectors]
+        if not keys:
+            return []
+        similarities = cosine_similarity([embedding], np.stack([vectors[key] for key in keys]))[0]
+        candidates = [(float(similarity), key) for similarity, key in zip(similarities, keys)
+                      if similarity >= threshold]
         candidates.sort(key=lambda x: x[0], reverse=True)
         return candidates[:limit]
     
-    def cache_rag_result(self, query: str, results: List[Dict], response_time: float = 0.0):
+    def cache_rag_result(self, query: str, results: List[Dict], response_time: float = 0.0,
+                         query_embedding: Optional[np.ndarray] = None):
         """Cache RAG search results with learning metadata."""
         query_hash = self._hash_query(query)
-        query_embedding = self._get_embedding(query)
-        
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        if query_embedding is None:
+            query_embedding = self._get_embedding(query)
+        # A semantic alias for this wording in L1 gives way to its own entry
+        self.rag_l1.discard(query_hash)
         
         # Check if already exists
-        cursor.execute('SELECT usage_count, avg_response_time FROM rag_cache WHERE query_hash = ?', (query_hash,))
-        existing = cursor.fetchone()
+        existing = self.backend.get("rag_cache", query_hash)
         
         if existing:
             # Update existing entry with learning
-            new_usage = existing[0] + 1
-            new_avg_time = (existing[1] * existing[0] + response_time) / new_usage
-            
-            cursor.execute('''
-                UPDATE rag_cache 
-                SET usage_count = ?, avg_response_time = ?, last_used = CURRENT_TIMESTAMP
-                WHERE query_hash = ?
-            ''', (new_usage, new_avg_time, query_hash))
+            new_usage = existing["usage_count"] + 1
+            new_avg_time = (existing["avg_response_time"] * existing["usage_count"] + response_time) / new_usage
+            fields = {"avg_response_time": new_avg_time}
+            # A wider search replaces a shorter stored result list
+            if len(results) > len(existing["results"]):
+                fields["results"] = results
+            self.backend.update("rag_cache", query_hash, fields)
+            self.backend.record_usage("rag_cache", {query_hash: 1})
         else:
             # Insert new entry
-            cursor.execute('''
-                INSERT INTO rag_cache 
-                (query_hash, query_text, query_embedding, results, avg_response_time)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (query_hash, query, pickle.dumps(query_embedding), 
-                 pickle.dumps(results), response_time))
-        
-        conn.commit()
-        conn.close()
-    
-    def get_rag_result(self, query: str) -> Optional[Tuple[List[Dict], Dict]]:
-        """Get RAG results from cache with semantic similarity matching."""
+            self.backend.insert("rag_cache", query_hash, {
+                "query_text": query,
+                "query_embedding": query_embedding,
+                "results": results,
+                "usage_count": 1,
+                "success_rate": 1.0,
+                "avg_response_time": response_time,
+            })
+    
+    def get_rag_result(self, query: str, record_usage: bool = True) -> Optional[Tuple[List[Dict], Dict]]:
+        """Get RAG results from cache with semantic similarity matching.
+        
+        The in-process L1 is checked first (no embedding, no I/O); then the
+        backend by exact hash and by semantic similarity. L2 hits are copied
+        into L1 under the query's hash. record_usage=False (cache warm-up)
+        leaves usage counts and stats alone.
+        """
         start_time = time.time()
-        self.stats["total_requests"] += 1
+        if record_usage:
+            self.stats["total_requests"] += 1
         
         query_hash = self._hash_query(query)
-        query_embedding = self._get_embedding(query)
+        entry = self.rag_l1.get(query_hash)
+        if entry is not None:
+            metadata = {
+                **entry["metadata"],
+                "cache_tier": "l1",
+                "usage_count": entry["usage_count"],
+                "response_time": time.time() - start_time
+            }
+            if record_usage:
+                entry["usage_count"] += 1
+                self.stats["hits"] += 1
+                self.stats["l1_hits"] += 1
+                self.usage_writer.record("rag_cache", entry["l2_hash"])
+            # Callers annotate the result dicts; hand out copies
+            return [dict(doc) for doc in entry["results"]], metadata
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        if record_usage:
+            self.stats["l2_lookups"] += 1
         
-        # First try exact match
-        cursor.execute('''
-            SELECT results, usage_count, success_rate FROM rag_cache 
-            WHERE query_hash = ?
-        ''', (query_hash,))
-        exact_match = cursor.fetchone()
+        # Exact match on the canonical form first; it needs no embedding
+        exact_match, exact_hash = self._get_exact("rag_cache", query_hash,
+                                                  self._hash_query(query, canonical=False))
         
         if exact_match:
-            results = pickle.loads(exact_match[0])
+            results = exact_match["results"]
             metadata = {
                 "cache_hit": "exact",
-                "usage_count": exact_match[1],
-                "success_rate": exact_match[2],
+                "cache_tier": "l2",
+                "usage_count": exact_match["usage_count"],
+                "success_rate": exact_match.get("success_rate", 1.0),
                 "response_time": time.time() - start_time
             }
+            self._promote_rag_result(query_hash, exact_hash, results, metadata)
             
-            # Update usage
-            cursor.execute('''
-                UPDATE rag_cache 
-                SET usage_count = usage_count + 1, last_used = CURRENT_TIMESTAMP
-                WHERE query_hash = ?
-            ''', (query_hash,))
-            conn.commit()
-            conn.close()
+            if not record_usage:
+                return results, metadata
             
             self.stats["hits"] += 1
-            self._save_stats()
+            self.stats["l2_hits"] += 1
+            self.usage_writer.record("rag_cache", exact_hash)
             return results, metadata
         
         # Try semantic similarity matching
-        similar_queries = self._find_similar_rag_queries(query, query_embedding)
+        query_embedding = self._get_embedding(query)
+        similar_queries = self._find_similar("rag_cache", query_embedding, self.similarity_threshold,
+                                             limit=5, scan=50)
+        best_match = self.backend.get("rag_cache", similar_queries[0][1]) if similar_queries else None
         
-        if similar_queries:
+        if best_match:
             # Use the best match
-            similarity, best_match = similar_queries[0]
-            results = pickle.loads(best_match[3])
+            similarity, matched_hash = similar_queries[0]
+            results = best_match["results"]
             
             metadata = {
                 "cache_hit": "semantic",
+                "cache_tier": "l2",
                 "similarity": similarity,
-                "original_query": best_match[1],
-                "usage_count": best_match[4],
-                "success_rate": best_match[5],
+                "original_query": best_match["query_text"],
+                "usage_count": best_match["usage_count"],
+                "success_rate": best_match.get("success_rate", 1.0),
                 "response_time": time.time() - start_time
             }
+            # Repeats of this wording resolve in L1; usage still goes to the matched entry
+            self._promote_rag_result(query_hash, matched_hash, results, metadata)
             
-            # Update usage for the matched query
-            cursor.execute('''
-                UPDATE rag_cache 
-                SET usage_count = usage_count + 1, last_used = CURRENT_TIMESTAMP
-                WHERE query_hash = ?
-            ''', (best_match[0],))
-            conn.commit()
-            conn.close()
+            if not record_usage:
+                return results, metadata
             
             self.stats["hits"] += 1
-            self._save_stats()
+            self.stats["l2_hits"] += 1
+            self.usage_writer.record("rag_cache", matched_hash)
             return results, metadata
         
-        conn.close()
-        self.stats["misses"] += 1
-        self._save_stats()
+        if record_usage:
+            self.stats["misses"] += 1
+            self.usage_writer.record()
         return None
     
+    def has_rag_results(self, queries: List[str]) -> List[bool]:
+        """Whether each query has an exact (canonical) hit, in L1 or one backend round trip; no embedding."""
+        keys = {}
+        for query in queries:
+            if self._hash_query(query) not in self.rag_l1:
+                keys[query] = (self._hash_query(query), self._hash_query(query, canonical=False))
+        entries = self.backend.get_many("rag_cache", list({key for pair in keys.values() for key in pair}))
+        return [query not in keys or any(key in entries for key in keys[query]) for query in queries]
+    
+    def _promote_rag_result(self, query_hash: str, l2_hash: str, results: List[Dict], metadata: Dict):
+        """Copy an L2 hit into L1, charged the pickled size of its results."""
+        self.rag_l1.put(query_hash, {
+            "results": [dict(doc) for doc in results],
+            "l2_hash": l2_hash,
+            "usage_count": metadata["usage_count"] + 1,
+            "metadata": {key: value for key, value in metadata.items()
+                         if key not in ("cache_tier", "usage_count", "response_time")},
+        }, len(pickle.dumps(results)))
+    
     def cache_code_result(self, prompt: str, context: str, temperature: float, 
-                         generated_code: str, quality_score: float = 0.0):
-        """Cache generated code with quality tracking."""
+                         generated_code: str, quality_score: float = 0.0,
+                         source: str = "live", provenance: Optional[Dict] = None,
+                         prompt_embedding: Optional[np.ndarray] = None):
+        """Cache generated code with quality tracking.
+        
+        ``source`` says where the entry came from (e.g. "live", "pregenerate")
+        and ``provenance`` holds free-form details such as model and job id.
+        An existing entry keeps its code; only usage and quality are updated.
+        """
         prompt_hash = self._hash_prompt(prompt, context, temperature)
-        context_hash = self._hash_query(context) if context else ""
-        prompt_embedding = self._get_embedding(prompt)
-        
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        context_hash = self._hash_query(context, canonical=False) if context else ""
         
-        cursor.execute('SELECT usage_count FROM code_cache WHERE prompt_hash = ?', (prompt_hash,))
-        existing = cursor.fetchone()
+        existing, existing_hash = self._get_exact("code_cache", prompt_hash,
+                                                  self._hash_prompt(prompt, context, temperature, canonical=False))
         
         if existing:
-            cursor.execute('''
-                UPDATE code_cache 
-                SET usage_count = usage_count + 1, last_used = CURRENT_TIMESTAMP,
-                    quality_score = MAX(quality_score, ?)
-                WHERE prompt_hash = ?
-            ''', (quality_score, prompt_hash))
+            if quality_score > existing["quality_score"]:
+                self.backend.update("code_cache", existing_hash, {"quality_score": quality_score})
+            self.backend.record_usage("code_cache", {existing_hash: 1})
         else:
-            cursor.execute('''
-                INSERT INTO code_cache 
-                (prompt_hash, prompt_text, prompt_embedding, context_hash, 
-                 generated_code, temperature, quality_score)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (prompt_hash, prompt, pickle.dumps(prompt_embedding), 
-                 context_hash, generated_code, temperature, quality_score))
-        
-        conn.commit()
-        conn.close()
-    
-    def get_code_result(self, prompt: str, context: str = "", temperature: float = 0.7) -> Optional[Tuple[str, Dict]]:
-        """Get cached code result with semantic similarity matching."""
+            if prompt_embedding is None:
+                prompt_embedding = self._get_embedding(prompt)
+            self.backend.insert("code_cache", prompt_hash, {
+                "prompt_text": prompt,
+                "prompt_embedding": prompt_embedding,
+                "context_hash": context_hash,
+                "generated_code": generated_code,
+                "temperature": temperature,
+                "quality_score": quality_score,
+                "usage_count": 1,
+                "user_feedback": 0.0,
+                "source": source,
+                "provenance": json.dumps(provenance) if provenance else None,
+            })
+    
+    def has_code_result(self, prompt: str, context: str = "", temperature: float = 0.7) -> bool:
+        """Check for an exact cached code entry without touching usage stats."""
+        existing, _ = self._get_exact("code_cache", self._hash_prompt(prompt, context, temperature),
+                                      self._hash_prompt(prompt, context, temperature, canonical=False))
+        return existing is not None
+    
+    def get_code_result(self, prompt: str, context: str = "", temperature: float = 0.7,
+                        similarity_threshold: Optional[float] = None,
+                        min_quality: Optional[float] = 0.5) -> Optional[Tuple[str, Dict]]:
+        """Get cached code result with semantic similarity matching.
+        
+        Semantic matches are limited to entries for the same context and
+        temperature rated above min_quality; None also admits unrated live
+        entries (the degraded-mode fallback).
+        """
         start_time = time.time()
         
-        prompt_hash = self._hash_prompt(prompt, context, temperature)
+        # Exact match on the canonical prompt first; it needs no embedding
+        exact_match, prompt_hash = self._get_exact("code_cache", self._hash_prompt(prompt, context, temperature),
+                                                   self._hash_prompt(prompt, context, temperature, canonical=False))
+        
+        if exact_match:
+            metadata = {
+                "cache_hit": "exact",
+                "quality_score": exact_match["quality_score"],
+                "usage_count": exact_match["usage_count"],
+                "source": exact_match.get("source"),
+                "response_time": time.time() - start_time
+            }
+            self.usage_writer.record("code_cache", prompt_hash)
+            return exact_match["generated_code"], metadata
+        
+        # Try semantic similarity among good-quality entries generated for
+        # the same context at the same temperature
         prompt_embedding = self._get_embedding(prompt)
+        threshold = self.similarity_threshold if similarity_threshold is None else similarity_threshold
+        context_hash = self._hash_query(context, canonical=False) if context else ""
+        similar_prompts = self._find_similar("code_cache", prompt_embedding, threshold, limit=3,
+                                             group=(context_hash, temperature), min_quality=min_quality)
+        best_match = self.backend.get("code_cache", similar_prompts[0][1]) if similar_prompts else None
+        
+        if best_match:
+            similarity, matched_hash = similar_prompts[0]
+            metadata = {
+                "cache_hit": "semantic",
+                "similarity": similarity,
+                "original_prompt": best_match["prompt_text"],
+                "quality_score": best_match["quality_score"],
+                "usage_count": best_match["usage_count"],
+                "response_time": time.time() - start_time
+            }
+            self.usage_writer.record("code_cache", matched_hash)
+            return best_match["generated_code"], metadata
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        return None
+    
+    def cache_diagram_result(self, prompt: str, diagram_type: str, mermaid_code: str):
+        """Cache a validated Mermaid diagram, evicting the least recently used beyond the size bound.
         
-        # Try exact match first
-        cursor.execute('''
-            SELECT generated_code, quality_score, usage_count FROM code_cache 
-            WHERE prompt_hash = ?
-        ''', (prompt_hash,))
-        exact_match = cursor.fetchone()
+        Callers must only pass diagrams that passed validation.
+        """
+        diagram_hash = self._hash_diagram(prompt, diagram_type)
+        prompt_embedding = self._get_embedding(prompt)
+        
+        # A regenerated diagram replaces an expired entry for the same prompt
+        self.backend.upsert("diagram_cache", diagram_hash, {
+            "prompt_text": prompt,
+            "diagram_type": diagram_type,
+            "prompt_embedding": prompt_embedding,
+            "mermaid_code": mermaid_code,
+        })
+        self.backend.evict("diagram_cache", self.diagram_max_entries)
+    
+    def get_diagram_result(self, prompt: str, diagram_type: str,
+                           similarity_threshold: Optional[float] = None) -> Optional[Tuple[str, Dict]]:
+        """Get a cached diagram by exact prompt or by semantic match within the same diagram type."""
+        start_time = time.time()
+        diagram_hash = self._hash_diagram(prompt, diagram_type)
+        
+        # Expired entries (diagram_ttl) are not returned by the backend
+        exact_match = self.backend.get("diagram_cache", diagram_hash)
         
         if exact_match:
-            metadata = {
+            self.usage_writer.record("diagram_cache", diagram_hash)
+            return exact_match["mermaid_code"], {
                 "cache_hit": "exact",
-                "quality_score": exact_match[1],
-                "usage_count": exact_match[2],
+                "usage_count": exact_match["usage_count"],
                 "response_time": time.time() - start_time
             }
-            
-            cursor.execute('''
-                UPDATE code_cache 
-                SET usage_count = usage_count + 1, last_used = CURRENT_TIMESTAMP
-                WHERE prompt_hash = ?
-            ''', (prompt_hash,))
-            conn.commit()
-            conn.close()
-            
-            return exact_match[0], metadata
         
-        # Try semantic similarity
-        similar_prompts = self._find_similar_code_prompts(prompt, prompt_embedding)
+        if similarity_threshold is None:
+            similarity_threshold = DIAGRAM_SIMILARITY_THRESHOLDS.get(
+                diagram_type, DIAGRAM_SIMILARITY_THRESHOLDS["default"]
+            )
+        
+        similar = self._find_similar("diagram_cache", self._get_embedding(prompt), similarity_threshold,
+                                     limit=1, group=diagram_type)
+        best_match = self.backend.get("diagram_cache", similar[0][1]) if similar else None
         
-        if similar_prompts:
-            similarity, best_match = similar_prompts[0]
-            metadata = {
+        if best_match:
+            similarity, matched_hash = similar[0]
+            self.usage_writer.record("diagram_cache", matched_hash)
+            return best_match["mermaid_code"], {
                 "cache_hit": "semantic",
                 "similarity": similarity,
-                "original_prompt": best_match[1],
-                "quality_score": best_match[4],
-                "usage_count": best_match[5],
+                "original_prompt": best_match["prompt_text"],
+                "usage_count": best_match["usage_count"],
                 "response_time": time.time() - start_time
             }
-            
-            cursor.execute('''
-                UPDATE code_cache 
-                SET usage_count = usage_count + 1, last_used = CURRENT_TIMESTAMP
-                WHERE prompt_hash = ?
-            ''', (best_match[0],))
-            conn.commit()
-            conn.close()
-            
-            return best_match[3], metadata
         
-        conn.close()
         return None
     
     def add_user_feedback(self, prompt: str, context: str, temperature: float, 
                          feedback_score: float):
         """Add user feedback to improve cache quality scoring."""
-        prompt_hash = self._hash_prompt(prompt, context, temperature)
-        
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE code_cache 
-            SET user_feedback = (user_feedback + ?) / 2
-            WHERE prompt_hash = ?
-        ''', (feedback_score, prompt_hash))
-        
-        conn.commit()
-        conn.close()
+        existing, prompt_hash = self._get_exact("code_cache", self._hash_prompt(prompt, context, temperature),
+                                                self._hash_prompt(prompt, context, temperature, canonical=False))
+        if existing:
+            self.backend.update("code_cache", prompt_hash, {
+                "user_feedback": ((existing.get("user_feedback") or 0.0) + feedback_score) / 2
+            })
         
         self.stats["learning_improvements"] += 1
         self._save_stats()
     
     def get_cache_stats(self) -> Dict:
         """Get comprehensive cache statistics."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # RAG cache stats
-        cursor.execute('SELECT COUNT(*), AVG(usage_count), AVG(success_rate) FROM rag_cache')
-        rag_stats = cursor.fetchone()
-        
-        # Code cache stats
-        cursor.execute('SELECT COUNT(*), AVG(usage_count), AVG(quality_score) FROM code_cache')
-        code_stats = cursor.fetchone()
-        
-        # Recent activity
-        cursor.execute('''
-            SELECT COUNT(*) FROM rag_cache 
-            WHERE last_used > datetime('now', '-24 hours')
-        ''')
-        recent_rag = cursor.fetchone()[0]
-        
-        cursor.execute('''
-            SELECT COUNT(*) FROM code_cache 
-            WHERE last_used > datetime('now', '-24 hours')
-        ''')
-        recent_code = cursor.fetchone()[0]
-        
-        conn.close()
+        rag_stats = self.backend.table_stats("rag_cache")
+        code_stats = self.backend.table_stats("code_cache")
+        diagram_stats = self.backend.table_stats("diagram_cache")
         
         hit_rate = self.stats["hits"] / max(self.stats["total_requests"], 1)
+        rag_lookups = self.stats["l1_hits"] + self.stats["l2_lookups"]
         
         return {
             **self.stats,
             "hit_rate": hit_rate,
-            "rag_cache_size": rag_stats[0] or 0,
-            "rag_avg_usage": rag_stats[1] or 0,
-            "rag_avg_success": rag_stats[2] or 0,
-            "code_cache_size": code_stats[0] or 0,
-            "code_avg_usage": code_stats[1] or 0,
-            "code_avg_quality": code_stats[2] or 0,
-            "recent_rag_activity": recent_rag,
-            "recent_code_activity": recent_code
+            # RAG lookups: share served from memory, and share of the rest served by the backend
+            "l1_hit_rate": self.stats["l1_hits"] / max(rag_lookups, 1),
+            "l2_hit_rate": self.stats["l2_hits"] / max(self.stats["l2_lookups"], 1),
+            "l1": self.rag_l1.get_stats(),
+            "usage_write_back": self.usage_writer.get_stats(),
+            "backend": self.backend.name,
+            "rag_cache_size": rag_stats["count"],
+            "rag_avg_usage": rag_stats["avg_usage"],
+            "rag_avg_success": rag_stats["avg_success_rate"],
+            "code_cache_size": code_stats["count"],
+            "code_avg_usage": code_stats["avg_usage"],
+            "code_avg_quality": code_stats["avg_quality"],
+            "recent_rag_activity": rag_stats["recent"],
+            "recent_code_activity": code_stats["recent"],
+            "diagram_cache_size": diagram_stats["count"],
+            "diagram_avg_usage": diagram_stats["avg_usage"]
         }
     
-    def warm_cache(self, common_queries: List[str] = None):
-        """Pre-warm cache with common queries and patterns."""
-        if not common_queries:
-            common_queries = [
-                "create a rotating cube",
-                "sphere with lighting",
-                "particle system animation",
-                "vector field visualization",
-                "3D graph plotting",
-                "physics simulation",
-                "camera controls orbit",
-                "texture mapping example"
-            ]
-        
-        print("Warming up cache with common patterns...")
-        for query in common_queries:
-            # This would typically trigger actual RAG searches
-            # but for now we just prepare the embeddings
-            self._get_embedding(query)
-        
-        print(f"Cache warmed with {len(common_queries)} patterns")
+    def hot_entries(self, limit: int = 200, days: Optional[int] = None) -> List[Tuple[str, np.ndarray, int]]:
+        """Most used cached queries and prompts across the RAG, code and diagram tables.
+        
+        Returns (text, stored embedding, usage_count), busiest first; ties go
+        to the most recently used. days limits entries to recent traffic.
+        """
+        rows = []
+        for table in ("rag_cache", "code_cache", "diagram_cache"):
+            rows.extend(self.backend.hot(table, limit, days))
+        
+        rows.sort(key=lambda row: (row["usage_count"], row["last_used"]), reverse=True)
+        hot = []
+        seen = set()
+        for row in rows:
+            if row["text"] in seen:
+                continue
+            seen.add(row["text"])
+            hot.append((row["text"], row["embedding"], row["usage_count"]))
+            if len(hot) >= limit:
+                break
+        return hot
+    
+    def warm_cache(self, limit: int = 200, days: Optional[int] = None) -> int:
+        """Load the stored embeddings of the hottest entries into the memo; returns how many."""
+        hot = self.hot_entries(limit=limit, days=days)
+        self.remember_embeddings([(text, embedding) for text, embedding, _ in hot])
+        return len(hot)
     
     def cleanup_old_entries(self, days: int = 30):
         """Clean up old, unused cache entries."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cutoff_date = datetime.now() - timedelta(days=days)
-        
-        # Remove old RAG entries with low usage
-        cursor.execute('''
-            DELETE FROM rag_cache 
-            WHERE last_used < ? AND usage_count < 2
-        ''', (cutoff_date,))
-        
-        # Remove old code entries with low quality
-        cursor.execute('''
-            DELETE FROM code_cache 
-            WHERE last_used < ? AND quality_score < 0.3 AND usage_count < 2
-        ''', (cutoff_date,))
-        
-        conn.commit()
-        conn.close()
+        self.usage_writer.flush()
+        self.backend.cleanup(days)
+        self.rag_l1.clear()
         
-        print(f"Cleaned up cache entries older than {days} days")
\ No newline at end of file
+        print(f"Cleaned up cache entries older than {days} days")
@@ -0,0 +1,152 @@
+import os
+import atexit
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class L1Cache:
+    """Bounded in-process LRU in front of the SQLite cache.
+
+    Keyed by the normalized query hash; each entry is charged the size of
+    its pickled value, and the least recently used entries are dropped once
+    max_bytes is exceeded. A hit costs a dict lookup under a lock.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv("RAG_L1_MAX_BYTES", str(32 * 1024 * 1024)))
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[0]
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key: str, value: Dict, size: int):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.stats["evictions"] += 1
+
+    def discard(self, key: str):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / max(lookups, 1),
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+class UsageWriteBack:
+    """Batch usage-count updates and write them to the cache backend off the request path.
+
+    record() only bumps an in-memory counter; a background thread applies
+    the pending increments with one backend.record_usage() call per table
+    every interval seconds and then calls on_flush (used to persist the
+    hit/miss stats file). Pending counts are flushed at interpreter exit.
+    """
+
+    def __init__(self, backend, interval: Optional[float] = None, on_flush: Optional[Callable[[], Any]] = None):
+        self.backend = backend
+        self.interval = interval if interval is not None else float(os.getenv("CACHE_USAGE_FLUSH_INTERVAL", "1.0"))
+        self.on_flush = on_flush
+        self._pending: Dict[Tuple[str, str], int] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self.stats = {"recorded": 0, "flushes": 0, "rows_written": 0, "errors": 0}
+
+        self._worker = threading.Thread(target=self._run, name="cache-usage-writer", daemon=True)
+        self._worker.start()
+        atexit.register(self.flush)
+
+    def record(self, table: Optional[str] = None, key: Optional[str] = None):
+        """Count one use of key in table (no arguments only marks the stats as dirty)."""
+        with self._lock:
+            if key is not None:
+                self._pending[(table, key)] = self._pending.get((table, key), 0) + 1
+                self.stats["recorded"] += 1
+            self._dirty = True
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            # One failed flush must not end write-back for the rest of the process
+            try:
+                self.flush()
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Usage write-back failed: {e}")
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                dirty, self._dirty = self._dirty, False
+            if not dirty:
+                return
+            by_table: Dict[str, Dict[str, int]] = {}
+            for (table, key), count in pending.items():
+                by_table.setdefault(table, {})[key] = count
+            for table, counts in by_table.items():
+                try:
+                    self.backend.record_usage(table, counts)
+                    self.stats["rows_written"] += len(counts)
+                except Exception as e:
+                    # Keep the counts for the next flush (e.g. database locked)
+                    with self._lock:
+                        for key, count in counts.items():
+                            self._pending[(table, key)] = self._pending.get((table, key), 0) + count
+                        self._dirty = True
+                    self.stats["errors"] += 1
+                    print(f"Usage write-back failed: {e}")
+            self.stats["flushes"] += 1
+            if self.on_flush:
+                try:
+                    self.on_flush()
+                except Exception as e:
+                    # Try again on the next flush (e.g. stats file not writable)
+                    with self._lock:
+                        self._dirty = True
+                    self.stats["errors"] += 1
+                    print(f"Usage write-back on_flush failed: {e}")
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {**self.stats, "pending": len(self._pending), "interval": self.interval}
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+import os
+import argparse
+from dotenv import load_dotenv
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from app.khan_catalog import KhanCatalog, CatalogSync, RecordedYouTube
+from rag.embedding_service import create_sentence_encoder
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync the Khan Academy channel's uploads into the local video catalog")
+    parser.add_argument("--db", default=None, help="Catalog database path (default: KHAN_CATALOG_DB or cache/khan_catalog.db)")
+    parser.add_argument("--max-pages", type=int, default=None, help="Stop after this many pages of 50 videos")
+    parser.add_argument("--fixture", help="Replay a recorded catalog fixture instead of calling the YouTube API")
+    args = parser.parse_args()
+    
+    # Load environment variables
+    load_dotenv()
+    
+    if args.fixture:
+        youtube = RecordedYouTube(args.fixture)
+    else:
+        api_key = os.getenv("YOUTUBE_API_KEY")
+        if not api_key:
+            parser.error("YOUTUBE_API_KEY is not set (use --fixture to sync offline)")
+        youtube = build_from_document(get_static_doc("youtube", "v3"), developerKey=api_key)
+    
+    catalog = KhanCatalog(db_path=args.db, embed_fn=create_sentence_encoder().encode)
+    CatalogSync(youtube, catalog).run(max_pages=args.max_pages)
+
+if __name__ == "__main__":
+    main()
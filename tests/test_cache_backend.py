@@ -0,0 +1,172 @@
+import time
+
+import numpy as np
+import pytest
+
+from rag import cache_backend
+from rag.cache_backend import InMemoryKV, KeyValueCacheBackend, SQLiteCacheBackend
+
+
+def _vector(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).random(8).astype(np.float32)
+
+
+def _diagram(prompt: str, diagram_type: str, seed: int = 0) -> dict:
+    return {
+        "prompt_text": prompt,
+        "prompt_embedding": _vector(seed),
+        "diagram_type": diagram_type,
+        "mermaid_code": f"{diagram_type}\n  %% {prompt}",
+        "usage_count": 1,
+    }
+
+
+def _code(prompt: str, quality: float, seed: int = 0, context_hash: str = "", temperature: float = 0.7) -> dict:
+    return {
+        "prompt_text": prompt,
+        "prompt_embedding": _vector(seed),
+        "context_hash": context_hash,
+        "generated_code": f"// {prompt}",
+        "temperature": temperature,
+        "quality_score": quality,
+        "usage_count": 1,
+        "user_feedback": 0.0,
+        "source": "live",
+        "provenance": None,
+    }
+
+
+@pytest.fixture(params=["sqlite", "kv"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteCacheBackend(str(tmp_path / "cache.db"))
+    return KeyValueCacheBackend(InMemoryKV(), prefix="test")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Advance InMemoryKV's expiry clock by clock["offset"] seconds."""
+    real = time.monotonic
+    state = {"offset": 0.0}
+    monkeypatch.setattr(cache_backend.time, "monotonic", lambda: real() + state["offset"])
+    return state
+
+
+def test_insert_get_roundtrip(backend):
+    assert backend.insert("diagram_cache", "a", _diagram("login flow", "flowchart", seed=1))
+    entry = backend.get("diagram_cache", "a")
+    assert entry["prompt_text"] == "login flow"
+    assert entry["diagram_type"] == "flowchart"
+    assert entry["usage_count"] == 1
+    np.testing.assert_allclose(entry["prompt_embedding"], _vector(1))
+    assert backend.get("diagram_cache", "missing") is None
+
+
+def test_insert_keeps_existing_entry(backend):
+    assert backend.insert("diagram_cache", "a", _diagram("first", "flowchart"))
+    assert not backend.insert("diagram_cache", "a", _diagram("second", "flowchart"))
+    assert backend.get("diagram_cache", "a")["prompt_text"] == "first"
+    backend.upsert("diagram_cache", "a", _diagram("third", "flowchart"))
+    assert backend.get("diagram_cache", "a")["prompt_text"] == "third"
+
+
+def test_top_keys_by_group_and_usage(backend):
+    backend.insert("diagram_cache", "a", _diagram("a", "flowchart"))
+    backend.insert("diagram_cache", "b", _diagram("b", "flowchart"))
+    backend.insert("diagram_cache", "c", _diagram("c", "pie"))
+    backend.record_usage("diagram_cache", {"b": 3})
+    assert backend.top_keys("diagram_cache", 10, group="flowchart") == ["b", "a"]
+    assert backend.top_keys("diagram_cache", 10, group="pie") == ["c"]
+    assert backend.top_keys("diagram_cache", 1, group="flowchart") == ["b"]
+    assert backend.top_keys("diagram_cache", None, group="flowchart") == ["b", "a"]
+    assert set(backend.top_keys("diagram_cache", None)) == {"a", "b", "c"}
+    assert backend.get("diagram_cache", "b")["usage_count"] == 4
+
+
+def test_top_keys_min_quality(backend):
+    backend.insert("code_cache", "low", _code("low", 0.2))
+    backend.insert("code_cache", "high", _code("high", 0.9))
+    backend.insert("code_cache", "unrated", _code("unrated", 0.0))
+    assert backend.top_keys("code_cache", 10, min_quality=0.5) == ["high"]
+    backend.update("code_cache", "low", {"quality_score": 0.8})
+    assert backend.top_keys("code_cache", 10, min_quality=0.5) == ["high", "low"]
+    assert backend.top_keys("code_cache", None, min_quality=0.5) == ["high", "low"]
+    assert set(backend.top_keys("code_cache", 10)) == {"high", "low", "unrated"}
+
+
+def test_top_keys_by_context_and_temperature(backend):
+    backend.insert("code_cache", "plain", _code("plain", 0.6))
+    backend.insert("code_cache", "ctx", _code("ctx", 0.9, context_hash="abc"))
+    backend.insert("code_cache", "hot", _code("hot", 0.0, temperature=1.0))
+    backend.insert("code_cache", "plain2", _code("plain2", 0.8))
+    assert backend.top_keys("code_cache", None, group=("", 0.7)) == ["plain2", "plain"]
+    assert backend.top_keys("code_cache", None, group=("abc", 0.7)) == ["ctx"]
+    assert backend.top_keys("code_cache", None, group=("", 1.0)) == ["hot"]
+    assert backend.top_keys("code_cache", None, group=("", 1.0), min_quality=0.5) == []
+    backend.update("code_cache", "plain", {"quality_score": 0.95})
+    assert backend.top_keys("code_cache", None, group=("", 0.7), min_quality=0.5) == ["plain", "plain2"]
+    backend.record_usage("code_cache", {"hot": 2})
+    assert backend.get("code_cache", "hot")["usage_count"] == 3
+
+
+def test_unset_temperature_is_its_own_group(backend):
+    backend.insert("code_cache", "unset", _code("unset", 0.5, temperature=None))
+    backend.insert("code_cache", "set", _code("set", 0.5))
+    assert backend.top_keys("code_cache", None, group=("", None)) == ["unset"]
+    assert backend.top_keys("code_cache", None, group=("", 0.7)) == ["set"]
+    backend.record_usage("code_cache", {"unset": 1})
+    assert backend.get("code_cache", "unset")["usage_count"] == 2
+
+
+def test_get_embeddings(backend):
+    backend.insert("diagram_cache", "a", _diagram("a", "flowchart", seed=3))
+    vectors = backend.get_embeddings("diagram_cache", ["a", "missing"])
+    assert list(vectors) == ["a"]
+    np.testing.assert_allclose(vectors["a"], _vector(3))
+
+
+def test_evict_keeps_most_recent(backend):
+    for i, key in enumerate("abc"):
+        backend.insert("diagram_cache", key, _diagram(key, "flowchart", seed=i))
+        time.sleep(0.01)
+    backend.evict("diagram_cache", 2)
+    assert backend.get("diagram_cache", "a") is None
+    assert set(backend.top_keys("diagram_cache", 10, group="flowchart")) == {"b", "c"}
+
+
+def test_kv_expired_keys_leave_group_rank(clock):
+    backend = KeyValueCacheBackend(InMemoryKV(), prefix="test", ttls={"diagram_cache": 10})
+    for i in range(5):
+        backend.insert("diagram_cache", f"old{i}", _diagram(f"old {i}", "flowchart", seed=i))
+    clock["offset"] = 11
+    backend.insert("diagram_cache", "new", _diagram("new", "flowchart", seed=9))
+
+    # The expired keys are seen (and dropped) by whichever read meets them first
+    assert len(backend.top_keys("diagram_cache", 10, group="flowchart")) == 6
+    assert list(backend.get_embeddings("diagram_cache", ["old0", "old1", "new"])) == ["new"]
+    assert backend.get_many("diagram_cache", ["old2"]) == {}
+    backend.record_usage("diagram_cache", {"old3": 1, "new": 1})
+    backend.evict("diagram_cache", 10)
+    assert backend.top_keys("diagram_cache", 10, group="flowchart") == ["new", "old4"]
+    backend.get("diagram_cache", "old4")
+    assert backend.top_keys("diagram_cache", 10, group="flowchart") == ["new"]
+    assert backend.top_keys("diagram_cache", 10) == ["new"]
+    assert backend.client.hgetall("test:diagram_cache:groups") == {b"new": b"flowchart"}
+
+
+def test_kv_evict_prunes_group_rank_of_expired_keys(clock):
+    backend = KeyValueCacheBackend(InMemoryKV(), prefix="test", ttls={"diagram_cache": 10})
+    backend.insert("diagram_cache", "old", _diagram("old", "pie"))
+    clock["offset"] = 11
+    backend.insert("diagram_cache", "new", _diagram("new", "pie"))
+    backend.evict("diagram_cache", 1)
+    assert backend.top_keys("diagram_cache", 10, group="pie") == ["new"]
+
+
+def test_kv_cleanup_prunes_group_rank():
+    backend = KeyValueCacheBackend(InMemoryKV(), prefix="test")
+    backend.insert("diagram_cache", "a", _diagram("a", "pie"))
+    backend.client.delete("test:diagram_cache:a")
+    backend.cleanup(days=-1)
+    assert backend.top_keys("diagram_cache", 10, group="pie") == []
+    assert backend.table_stats("diagram_cache")["count"] == 0
@@ -0,0 +1,48 @@
+import pytest
+
+from app.code_edits import EditApplyError, apply_edit_blocks, parse_edit_blocks
+
+CODE = """const cube = new THREE.Mesh(new THREE.BoxGeometry(), new THREE.MeshNormalMaterial());
+scene.add(cube);
+
+function animate() {
+  cube.rotation.y += 0.01;
+  return;
+}
+
+return animate;"""
+
+
+def test_empty_search_inserts_before_final_return():
+    code = apply_edit_blocks(CODE, [("", "const light = new THREE.AmbientLight(0xffffff);\nscene.add(light);")])
+    lines = code.split("\n")
+    assert lines[-1] == "return animate;"
+    assert lines.index("scene.add(light);") < lines.index("return animate;")
+    # Not inside animate(), whose own return is nested
+    assert lines.index("const light = new THREE.AmbientLight(0xffffff);") > lines.index("}")
+    assert code.count("return animate;") == 1
+
+
+def test_empty_search_appends_without_top_level_return():
+    code = apply_edit_blocks("scene.add(cube);", [("", "scene.add(light);")])
+    assert code == "scene.add(cube);\nscene.add(light);"
+
+
+def test_search_replace_exact_and_by_lines():
+    code = apply_edit_blocks(CODE, [("cube.rotation.y += 0.01;", "cube.rotation.y += 0.02;")])
+    assert "0.02" in code
+    # Indentation differences are tolerated
+    code = apply_edit_blocks(CODE, [("function animate() {\ncube.rotation.y += 0.01;", "function animate() {")])
+    assert "rotation" not in code
+
+
+def test_missing_or_ambiguous_search_is_rejected():
+    with pytest.raises(EditApplyError):
+        apply_edit_blocks(CODE, [("cube.rotation.z", "x")])
+    with pytest.raises(EditApplyError):
+        apply_edit_blocks(CODE, [("cube", "x")])
+
+
+def test_parse_edit_blocks():
+    text = "<<<<<<< SEARCH\na = 1;\n=======\na = 2;\n>>>>>>> REPLACE\n<<<<<<< SEARCH\n=======\nb = 3;\n>>>>>>> REPLACE"
+    assert parse_edit_blocks(text) == [("a = 1;", "a = 2;"), ("", "b = 3;")]
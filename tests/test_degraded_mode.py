@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from app.degraded_mode import CircuitBreaker, StaleWhileRevalidate, UpstreamUnavailable
+
+
+def _swr(threshold=3, deadline=0.05):
+    breaker = CircuitBreaker("test", failure_threshold=threshold, reset_timeout=60)
+    return breaker, StaleWhileRevalidate("test", breaker, deadline=deadline)
+
+
+async def _slow_ok():
+    await asyncio.sleep(0.1)
+    return "fresh"
+
+
+async def _failing():
+    raise RuntimeError("upstream error")
+
+
+async def _cached():
+    return "stale"
+
+
+async def _nothing():
+    return None
+
+
+def test_slow_call_that_succeeds_does_not_trip_breaker():
+    async def scenario():
+        breaker, swr = _swr()
+        for i in range(breaker.failure_threshold * 2):
+            result, reason = await swr.run(("k", i), _slow_ok, _cached)
+            assert (result, reason) == ("stale", "deadline")
+        # Let the calls that outlived their deadline land
+        await asyncio.sleep(0.2)
+        assert breaker.state == "closed"
+        assert breaker.stats["failures"] == 0
+        assert breaker.stats["successes"] == breaker.failure_threshold * 2
+        assert swr.stats["deadline_missed"] == breaker.failure_threshold * 2
+        # Still allowed through, and waited for when nothing is cached
+        assert await swr.run("k", _slow_ok, _nothing) == ("fresh", None)
+
+    asyncio.run(scenario())
+
+
+def test_slow_call_that_fails_counts_as_failure():
+    async def slow_fail():
+        await asyncio.sleep(0.1)
+        raise RuntimeError("late error")
+
+    async def scenario():
+        breaker, swr = _swr(threshold=2)
+        for i in range(2):
+            assert await swr.run(("k", i), slow_fail, _cached) == ("stale", "deadline")
+        await asyncio.sleep(0.2)
+        assert breaker.state == "open"
+
+    asyncio.run(scenario())
+
+
+def test_errors_open_circuit_and_serve_stale():
+    async def scenario():
+        breaker, swr = _swr(threshold=2)
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await swr.run("k", _failing, _nothing)
+        assert breaker.state == "open"
+        assert await swr.run("k", _failing, _cached) == ("stale", "circuit_open")
+        with pytest.raises(UpstreamUnavailable):
+            await swr.run("k", _failing, _nothing)
+        for task in list(swr._refreshing.values()):
+            task.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_success_resets_failure_count():
+    async def ok():
+        return "fresh"
+
+    async def scenario():
+        breaker, swr = _swr(threshold=2)
+        with pytest.raises(RuntimeError):
+            await swr.run("k", _failing, _nothing)
+        assert await swr.run("k", ok, _nothing) == ("fresh", None)
+        with pytest.raises(RuntimeError):
+            await swr.run("k", _failing, _nothing)
+        assert breaker.state == "closed"
+
+    asyncio.run(scenario())
@@ -0,0 +1,31 @@
+import json
+import os
+
+from app.diagram_classifier import DIAGRAM_CUES, DiagramTypeClassifier
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks")
+
+# Measured 56/60 when the set was written; the cues were never tuned on it
+HELDOUT_MIN_ACCURACY = 0.85
+
+
+def _load(name):
+    with open(os.path.join(BENCH_DIR, name)) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_heldout_set_is_separate_from_tuning_set():
+    tuning = {item["prompt"].lower() for item in _load("diagram_type_labels.jsonl")}
+    assert not [item["prompt"] for item in _load("diagram_type_heldout.jsonl") if item["prompt"].lower() in tuning]
+
+
+def test_heldout_accuracy():
+    heldout = _load("diagram_type_heldout.jsonl")
+    predicted = DiagramTypeClassifier().classify_many([item["prompt"] for item in heldout])
+    misses = [(item["prompt"], item["type"], got) for item, got in zip(heldout, predicted) if got != item["type"]]
+    accuracy = 1 - len(misses) / len(heldout)
+    assert accuracy >= HELDOUT_MIN_ACCURACY, misses
+
+
+def test_heldout_covers_every_type():
+    assert {item["type"] for item in _load("diagram_type_heldout.jsonl")} == set(DIAGRAM_CUES)
@@ -0,0 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from rag.embedding_batcher import EmbeddingBatcher
+
+
+def encode(texts):
+    if any(text == "bad" for text in texts):
+        raise ValueError("cannot encode 'bad'")
+    return np.array([[float(len(text))] for text in texts])
+
+
+def test_concurrent_calls_share_a_batch():
+    batcher = EmbeddingBatcher(encode, window_ms=50, max_batch=8)
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(batcher.encode, ["a", "bb", "ccc", "dddd"]))
+    assert [float(vector[0]) for vector in results] == [1.0, 2.0, 3.0, 4.0]
+    assert batcher.get_stats()["batches"] < 4
+
+
+def test_one_bad_input_fails_only_its_caller():
+    batcher = EmbeddingBatcher(encode, window_ms=50, max_batch=8)
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(batcher.encode, text) for text in ["a", "bad", "ccc", ["dd", "e"]]]
+        with pytest.raises(ValueError):
+            futures[1].result()
+        assert float(futures[0].result()[0]) == 1.0
+        assert float(futures[2].result()[0]) == 3.0
+        assert futures[3].result().tolist() == [[2.0], [1.0]]
@@ -0,0 +1,35 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from rag.embedding_service import EmbeddingServer
+
+
+def encode(texts):
+    if any(text == "bad" for text in texts):
+        raise ValueError("cannot encode 'bad'")
+    return np.array([[float(len(text))] for text in texts], dtype=np.float32)
+
+
+def test_one_bad_input_fails_only_its_caller(tmp_path):
+    server = EmbeddingServer(socket_path=str(tmp_path / "embed.sock"), models=["fake"], max_wait_ms=50)
+    server.encoders["fake"] = encode
+
+    async def scenario():
+        server._queues["fake"] = asyncio.Queue()
+        batcher = asyncio.create_task(server._batcher("fake"))
+        try:
+            results = await asyncio.gather(
+                server._encode("fake", ["a"]), server._encode("fake", ["bad"]),
+                server._encode("fake", ["ccc", "dd"]), return_exceptions=True
+            )
+        finally:
+            batcher.cancel()
+        return results
+
+    good, bad, pair = asyncio.run(scenario())
+    assert isinstance(bad, ValueError)
+    assert good.tolist() == [[1.0]]
+    assert pair.tolist() == [[3.0], [2.0]]
+    assert server.stats["retried_separately"] == 3
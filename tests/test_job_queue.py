@@ -0,0 +1,189 @@
+import asyncio
+import sqlite3
+import time
+
+from app.job_queue import FAILED, QUEUED, RUNNING, SUCCEEDED, JobStore, JobWorkerPool, RetryLater
+
+
+class SiblingStore(JobStore):
+    """The same job file as seen by another worker process."""
+
+    owner = "sibling:1"
+
+
+def _age_lease(db_path: str, job_id: str, seconds: float):
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE jobs SET heartbeat_at = heartbeat_at - ? WHERE id = ?", (seconds, job_id))
+    conn.commit()
+    conn.close()
+
+
+def test_recover_leaves_live_leases_alone(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    store, sibling = JobStore(db_path), SiblingStore(db_path)
+    job = store.submit("generate", {"prompt": "cube"})
+    assert sibling.claim_next()["id"] == job["id"]
+
+    # A live sibling's job is not taken over
+    assert store.recover(lease_timeout=60) == 0
+    assert store.get(job["id"])["status"] == RUNNING
+    assert not store.complete(job["id"], {"code": "mine"})
+
+    # Once its lease lapses (the sibling died), the job is queued again
+    _age_lease(db_path, job["id"], 120)
+    assert store.recover(lease_timeout=60) == 1
+    assert store.get(job["id"])["status"] == QUEUED
+    assert store.claim_next()["owner"] == store.owner
+    assert not sibling.complete(job["id"], {"code": "late"})
+    assert store.complete(job["id"], {"code": "mine"})
+    assert store.get(job["id"])["result"] == {"code": "mine"}
+
+
+def test_heartbeat_renews_only_own_leases(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    store, sibling = JobStore(db_path), SiblingStore(db_path)
+    mine = store.submit("generate", {"prompt": "a"})
+    theirs = store.submit("generate", {"prompt": "b"})
+    store.claim_next()
+    sibling.claim_next()
+    _age_lease(db_path, mine["id"], 120)
+    _age_lease(db_path, theirs["id"], 120)
+    store.heartbeat([mine["id"], theirs["id"]])
+    assert store.recover(lease_timeout=60) == 1
+    assert store.get(mine["id"])["status"] == RUNNING
+    assert store.get(theirs["id"])["status"] == QUEUED
+
+
+def test_old_job_file_gets_lease_columns(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+        CREATE TABLE jobs (
+            id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, dedup_key TEXT,
+            priority INTEGER DEFAULT 0, status TEXT NOT NULL, result TEXT, error TEXT,
+            attempts INTEGER DEFAULT 0, created_at REAL NOT NULL, run_after REAL NOT NULL,
+            started_at REAL, finished_at REAL, expires_at REAL
+        )
+    ''')
+    now = time.time()
+    conn.execute("INSERT INTO jobs (id, kind, payload, status, created_at, run_after) VALUES (?, ?, ?, ?, ?, ?)",
+                 ("old", "generate", "{}", RUNNING, now, now))
+    conn.commit()
+    conn.close()
+
+    store = JobStore(db_path)
+    # Running before leases existed: nobody holds it
+    assert store.recover(lease_timeout=60) == 1
+    assert store.claim_next()["id"] == "old"
+
+
+def test_pool_runs_retries_and_fails_jobs(tmp_path):
+    calls = {"flaky": 0}
+
+    async def ok(payload):
+        return {"echo": payload["x"]}
+
+    async def flaky(payload):
+        calls["flaky"] += 1
+        if calls["flaky"] == 1:
+            raise RetryLater("shed", 0)
+        raise RuntimeError("broken")
+
+    async def scenario():
+        store = JobStore(str(tmp_path / "jobs.db"))
+        pool = JobWorkerPool(store, {"ok": ok, "flaky": flaky}, workers=2, max_attempts=1,
+                             lease_timeout=1, poll_interval=0.05)
+        pool.start()
+        try:
+            good = store.submit("ok", {"x": 1})
+            bad = store.submit("flaky", {})
+            pool.notify_submitted()
+            for _ in range(100):
+                if all(store.get(job["id"])["status"] in (SUCCEEDED, FAILED) for job in (good, bad)):
+                    break
+                await pool.wait(good["id"], 0.05)
+            assert store.get(good["id"])["result"] == {"echo": 1}
+            failed = store.get(bad["id"])
+            assert failed["status"] == FAILED and failed["error"] == "broken"
+            # RetryLater did not use up the only attempt
+            assert failed["attempts"] == 1
+        finally:
+            await pool.stop()
+
+    asyncio.run(scenario())
+
+
+def test_pool_keeps_lease_of_long_job(tmp_path):
+    async def slow(payload):
+        await asyncio.sleep(0.6)
+        return {}
+
+    async def scenario():
+        db_path = str(tmp_path / "jobs.db")
+        store = JobStore(db_path)
+        pool = JobWorkerPool(store, {"slow": slow}, workers=1, lease_timeout=0.2, poll_interval=0.05)
+        pool.start()
+        try:
+            job = store.submit("slow", {})
+            pool.notify_submitted()
+            await asyncio.sleep(0.3)
+            # Past lease_timeout, but renewed: a sibling's recover leaves it alone
+            assert SiblingStore(db_path).recover(lease_timeout=0.2) == 0
+            for _ in range(40):
+                if store.get(job["id"])["status"] == SUCCEEDED:
+                    break
+                await asyncio.sleep(0.05)
+            assert store.get(job["id"])["status"] == SUCCEEDED
+            assert pool.stats["lease_lost"] == 0
+        finally:
+            await pool.stop()
+
+    asyncio.run(scenario())
+
+
+def test_worker_survives_store_errors(tmp_path):
+    async def ok(payload):
+        return {"done": True}
+
+    class LockedStore(JobStore):
+        failures = 2
+
+        def claim_next(self):
+            if self.failures:
+                self.failures -= 1
+                raise sqlite3.OperationalError("database is locked")
+            return super().claim_next()
+
+    async def scenario():
+        store = LockedStore(str(tmp_path / "jobs.db"))
+        pool = JobWorkerPool(store, {"ok": ok}, workers=1, poll_interval=0.01)
+        job = store.submit("ok", {})
+        pool.start()
+        try:
+            for _ in range(100):
+                if store.get(job["id"])["status"] == SUCCEEDED:
+                    break
+                await asyncio.sleep(0.02)
+            assert store.get(job["id"])["status"] == SUCCEEDED
+            assert pool.stats["store_errors"] == 2
+        finally:
+            await pool.stop()
+
+    asyncio.run(scenario())
+
+
+def test_timed_out_waits_do_not_leak(tmp_path):
+    async def scenario():
+        pool = JobWorkerPool(JobStore(str(tmp_path / "jobs.db")), {}, workers=0)
+        await asyncio.gather(*(pool.wait(f"job{i}", 0.01) for i in range(50)))
+        assert pool._watchers == {}
+
+        # A waiter still listening keeps the event for the job
+        slow = asyncio.ensure_future(pool.wait("shared", 1.0))
+        await pool.wait("shared", 0.01)
+        assert "shared" in pool._watchers
+        pool._changed("shared")
+        await asyncio.wait_for(slow, 0.5)
+        assert pool._watchers == {}
+
+    asyncio.run(scenario())
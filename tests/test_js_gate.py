@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from app import js_gate
+from app.anthropic_client import AnthropicClient
+from app.js_gate import JavaScriptGate
+
+pytestmark = pytest.mark.skipif(js_gate.esprima is None, reason="esprima is not installed")
+
+SCENE = """const geometry = new THREE.BoxGeometry(1, 1, 1);
+const cube = new THREE.Mesh(geometry, new THREE.MeshNormalMaterial());
+scene.add(cube);
+function animate() {
+  cube.rotation.x += 0.01;
+}
+return animate;"""
+
+
+def test_valid_code_passes_unchanged():
+    result = JavaScriptGate().check(SCENE)
+    assert result.parsed is True
+    assert result.code == SCENE
+
+
+def test_environment_fixes_are_applied():
+    code = "const scene = new THREE.Scene();\n" + SCENE.replace("return animate;", "animate();")
+    result = JavaScriptGate().check(code)
+    assert result.parsed is True
+    assert "new THREE.Scene" not in result.code
+    assert result.code.rstrip().endswith("return animate;")
+    assert set(result.rules) >= {"scene", "animate_call", "return_animate"}
+
+
+def test_syntax_error_fails():
+    gate = JavaScriptGate()
+    result = gate.check(SCENE.replace("cube.rotation.x += 0.01;", "cube.rotation.x += ;"))
+    assert result.parsed is False
+    assert result.error.startswith("line 5:")
+    assert gate.get_stats()["parse_failures"] == 1
+
+
+@pytest.mark.parametrize("line", [
+    "const speed = cube.userData?.speed ?? 0.01;",
+    "const count = 1_000;",
+    "let ready = false; ready ||= true;",
+    "class Spinner { speed = 0.01; }",
+    "try { JSON.parse('{}'); } catch { }",
+])
+def test_newer_syntax_is_unverified_not_failed(line):
+    gate = JavaScriptGate()
+    result = gate.check(line + "\n" + SCENE)
+    assert result.parsed is None
+    assert "predates" in result.error
+    stats = gate.get_stats()
+    assert stats["parse_failures"] == 0 and stats["unverified"] == 1
+
+
+def test_repair_quotes_the_code_the_error_refers_to():
+    # Dropping the DOM styling leaves "if (show)  else", so the error is in the fixed code
+    code = ("const label = document.createElement('div');\n"
+            "const show = true;\n"
+            "if (show) label.style.color = 'red'; else scene.add(new THREE.AxesHelper());\n" + SCENE)
+    gate = JavaScriptGate().check(code)
+    assert gate.parsed is False and gate.error.startswith("after fixes")
+    client = AnthropicClient(client=object())
+    sent = {}
+
+    async def repair(code, error, *args):
+        sent["code"], sent["error"] = code, error
+        return None
+
+    client._repair_syntax = repair
+    asyncio.run(client._gate_code(code, [], "model", "generate", None))
+    assert sent["code"] == gate.code
+    assert sent["code"].startswith("// WARNING: Fixed violations")
+    assert sent["error"] == gate.error
+
+
+def test_gate_does_not_ask_for_repair_of_newer_syntax():
+    client = AnthropicClient(client=object())
+
+    async def repair(*args):
+        raise AssertionError("no repair expected")
+
+    client._repair_syntax = repair
+    code = "const speed = cube.userData?.speed ?? 0.01;\n" + SCENE
+    assert "?.speed" in asyncio.run(client._gate_code(code, [], "model", "generate", None))
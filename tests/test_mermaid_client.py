@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from app import mermaid_client
+from app.mermaid_client import MermaidClient
+from app.stand_in_llm import StandInAnthropic
+
+BROKEN = "classDiagram\n    User ||--o{ Order : places"
+FIXED = 'classDiagram\n    User "1" --> "*" Order : places'
+
+
+@pytest.fixture
+def replies(monkeypatch):
+    """Scripted model replies, one per request."""
+    queue = []
+
+    async def complete(client, messages, max_tokens, **kwargs):
+        return queue.pop(0), "end_turn", 50
+
+    monkeypatch.setattr(mermaid_client, "complete_with_continuation", complete)
+    return queue
+
+
+def _generate(client):
+    return asyncio.run(client.generate_mermaid_diagram("users place orders", diagram_type="classDiagram"))
+
+
+def test_repair_goes_through_post_processing(replies):
+    client = MermaidClient(client=object())
+    replies.extend([BROKEN, f"```mermaid\n{FIXED}\n```"])
+    result = _generate(client)
+    assert result["mermaid_code"] == FIXED
+    assert result["valid"] is True
+    assert client.repair_stats == {"attempted": 1, "succeeded": 1}
+
+
+def test_invalid_repair_is_not_trusted(replies):
+    client = MermaidClient(client=object())
+    replies.extend([BROKEN, BROKEN.replace("places", "buys")])
+    result = _generate(client)
+    assert result["mermaid_code"] == BROKEN
+    assert result["valid"] is False
+    assert result["validation_errors"]
+    assert client.repair_stats == {"attempted": 1, "succeeded": 0}
+
+
+def test_repair_without_declaration_is_not_trusted(replies):
+    client = MermaidClient(client=object())
+    # Validates once a header is added, but the model never declared the type
+    replies.extend([BROKEN, 'User "1" --> "*" Order : places'])
+    result = _generate(client)
+    assert result["valid"] is False
+    assert client.repair_stats["succeeded"] == 0
+
+
+class ChattyModel(StandInAnthropic):
+    """Wraps the diagram in prose and a fence unless the fence is prefilled."""
+
+    def _diagram(self, diagram_type, prompt):
+        return FIXED
+
+    def _respond(self, model, messages, max_tokens, **kwargs):
+        response = super()._respond(model, messages, max_tokens, **kwargs)
+        if messages[-1]["role"] != "assistant":
+            # Without a prefill the stop sequence ends the reply at the opening fence
+            response.content[0].text = "Here is the diagram:"
+            response.stop_reason, response.stop_sequence = "stop_sequence", "\n```"
+        return response
+
+
+def test_preamble_cannot_swallow_the_diagram():
+    client = MermaidClient(client=ChattyModel(latency=0))
+    result = _generate(client)
+    assert result["mermaid_code"] == FIXED
+    assert result["valid"] is True
+    assert client.client.calls[0]["messages"][-1] == {"role": "assistant", "content": mermaid_client.MERMAID_PREFILL}
@@ -0,0 +1,24 @@
+from app.mermaid_prompts import (MERMAID_CORE_PROMPT, MERMAID_EXAMPLES, MIN_CACHEABLE_TOKENS,
+                                 build_system_blocks)
+
+
+def test_known_type_gets_only_its_own_examples():
+    for diagram_type, example in MERMAID_EXAMPLES.items():
+        blocks = build_system_blocks(diagram_type)
+        assert blocks[0]["text"] == MERMAID_CORE_PROMPT
+        text = "".join(block["text"] for block in blocks)
+        assert example in text
+        others = [other for name, other in MERMAID_EXAMPLES.items() if name != diagram_type and other not in example]
+        assert not [other for other in others if other in text]
+        # Too short for the prompt cache, so no breakpoint is sent
+        assert len(text) // 4 < MIN_CACHEABLE_TOKENS
+        assert all("cache_control" not in block for block in blocks)
+
+
+def test_unknown_type_gets_every_example_and_is_cached():
+    blocks = build_system_blocks("unknown-type")
+    text = "".join(block["text"] for block in blocks)
+    assert all(example in text for example in MERMAID_EXAMPLES.values())
+    assert len(text) // 4 >= MIN_CACHEABLE_TOKENS
+    assert blocks[-1]["cache_control"] == {"type": "ephemeral"}
+    assert "cache_control" not in blocks[0]
@@ -0,0 +1,49 @@
+import pytest
+
+from rag import smart_cache
+from rag.rag_engine import RAGEngine
+from test_smart_cache import WordHashEncoder
+
+DOCS = [f"three.js example number {i}" for i in range(8)]
+
+
+class FakeCollection:
+    """Returns the first n_results documents for any query and counts the queries."""
+
+    def __init__(self):
+        self.queries = 0
+
+    def count(self):
+        return len(DOCS)
+
+    def query(self, query_texts, n_results):
+        self.queries += 1
+        rows = [DOCS[:n_results] for _ in query_texts]
+        return {"documents": rows, "metadatas": [[{}] * len(row) for row in rows],
+                "distances": [[0.1] * len(row) for row in rows]}
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    monkeypatch.setenv("CACHE_BACKEND", "sqlite")
+    monkeypatch.setattr(smart_cache, "create_sentence_encoder", WordHashEncoder)
+    engine = RAGEngine.__new__(RAGEngine)
+    engine.cache = smart_cache.SmartCache(cache_dir=str(tmp_path))
+    engine.collection = FakeCollection()
+    engine.metrics = {"total_searches": 0, "cache_hits": 0, "avg_search_time": 0.0}
+    return engine
+
+
+def test_refine_lookup_does_not_shrink_later_searches(engine):
+    assert len(engine.search("add a spotlight", k=1, cache_results=False)) == 1
+    assert len(engine.search("add a spotlight", k=5)) == 5
+    # The five-document entry also answers the narrow lookup
+    assert len(engine.search("add a spotlight", k=1, cache_results=False)) == 1
+    assert engine.collection.queries == 2
+
+
+def test_short_cached_results_are_searched_again_and_replaced(engine):
+    engine.search("add a spotlight", k=1)
+    assert len(engine.search("add a spotlight", k=5)) == 5
+    assert len(engine.search_many(["add a spotlight"], k=5)[0]) == 5
+    assert engine.collection.queries == 2
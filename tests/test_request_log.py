@@ -0,0 +1,75 @@
+import json
+import time
+
+from app.request_log import RequestLog, rotated_path
+
+
+def _wait_written(log: RequestLog, count: int):
+    for _ in range(200):
+        if log.stats["written"] >= count:
+            return
+        time.sleep(0.01)
+
+
+def test_append_is_written_in_the_background(tmp_path):
+    path = str(tmp_path / "requests.jsonl")
+    log = RequestLog(path)
+    log.append("spinning cube", None)
+    log.append("solar system", "dark background")
+    _wait_written(log, 2)
+    with open(path) as f:
+        rows = [json.loads(line) for line in f]
+    assert [row["prompt"] for row in rows] == ["spinning cube", "solar system"]
+    assert rows[1]["context"] == "dark background"
+
+
+def test_log_rotates_at_max_bytes(tmp_path):
+    path = str(tmp_path / "requests.jsonl")
+    log = RequestLog(path, max_bytes=200)
+    for i in range(20):
+        log.append(f"prompt number {i}", None)
+        _wait_written(log, i + 1)
+    assert rotated_path(path) == str(tmp_path / "requests.1.jsonl")
+    assert log.stats["rotations"] > 0
+    for name in (path, rotated_path(path)):
+        with open(name) as f:
+            assert len(f.read()) < 200 + 100
+
+
+def test_full_queue_drops_instead_of_blocking(tmp_path):
+    log = RequestLog(str(tmp_path / "requests.jsonl"), max_pending=1)
+    with log._write_lock:
+        # The writer is stuck behind the lock, so the queue fills up
+        for i in range(20):
+            log.append(f"prompt {i}", None)
+    assert log.stats["dropped"] > 0
+    log.flush()
+
+
+def test_warm_up_counts_rotated_prompts(tmp_path):
+    from app.cache_warmer import CacheWarmer
+
+    path = str(tmp_path / "requests.jsonl")
+    with open(rotated_path(path), "w") as f:
+        f.write("".join(json.dumps({"prompt": p}) + "\n" for p in ["solar system", "solar system", "cube"]))
+    with open(path, "w") as f:
+        f.write(json.dumps({"prompt": "cube"}) + "\n" + json.dumps({"prompt": "solar system"}) + "\n")
+    warmer = CacheWarmer(rag_engine=None, request_log=path, top_n=2)
+    assert warmer.log_queries() == ["solar system", "cube"]
+
+
+def test_routing_outcomes_go_through_the_background_writer(tmp_path):
+    from app.model_router import ModelRouter
+    from app.pipeline_metrics import PipelineRecord
+
+    path = str(tmp_path / "model_routing.jsonl")
+    router = ModelRouter(log_path=path)
+    decision = router.route("mermaid", "simple flowchart", diagram_type="flowchart")
+    record = PipelineRecord("generate-mermaid")
+    record.finish()
+    router.record_outcome(decision, record, success=True)
+    _wait_written(router.log, 1)
+    with open(path) as f:
+        entry = json.loads(f.readline())
+    assert entry["domain"] == "mermaid" and entry["success"] is True
+    assert ModelRouter(log_path="").log is None
@@ -0,0 +1,81 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+from rag import smart_cache
+
+
+class WordHashEncoder:
+    """Deterministic bag-of-words embeddings, so tests control similarity without a model."""
+
+    dims = 256
+
+    def encode(self, sentences, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        vectors = np.zeros((len(texts), self.dims), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dims] += 1.0
+        return vectors[0] if single else vectors
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("CACHE_BACKEND", "sqlite")
+    monkeypatch.setattr(smart_cache, "create_sentence_encoder", WordHashEncoder)
+    return smart_cache.SmartCache(cache_dir=str(tmp_path))
+
+
+def test_diagram_semantic_match_beyond_most_used(cache):
+    # Plenty of busier diagrams of the same type must not hide the match
+    for i in range(80):
+        cache.cache_diagram_result(f"distractor topic number{i} word{i}", "flowchart", f"flowchart TD\n  A{i}")
+    cache.backend.record_usage("diagram_cache", {
+        cache._hash_diagram(f"distractor topic number{i} word{i}", "flowchart"): 10 for i in range(80)
+    })
+    cache.cache_diagram_result("the user login flow with password reset", "flowchart", "flowchart TD\n  Login")
+
+    hit = cache.get_diagram_result("user login flow with password reset", "flowchart", similarity_threshold=0.85)
+    assert hit is not None
+    assert hit[0] == "flowchart TD\n  Login"
+    assert hit[1]["cache_hit"] == "semantic"
+    assert cache.get_diagram_result("user login flow with password reset", "sequenceDiagram",
+                                    similarity_threshold=0.85) is None
+
+
+def test_stale_code_lookup_reaches_unrated_entries(cache):
+    # Rated entries outrank unrated live ones; the fallback must still see the latter
+    for i in range(40):
+        cache.cache_code_result(f"rated scene number{i} word{i}", "", 0.7, f"// rated {i}", quality_score=0.9)
+    cache.cache_code_result("red cube spinning slowly around", "", 0.7, "// cube", source="live")
+
+    assert cache.get_code_result("red cube spinning slowly", similarity_threshold=0.8) is None
+    hit = cache.get_code_result("red cube spinning slowly", similarity_threshold=0.8, min_quality=None)
+    assert hit is not None
+    assert hit[0] == "// cube"
+    assert hit[1]["cache_hit"] == "semantic"
+
+
+def test_code_semantic_match_needs_same_context_and_temperature(cache):
+    cache.cache_code_result("red cube spinning slowly around", "", 0.7, "// plain", quality_score=0.9)
+    cache.cache_code_result("red cube spinning slowly around", "use a dark background", 0.7, "// dark",
+                            quality_score=0.9)
+    cache.cache_code_result("red cube spinning slowly around", "", 1.0, "// hot", quality_score=0.9)
+
+    assert cache.get_code_result("red cube spinning slowly", "", 0.7, similarity_threshold=0.8)[0] == "// plain"
+    assert cache.get_code_result("red cube spinning slowly", "use a dark background", 0.7,
+                                 similarity_threshold=0.8)[0] == "// dark"
+    assert cache.get_code_result("red cube spinning slowly", "", 1.0, similarity_threshold=0.8)[0] == "// hot"
+    assert cache.get_code_result("red cube spinning slowly", "other context", 0.7, similarity_threshold=0.8) is None
+    assert cache.get_code_result("red cube spinning slowly", "", 0.2, similarity_threshold=0.8) is None
+
+
+def test_code_lookup_without_temperature(tmp_path, monkeypatch):
+    monkeypatch.setenv("CACHE_BACKEND", "memory")
+    monkeypatch.setattr(smart_cache, "create_sentence_encoder", WordHashEncoder)
+    cache = smart_cache.SmartCache(cache_dir=str(tmp_path))
+    cache.cache_code_result("red cube spinning slowly around", "", None, "// unset", quality_score=0.9)
+    assert cache.get_code_result("red cube spinning slowly", "", None, similarity_threshold=0.8)[0] == "// unset"
+    assert cache.get_code_result("red cube spinning slowly", "", 0.7, similarity_threshold=0.8) is None
@@ -0,0 +1,41 @@
+import time
+
+from rag.tiered_cache import UsageWriteBack
+
+
+class RecordingBackend:
+    def __init__(self):
+        self.written = {}
+
+    def record_usage(self, table, counts):
+        for key, count in counts.items():
+            self.written[(table, key)] = self.written.get((table, key), 0) + count
+
+
+def _wait_for(condition):
+    for _ in range(200):
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_write_back_survives_failing_on_flush():
+    calls = {"on_flush": 0}
+
+    def on_flush():
+        calls["on_flush"] += 1
+        if calls["on_flush"] == 1:
+            raise OSError("stats.json is read-only")
+
+    backend = RecordingBackend()
+    write_back = UsageWriteBack(backend, interval=0.01, on_flush=on_flush)
+    write_back.record("rag_cache", "a")
+    assert _wait_for(lambda: calls["on_flush"] >= 2)
+    assert write_back.stats["errors"] == 1
+
+    # The thread is still running after the failure
+    write_back.record("rag_cache", "b")
+    assert _wait_for(lambda: ("rag_cache", "b") in backend.written)
+    assert backend.written[("rag_cache", "a")] == 1
+    assert write_back._worker.is_alive()